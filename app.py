@@ -1,21 +1,38 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
 import sys
-import json
 
-# Ensure we can import services
+# Ensure we can import services (as services.*, like backend/main.py: one copy of each module and its singletons)
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
 
-from backend.services.data_engine import DataEngine
-from backend.services.ai_engine import AIEngine
+from services import metrics as prom
+from services.analysis import normalize_ticker, parse_chart_format, with_chart_format
+from services.compression import get_default_encoder
+from services.runtime import Engines
 
 app = Flask(__name__, static_folder='frontend', static_url_path='')
 CORS(app)
 
-# Initialize Engines
-data_engine = DataEngine()
-ai_engine = AIEngine()
+# Engines are built on first use (cold start); NUKIDA_EAGER_INIT / NUKIDA_WARMUP change that
+engines = Engines().start()
+encoder = get_default_encoder()
+
+@app.after_request
+def encode_response(response):
+    # gzip/brotli + ETag/304 for API JSON and frontend/ assets; SSE streams pass through untouched
+    if response.status_code != 200 or response.mimetype == 'text/event-stream' or 'Content-Encoding' in response.headers:
+        return response
+    response.direct_passthrough = False  # static files: read the file body
+    status, body, headers = encoder.encode(response.get_data(), response.mimetype,
+                                           request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'),
+                                           conditional=request.method in ('GET', 'HEAD'))
+    response.set_data(body)
+    response.headers.update(headers)
+    if status:
+        response.status_code = status
+        response.headers.pop('Content-Length', None)
+    return response
 
 @app.route('/')
 def index():
@@ -38,29 +55,154 @@ def analyze():
         if not api_key:
             return jsonify({"error": "Thiếu API Key. Vui lòng cấu hình trên Vercel Settings -> Environment Variables."}), 400
 
+        try:
+            chart_format = parse_chart_format(data.get('chartFormat'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Normalize Ticker
-        ticker = "".join(filter(str.isalnum, ticker)).upper()
+        ticker = normalize_ticker(ticker)
 
-        # Step 1: Get Hard Data
-        hard_data = data_engine.get_market_data(ticker)
-        
-        # Step 2: AI Analysis
-        ai_result = ai_engine.call_perplexity(ticker, api_key, hard_data)
-        
-        # Step 3: DATA MERGE
-        ai_result['financials'] = hard_data.get('financials', {})
-        ai_result['technicals'] = hard_data.get('technicals', {})
-        ai_result['chart_data'] = hard_data.get('history', [])
-        ai_result['current_price'] = hard_data.get('price')
-        ai_result['percent_change'] = hard_data.get('percent_change', '0%')
+        # Hard Data -> AI Analysis -> DATA MERGE (identical concurrent requests share one run)
+        return jsonify(engines.analyzer.analyze(ticker, api_key, chart_format))
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    data = request.json or {}
+    ticker = normalize_ticker(data.get('ticker'))
+    api_key = data.get('apiKey') or os.environ.get('PPLX_API_KEY')
+
+    if not ticker:
+        return jsonify({"error": "Thiếu mã cổ phiếu"}), 400
+
+    if not api_key:
+        return jsonify({"error": "Thiếu API Key. Vui lòng cấu hình trên Vercel Settings -> Environment Variables."}), 400
+
+    try:
+        chart_format = parse_chart_format(data.get('chartFormat'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Server-Sent Events: snapshot -> chart -> news -> AI tokens -> result
+    return Response(stream_with_context(engines.analyzer.stream(ticker, api_key, chart_format)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    try:
+        data = request.json or {}
+        tickers = data.get('tickers')
+        api_key = data.get('apiKey') or os.environ.get('PPLX_API_KEY')
+
+        if not tickers or not isinstance(tickers, list):
+            return jsonify({"error": "Thiếu danh sách mã cổ phiếu (tickers)"}), 400
+
+        if not api_key:
+            return jsonify({"error": "Thiếu API Key. Vui lòng cấu hình trên Vercel Settings -> Environment Variables."}), 400
+
+        if len(engines.batch_analyzer.dedupe(tickers)) > engines.batch_analyzer.max_tickers:
+            return jsonify({"error": f"Tối đa {engines.batch_analyzer.max_tickers} mã mỗi lần phân tích"}), 400
 
-        return jsonify(ai_result)
+        try:
+            chart_format = parse_chart_format(data.get('chartFormat'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
+        return jsonify(engines.batch_analyzer.analyze(tickers, api_key, chart_format))
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/scan', methods=['GET', 'POST'])
+def scan():
+    from services.scanner import parse_filters
+
+    params = request.args.to_dict() if request.method == 'GET' else (request.get_json(silent=True) or {})
+    try:
+        filters = parse_filters(params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Whole listed universe: bounded-concurrency history load + one vectorized indicator pass
+        return jsonify(engines.scanner.scan(filters))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/intraday', methods=['GET'])
+def intraday():
+    ticker = normalize_ticker(request.args.get('ticker'))
+    if not ticker:
+        return jsonify({"error": "Thiếu mã cổ phiếu"}), 400
+    try:
+        days = int(request.args['days']) if request.args.get('days') else None
+        chart_format = parse_chart_format(request.args.get('chartFormat'))
+        # Intraday bars + streaming technicals (only new / revised bars are applied)
+        result = engines.data_engine.get_intraday(ticker, request.args.get('resolution', '15m'), days)
+        return jsonify(with_chart_format(result, chart_format))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/highlights', methods=['GET'])
+def highlights():
+    # In-memory snapshot kept fresh in the background; never waits on CafeF/DChart after the first load
+    return jsonify(engines.highlights.get())
+
+@app.route('/api/prefetch', methods=['GET'])
+def prefetch_status():
+    # Lag / coverage of the trading-hours prefetch scheduler
+    return jsonify(engines.prefetcher.stats())
+
+@app.route('/api/prefetch/watchlist', methods=['POST'])
+def prefetch_watchlist():
+    data = request.get_json(silent=True) or {}
+    tickers = data.get('tickers')
+    if not isinstance(tickers, list):
+        return jsonify({"error": "Thiếu danh sách mã cổ phiếu (tickers)"}), 400
+    scheduled = engines.prefetcher.set_watchlist(data.get('id') or 'default', tickers)
+    return jsonify({"watchlist": data.get('id') or 'default', "scheduled_tickers": len(scheduled)})
+
+@app.route('/api/health/upstreams', methods=['GET'])
+def upstream_health():
+    # Circuit state, success rate, latency and error mix per upstream host
+    return jsonify(engines.data_engine.health.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Per-stage latency histograms + upstream latency / admission wait, Prometheus text format
+    return Response(prom.render(), content_type=prom.CONTENT_TYPE)
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "singleflight": engines.analyzer.stats(),
+        "cache": engines.data_engine.cache.stats() if engines.data_engine.cache else None,
+        "history": engines.data_engine.history_stats(),
+        "news": engines.data_engine.news.stats(),
+        "upstream_limits": engines.data_engine.limiter.stats(),
+        "ai_cache": engines.ai_engine.cache.stats() if engines.ai_engine.cache else None,
+        "ai_http": engines.ai_engine.http.stats(),
+        "ai_prompt": engines.ai_engine.prompt_stats(),
+        "highlights": engines.highlights.stats(),
+        "prefetch": engines.prefetcher.stats(),
+        "compression": encoder.stats(),
+        "startup": engines.status()
+    })
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,86 @@
+"""
+So sánh parser trang tổng quan CafeF: đường nhanh (regex) vs BeautifulSoup toàn trang.
+Đo CPU time (process_time) và bộ nhớ đỉnh (tracemalloc) trên các trang CafeF đã lưu.
+--check: chỉ kiểm tra đường nhanh cho cùng kết quả với BeautifulSoup (exit 1 nếu lệch) — dùng trang thật,
+fixtures/cafef_overview.html là trang tự viết (xem fixtures/SOURCES.json)
+
+    cd backend
+    python -m benchmarks.overview_parse saved/HPG.html saved/SSI.html [--repeat 50] [--check]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.data_engine import DataEngine
+
+
+def _empty():
+    return {"price": 0, "volume": 0, "financials": {}, "last_update": ""}
+
+
+def measure(fn, html_text, repeat):
+    """(cpu ms per parse, peak KiB of one parse, result)"""
+    result = fn(html_text, _empty())
+    started = time.process_time()
+    for _ in range(repeat):
+        fn(html_text, _empty())
+    cpu_ms = (time.process_time() - started) * 1000 / repeat
+
+    tracemalloc.start()
+    fn(html_text, _empty())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_ms, peak / 1024, result
+
+
+def differences(engine, html_text):
+    """Fields where the fast path disagrees with the BeautifulSoup parser: {field: (fast, soup)}"""
+    fast = engine._parse_overview_fast(html_text, _empty())
+    soup = engine._parse_overview_soup(html_text, _empty())
+    out = {k: (fast.get(k), soup.get(k)) for k in ("price", "volume") if fast.get(k) != soup.get(k)}
+    for k in sorted(set(fast["financials"]) | set(soup["financials"])):
+        if fast["financials"].get(k) != soup["financials"].get(k):
+            out[f"financials.{k}"] = (fast["financials"].get(k), soup["financials"].get(k))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="+", help="saved CafeF overview HTML files")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--check", action="store_true", help="only compare fast path and soup results")
+    args = parser.parse_args(argv)
+
+    engine = DataEngine(concurrent_fetch=False, cache=False)
+    if args.check:
+        failed = 0
+        for page in args.pages:
+            with open(page, encoding="utf-8", errors="replace") as f:
+                diff = differences(engine, f.read())
+            failed += bool(diff)
+            print(f"{os.path.basename(page)}: {'OK' if not diff else diff}")
+        return 1 if failed else 0
+
+    paths = {
+        "soup (legacy)": engine._parse_overview_soup,
+        "fast": engine._parse_overview_fast,
+        "auto": engine._parse_overview,
+    }
+    for page in args.pages:
+        with open(page, encoding="utf-8", errors="replace") as f:
+            html_text = f.read()
+        print(f"{os.path.basename(page)} ({len(html_text) / 1024:.0f} KiB)")
+        baseline = None
+        for name, fn in paths.items():
+            cpu_ms, peak_kib, result = measure(fn, html_text, args.repeat)
+            baseline = baseline or cpu_ms
+            print(f"  {name:<14} cpu={cpu_ms:8.2f} ms  peak={peak_kib:9.0f} KiB  "
+                  f"x{baseline / cpu_ms:5.1f}  price={result['price']} fin={result['financials']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
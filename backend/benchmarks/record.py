@@ -0,0 +1,81 @@
+"""
+Ghi lại fixtures cho benchmarks.run từ upstream thật (CafeF, VNDirect DChart, VNDirect finfo, SSI iBoard).
+Cần mạng. perplexity_completion.json không được ghi lại (cần API key) — giữ bản trong repo.
+Mỗi file ghi được đánh dấu "recorded" trong fixtures/SOURCES.json; trang tổng quan vừa ghi được dùng để
+kiểm tra đường parse nhanh so với BeautifulSoup.
+
+    cd backend
+    python -m benchmarks.record HPG [--days 90]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.overview_parse import differences
+from services.data_engine import DataEngine
+from services.vnstock_lite import VNStockLite
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SOURCES = os.path.join(FIXTURES, "SOURCES.json")
+
+
+def save(name, text, url):
+    path = os.path.join(FIXTURES, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    with open(SOURCES, encoding="utf-8") as f:
+        sources = json.load(f)
+    sources[name] = {"origin": "recorded", "url": url, "recorded_at": time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(SOURCES, "w", encoding="utf-8") as f:
+        json.dump(sources, f, indent=4, ensure_ascii=False)
+    print(f"[Record] {name}: {len(text) / 1024:.1f} KiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ticker", nargs="?", default="HPG")
+    parser.add_argument("--days", type=int, default=90)
+    args = parser.parse_args(argv)
+    ticker = args.ticker.upper()
+
+    engine = DataEngine(concurrent_fetch=False, cache=False)
+    r = engine.session.get(engine._find_cafef_url(ticker), timeout=10)
+    r.raise_for_status()
+    save("cafef_overview.html", r.text, r.url)
+    # The fast overview parser was written against a hand-made page: hold it to the real one
+    diff = differences(engine, r.text)
+    print("[Record] Overview fast path matches BeautifulSoup" if not diff
+          else f"[Record] WARNING: overview fast path differs from BeautifulSoup: {diff}")
+
+    r = engine.session.get(f"https://s.cafef.vn/tin-doanh-nghiep/{ticker}/tin-moi-nhat.chn", timeout=10)
+    r.raise_for_status()
+    save("cafef_news.html", r.text, r.url)
+
+    lite = VNStockLite(store=False)
+    end = int(time.time())
+    r = lite.session.get("https://dchart-api.vndirect.com.vn/dchart/history", timeout=10, params={
+        "resolution": "D", "symbol": ticker, "from": end - args.days * 86400, "to": end
+    }, headers={'Referer': 'https://dchart.vndirect.com.vn/'})
+    r.raise_for_status()
+    save(f"dchart_{ticker.lower()}.json", json.dumps(r.json()), r.url)
+
+    # History fallbacks (same URLs as DataEngine._history_finfo / _history_ssi)
+    r = engine.session.get(f"https://finfo-api.vndirect.com.vn/v4/stock_prices?query=code:{ticker}&size=100&sort=date:desc",
+                           timeout=10)
+    r.raise_for_status()
+    save(f"finfo_{ticker.lower()}.json", json.dumps(r.json()), r.url)
+
+    r = engine.session.get(f"https://iboard-query.ssi.com.vn/stock/second/history/{ticker}/1M", timeout=10)
+    r.raise_for_status()
+    save(f"ssi_{ticker.lower()}.json", json.dumps(r.json()), r.url)
+    if ticker != "HPG":
+        print(f"[Record] Note: benchmarks.run reads the *_hpg.json fixtures")
+    return 1 if diff else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
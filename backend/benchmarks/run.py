@@ -0,0 +1,295 @@
+"""
+Offline micro-benchmarks cho các đường nóng: scrape, parse, chuyển đổi bars, chỉ báo,
+repair_json và serialize response. Không cần mạng: upstream được phát lại từ fixtures/.
+
+    cd backend
+    python -m benchmarks.run                          # bảng kết quả
+    python -m benchmarks.run --json out.json          # kết quả dạng máy đọc (so sánh giữa các commit)
+    python -m benchmarks.run --compare base.json      # báo hồi quy so với lần chạy trước
+    python -m benchmarks.run --filter technicals      # chỉ chạy các case có tên chứa chuỗi này
+
+Ghi lại fixtures từ upstream thật: python -m benchmarks.record HPG
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Replayed upstreams: measure the code, not the per-host pacing (upstream_admit covers the limiter itself)
+os.environ.setdefault('NUKIDA_UPSTREAM_LIMITS', '0')
+
+from services.ai_engine import AIEngine
+from services.analysis import merge_result, safe_serialize
+from services.compression import ResponseEncoder
+from services.data_engine import DataEngine
+from services.indicator_state import TechnicalsState
+from services.metrics import stage_timer
+from services.news_store import NewsCrawler, NewsStore
+from services.ratelimit import UpstreamLimiter
+from services.scanner import MarketScanner, parse_filters
+from services.vnstock_lite import VNStockLite
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_sources():
+    """{fixture: {origin, ...}}; origin is recorded (benchmarks.record), synthetic (hand-written) or derived"""
+    with open(os.path.join(FIXTURES, "SOURCES.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class ReplayResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplaySession:
+    """Stands in for requests.Session: every GET returns the same recorded body"""
+
+    def __init__(self, body):
+        self.body = body
+        self.headers = {}
+        self.verify = False
+
+    def get(self, url, **kwargs):
+        return ReplayResponse(self.body)
+
+
+def synthetic_dchart(bars, step, seed=1):
+    """DChart-shaped payload with `bars` bars spaced `step` seconds apart (prices in thousand VND)"""
+    rng = np.random.default_rng(seed)
+    close = 25.0 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    spread = np.abs(rng.normal(0, 0.005, bars)) * close
+    t0 = 1262304000  # 2010-01-01
+    return json.dumps({
+        "t": (t0 + np.arange(bars) * step).tolist(),
+        "o": np.round(close - spread / 2, 2).tolist(),
+        "h": np.round(close + spread, 2).tolist(),
+        "l": np.round(close - spread, 2).tolist(),
+        "c": np.round(close, 2).tolist(),
+        "v": rng.integers(10_000, 5_000_000, bars).astype(float).tolist(),
+        "s": "ok"
+    })
+
+
+def build_cases():
+    """[(name, size label, callable)] — each callable does one unit of work"""
+    engine = DataEngine(concurrent_fetch=False, cache=False)
+    ai = AIEngine(cache=False)
+    lite = VNStockLite(store=False)
+
+    overview = fixture("cafef_overview.html")
+    overview_large = overview.replace("<div id=\"footer\">", "<div class=\"filler\">" + ("<p>lorem ipsum</p>" * 20000) + "</div><div id=\"footer\">")
+    news = fixture("cafef_news.html")
+    dchart = {
+        "90d": fixture("dchart_hpg.json"),
+        "10y_daily": synthetic_dchart(2500, 86400),
+        "1m_1y": synthetic_dchart(250 * 270, 60),
+    }
+    completion = json.loads(fixture("perplexity_completion.json"))["choices"][0]["message"]["content"]
+
+    def scrape(body):
+        def run():
+            engine.session = ReplaySession(body)
+            return engine._scrape_overview("https://s.cafef.vn/hose/HPG-1.chn")
+        return run
+
+    def scrape_soup(body):
+        return lambda: engine._parse_overview_soup(body, {"price": 0, "volume": 0, "financials": {}, "last_update": ""})
+
+    def ticker_news(body, warm=False):
+        """Cold: empty store, every item parsed. Warm: page unchanged, parsing stops after a run of known items."""
+        crawler = NewsCrawler(ReplaySession(body), store=NewsStore(":memory:"), ttl=0)
+
+        def run():
+            if not warm:
+                crawler.store = NewsStore(":memory:")
+            engine.news = crawler
+            return engine._get_ticker_news("HPG")
+        return run
+
+    def to_bars(body):
+        def run():
+            lite.session = ReplaySession(body)
+            return lite._fetch_dchart("HPG", "1D", 0, 2_000_000_000)
+        return run
+
+    def fallback_to_bars(source, body):
+        def run():
+            engine.session = ReplaySession(body)
+            return getattr(engine, f"_history_{source}")("HPG")
+        return run
+
+    series = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for label, body in dchart.items():
+            series[label] = to_bars(body)()
+
+    hard_data = {"price": 26800.0, "financials": {"EPS": "2,345"}, "technicals": {}, "history": series["10y_daily"]}
+
+    def serialize(chart_format=None):
+        def run():
+            result = merge_result(json.loads(json.dumps({"ticker": "HPG", "layers": []})), hard_data, chart_format)
+            return json.dumps(safe_serialize(result))
+        return run
+
+    # Scraped headlines repeated 3x: exercises dedupe, recency sort and the news token budget
+    with contextlib.redirect_stdout(io.StringIO()):
+        prompt_news = ticker_news(news)() * 3
+    encoder = ResponseEncoder(cache_bytes=0)
+    payload = serialize()().encode()
+
+    limiter = UpstreamLimiter(rates="*=1e9:1e9", concurrency="*=64")
+    limiter.enabled = True
+
+    def admit():
+        with limiter.admit("s.cafef.vn"):
+            pass
+
+    def timed_stage():
+        with stage_timer("benchmark", "noop"):
+            pass
+
+    cases = [
+        ("scrape_overview", "fixture", scrape(overview)),
+        ("scrape_overview", "large", scrape(overview_large)),
+        ("scrape_overview_soup", "fixture", scrape_soup(overview)),
+        ("get_ticker_news", "fixture", ticker_news(news)),
+        ("get_ticker_news_incremental", "fixture", ticker_news(news, warm=True)),
+        ("repair_json", "fixture", lambda: ai.repair_json(completion)),
+        ("repair_json", "x20", lambda: ai.repair_json(completion * 20)),
+        ("parse_completion", "fixture", lambda: ai._parse_content("HPG", completion)),
+        ("build_prompt", "news_x3", lambda: ai.prompts.build("HPG", ai.prompt_fields(hard_data), prompt_news)),
+        ("response_serialize", "10y_daily", serialize()),
+        ("response_serialize_compact", "10y_daily", serialize("compact")),
+        ("response_gzip", "10y_daily", lambda: encoder.encode(payload, "application/json", "gzip")),
+        ("upstream_admit", "uncontended", admit),
+        ("stage_timer", "noop", timed_stage),
+    ]
+    for source in ("finfo", "ssi"):
+        cases.append((f"{source}_to_bars", "fixture", fallback_to_bars(source, fixture(f"{source}_hpg.json"))))
+    for label, body in dchart.items():
+        cases.append(("dchart_to_bars", label, to_bars(body)))
+        cases.append(("bars_to_records", label, series[label].to_records))
+        cases.append(("calculate_technicals", label, lambda s=series[label]: engine._calculate_technicals(s)))
+    # Intraday refresh: streaming state revises the running bar vs a full recompute over 1y of 1m bars
+    intraday = series["1m_1y"]
+    state = TechnicalsState.from_series(intraday)
+    last = next(iter(intraday.tail(1).rows()))
+    cases.append(("technicals_state_update", "1m_1y", lambda: (state.update(*last), state.technicals())))
+    cases.append(("technicals_state_seed", "1m_1y", lambda: TechnicalsState.from_series(intraday)))
+    watchlist = [series["10y_daily"].tail(250)] * 50
+    cases.append(("calculate_technicals_batch", "50x250", lambda: engine.calculate_technicals_batch(watchlist)))
+
+    # Scanner compute stage over a full-market-sized universe (histories already loaded)
+    scanner = MarketScanner(vnstock=VNStockLite(store=False))
+    universe = {f"S{i:04d}": series["10y_daily"].tail(62 + i % 5) for i in range(1600)}
+    symbols = sorted(universe)
+    filters = parse_filters({"signal": "MUA"})
+    cases.append(("scan_evaluate", "1600x62", lambda: scanner._evaluate(symbols, universe, {}, filters)))
+    return cases
+
+
+def time_case(fn, min_time=0.2, max_runs=200):
+    """Per-run wall times in ms; repeats until `min_time` seconds or `max_runs` runs"""
+    times = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()  # warm-up
+        while len(times) < max_runs and (time.perf_counter() - started < min_time or len(times) < 3):
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="previous --json output to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median ratio reported as a regression")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent per case")
+    args = parser.parse_args(argv)
+
+    sources = fixture_sources()
+    unrecorded = sorted(name for name, src in sources.items() if src.get("origin") != "recorded")
+    if unrecorded:
+        # Timings on these reflect pages shaped like the parsers expect, not what upstream serves
+        print(f"[Bench] Not recorded from upstream (see fixtures/SOURCES.json): {', '.join(unrecorded)}")
+
+    results = []
+    for name, size, fn in build_cases():
+        if args.filter not in name:
+            continue
+        times = time_case(fn, min_time=args.min_time)
+        results.append({
+            "name": name,
+            "size": size,
+            "runs": len(times),
+            "min_ms": round(min(times), 4),
+            "median_ms": round(statistics.median(times), 4),
+            "mean_ms": round(statistics.fmean(times), 4)
+        })
+        print(f"{name:<28} {size:<10} median={results[-1]['median_ms']:10.3f} ms  min={results[-1]['min_ms']:10.3f} ms  runs={len(times)}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "timestamp": int(time.time()),
+            "fixtures": {name: src.get("origin") for name, src in sources.items()}
+        },
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            base = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+        print(f"\nvs {args.compare}:")
+        for r in results:
+            b = base.get((r["name"], r["size"]))
+            if not b:
+                continue
+            ratio = r["median_ms"] / b["median_ms"] if b["median_ms"] else float("inf")
+            flag = "REGRESSION" if ratio > args.threshold else ""
+            regressions += bool(flag)
+            print(f"  {r['name']:<28} {r['size']:<10} x{ratio:6.2f} {flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
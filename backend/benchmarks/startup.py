@@ -0,0 +1,146 @@
+"""
+Đo cold start của app.py (Vercel / gunicorn): thời gian import và time-to-first-response,
+mỗi lần đo là một process Python mới.
+
+    cd backend
+    python -m benchmarks.startup                       # lazy (mặc định) vs eager
+    python -m benchmarks.startup --modes lazy,eager,warmup --runs 5 --json startup.json
+    python -m benchmarks.startup --importtime 15       # các module import chậm nhất
+
+Mode: lazy = mặc định, eager = NUKIDA_EAGER_INIT=1, warmup = NUKIDA_WARMUP=1 (cần mạng)
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = {
+    "lazy": {},
+    "eager": {"NUKIDA_EAGER_INIT": "1"},
+    "warmup": {"NUKIDA_WARMUP": "1"},
+}
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def _env(mode):
+    env = dict(os.environ)
+    env.update(MODES[mode])
+    return env
+
+
+def import_time(mode):
+    """Seconds spent in `import app` in a fresh interpreter"""
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=_env(mode),
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as r:
+        r.read()
+    return time.perf_counter() - started
+
+
+def first_response(mode, api_path, timeout=30):
+    """
+    Spawn `python app.py` and return (seconds until the first response on /, seconds for the first
+    `api_path` request, which pays for any engine construction still outstanding).
+    """
+    port = _free_port()
+    env = _env(mode)
+    env["PORT"] = str(port)
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"app.py exited with code {proc.returncode}")
+            try:
+                _get(f"http://127.0.0.1:{port}/")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("app.py did not answer in time")
+                time.sleep(0.005)
+        ready = time.perf_counter() - started
+        api = _get(f"http://127.0.0.1:{port}{api_path}")
+        return ready, api
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def slowest_imports(limit):
+    """Top modules by cumulative import time (python -X importtime)"""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                         env=_env("lazy"), capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def _summary(values):
+    return {"median_ms": round(statistics.median(values) * 1000, 1), "min_ms": round(min(values) * 1000, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="lazy,eager")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--api-path", default="/api/health/upstreams",
+                        help="first API request to time (should not need the network)")
+    parser.add_argument("--importtime", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for mode in args.modes.split(","):
+        imports, ready, api = [], [], []
+        for _ in range(args.runs):
+            imports.append(import_time(mode))
+            r, a = first_response(mode, args.api_path)
+            ready.append(r)
+            api.append(a)
+        report[mode] = {
+            "import": _summary(imports),
+            "first_response": _summary(ready),
+            "first_api_request": _summary(api),
+            "first_api_total": _summary([r + a for r, a in zip(ready, api)])
+        }
+        m = report[mode]
+        print(f"{mode:<7} import={m['import']['median_ms']:7.1f} ms  first response={m['first_response']['median_ms']:7.1f} ms  "
+              f"first {args.api_path}={m['first_api_request']['median_ms']:7.1f} ms  (spawn->api {m['first_api_total']['median_ms']:.1f} ms)")
+
+    if args.importtime:
+        print("\nslowest imports (cumulative):")
+        for us, name in slowest_imports(args.importtime):
+            print(f"  {us / 1000:8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
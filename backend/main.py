@@ -1,114 +1,381 @@
 import http.server
-import socketserver
+import signal
+import threading
 import webbrowser
 import os
 import json
+import select
 import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
 
 # Ensure we can import services
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from services.data_engine import DataEngine
-from services.ai_engine import AIEngine
+from services.analysis import normalize_ticker, parse_chart_format, safe_serialize, with_chart_format
+from services.compression import get_default_encoder
+from services.http_server import WorkerPoolHTTPServer
+from services import metrics as prom
+from services.runtime import Engines
 
-PORT = 8080
+PORT = int(os.environ.get('NUKIDA_PORT', 8080))
+MAX_BODY_BYTES = int(os.environ.get('NUKIDA_MAX_BODY_BYTES', 1024 * 1024))
 FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../frontend')
 
-# Initialize Engines
-data_engine = DataEngine()
-ai_engine = AIEngine()
+# Engines are built on first use (cold start); NUKIDA_EAGER_INIT / NUKIDA_WARMUP change that
+engines = Engines().start()
+encoder = get_default_encoder()
 
 class NukidaHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep-alive: every response carries Content-Length or closes the connection
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections give their worker back after this many seconds,
+    # or at the next poll once connections are queueing for a worker
+    timeout = float(os.environ.get('NUKIDA_KEEPALIVE_TIMEOUT', 5))
+    idle_poll = 0.25
+
     def __init__(self, *args, **kwargs):
         # Serve frontend files by default
         super().__init__(*args, directory=FRONTEND_DIR, **kwargs)
 
     def do_POST(self):
         if self.path == '/api/analyze':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
+            self._handle_analyze()
+        elif self.path == '/api/analyze/batch':
+            self._handle_batch()
+        elif self.path == '/api/analyze/stream':
+            self._handle_stream()
+        elif self.path == '/api/prefetch/watchlist':
+            self._handle_watchlist()
+        elif self.path == '/api/scan':
             try:
-                request_data = json.loads(post_data.decode('utf-8'))
-                ticker = request_data.get('ticker')
-                api_key = request_data.get('apiKey') or os.environ.get('PPLX_API_KEY')
-                
-                if not ticker:
-                    self._send_response(400, {"error": "Thiếu mã cổ phiếu"})
-                    return
-                
-                if not api_key:
-                    self._send_response(400, {"error": "Thiếu API Key. Vui lòng cấu hình PPLX_API_KEY trong môi trường."})
-                    return
-
-                # Normalize Ticker
-                ticker = filter(str.isalnum, ticker)
-                ticker = "".join(ticker).upper()
-
-                # Step 1: Get Hard Data (Price, VNStock, News)
-                print(f"[Nukida] Fetching Data for {ticker}...")
-                hard_data = data_engine.get_market_data(ticker)
-                
-                # Step 2: AI Analysis (Nukida Strategy)
-                print(f"[Nukida] Ultra-Deep Analysis with AI...")
-                ai_result = ai_engine.call_perplexity(ticker, api_key, hard_data)
-                
-                # Step 3: DATA MERGE (Fix N/A Issue)
-                # We must attach the raw metrics so the Frontend can display them in the Fast Metrics grid
-                ai_result['financials'] = hard_data.get('financials', {})
-                ai_result['technicals'] = hard_data.get('technicals', {})
-                ai_result['chart_data'] = hard_data.get('history', [])
-                ai_result['current_price'] = hard_data.get('price')
-                ai_result['percent_change'] = hard_data.get('percent_change', '0%')
-
-                # SAFE SERIALIZATION
-                # Ensure no NaN or Inf which breaks JSON.parse in frontend
-                def safe_serialize(obj):
-                    if isinstance(obj, float):
-                        if obj != obj: return None # NaN
-                        if obj == float('inf') or obj == float('-inf'): return None
-                    elif isinstance(obj, dict):
-                        return {k: safe_serialize(v) for k, v in obj.items()}
-                    elif isinstance(obj, list):
-                        return [safe_serialize(x) for x in obj]
-                    return obj
-
-                response_data = safe_serialize(ai_result)
-                self._send_response(200, response_data)
-
+                params = self._read_json()
             except Exception as e:
-                import traceback
-                traceback.print_exc()
-                self._send_response(500, {"error": str(e)})
+                self._send_response(400, {"error": str(e)})
+                return
+            self._handle_scan(params)
         else:
+            # The body was not read: the connection cannot carry another request
+            self.close_connection = True
             self.send_error(404)
 
-    def _send_response(self, code, data):
-        self.send_response(code)
-        self.send_header('Content-type', 'application/json')
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/api/scan':
+            self._handle_scan(dict(parse_qsl(url.query)))
+        elif url.path == '/api/intraday':
+            self._handle_intraday(dict(parse_qsl(url.query)))
+        elif url.path == '/api/prefetch':
+            self._send_response(200, engines.prefetcher.stats())
+        elif url.path == '/api/highlights':
+            self._send_response(200, safe_serialize(engines.highlights.get()))
+        elif url.path == '/metrics':
+            self._send_bytes(200, prom.render().encode('utf-8'), prom.CONTENT_TYPE)
+        elif url.path == '/api/health/upstreams':
+            self._send_response(200, engines.data_engine.health.snapshot())
+        elif url.path == '/api/stats':
+            self._send_response(200, {
+                "singleflight": engines.analyzer.stats(),
+                "cache": engines.data_engine.cache.stats() if engines.data_engine.cache else None,
+                "history": engines.data_engine.history_stats(),
+                "news": engines.data_engine.news.stats(),
+                "upstream_limits": engines.data_engine.limiter.stats(),
+                "ai_cache": engines.ai_engine.cache.stats() if engines.ai_engine.cache else None,
+                "ai_http": engines.ai_engine.http.stats(),
+                "ai_prompt": engines.ai_engine.prompt_stats(),
+                "highlights": engines.highlights.stats(),
+                "prefetch": engines.prefetcher.stats(),
+                "compression": encoder.stats(),
+                "server": self.server.stats(),
+                "startup": engines.status()
+            })
+        else:
+            self._serve_static()
+
+    def _read_json(self):
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if content_length > MAX_BODY_BYTES:
+            self.close_connection = True
+            raise ValueError(f"Request body too large ({content_length} > {MAX_BODY_BYTES} bytes)")
+        post_data = self.rfile.read(content_length)
+        return json.loads(post_data.decode('utf-8'))
+
+    def _handle_analyze(self):
+        try:
+            request_data = self._read_json()
+            ticker = request_data.get('ticker')
+            api_key = request_data.get('apiKey') or os.environ.get('PPLX_API_KEY')
+            
+            if not ticker:
+                self._send_response(400, {"error": "Thiếu mã cổ phiếu"})
+                return
+            
+            if not api_key:
+                self._send_response(400, {"error": "Thiếu API Key. Vui lòng cấu hình PPLX_API_KEY trong môi trường."})
+                return
+
+            try:
+                chart_format = parse_chart_format(request_data.get('chartFormat'))
+            except ValueError as e:
+                self._send_response(400, {"error": str(e)})
+                return
+
+            # Normalize Ticker
+            ticker = normalize_ticker(ticker)
+
+            # Hard Data (Price, VNStock, News) -> AI Analysis (Nukida Strategy) -> DATA MERGE
+            # Identical concurrent requests wait on one shared run
+            print(f"[Nukida] Ultra-Deep Analysis for {ticker}...")
+            ai_result = engines.analyzer.analyze(ticker, api_key, chart_format)
+
+            self._send_response(200, safe_serialize(ai_result))
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._send_response(500, {"error": str(e)})
+
+    def _handle_stream(self):
+        try:
+            request_data = self._read_json()
+        except Exception as e:
+            self._send_response(400, {"error": str(e)})
+            return
+        ticker = normalize_ticker(request_data.get('ticker'))
+        api_key = request_data.get('apiKey') or os.environ.get('PPLX_API_KEY')
+
+        if not ticker:
+            self._send_response(400, {"error": "Thiếu mã cổ phiếu"})
+            return
+
+        if not api_key:
+            self._send_response(400, {"error": "Thiếu API Key. Vui lòng cấu hình PPLX_API_KEY trong môi trường."})
+            return
+
+        try:
+            chart_format = parse_chart_format(request_data.get('chartFormat'))
+        except ValueError as e:
+            self._send_response(400, {"error": str(e)})
+            return
+
+        # Each stream holds a worker for the whole LLM call
+        if not self.server.open_stream():
+            self._send_response(503, {"error": "Quá nhiều phiên phân tích đang chạy, vui lòng thử lại sau."},
+                                headers={'Retry-After': str(self.server.retry_after)})
+            return
+        try:
+            self._stream(ticker, api_key, chart_format)
+        finally:
+            self.server.close_stream()
+
+    def _stream(self, ticker, api_key, chart_format):
+        print(f"[Nukida] Streaming analysis for {ticker}...")
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # No Content-Length for a stream: it ends when the connection does
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for frame in engines.analyzer.stream(ticker, api_key, chart_format):
+                self.wfile.write(frame.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"[Nukida] Client left stream for {ticker}")
+
+    def _handle_batch(self):
+        try:
+            request_data = self._read_json()
+            tickers = request_data.get('tickers')
+            api_key = request_data.get('apiKey') or os.environ.get('PPLX_API_KEY')
+
+            if not tickers or not isinstance(tickers, list):
+                self._send_response(400, {"error": "Thiếu danh sách mã cổ phiếu (tickers)"})
+                return
+
+            if not api_key:
+                self._send_response(400, {"error": "Thiếu API Key. Vui lòng cấu hình PPLX_API_KEY trong môi trường."})
+                return
+
+            if len(engines.batch_analyzer.dedupe(tickers)) > engines.batch_analyzer.max_tickers:
+                self._send_response(400, {"error": f"Tối đa {engines.batch_analyzer.max_tickers} mã mỗi lần phân tích"})
+                return
+
+            try:
+                chart_format = parse_chart_format(request_data.get('chartFormat'))
+            except ValueError as e:
+                self._send_response(400, {"error": str(e)})
+                return
+
+            print(f"[Nukida] Batch analysis for {len(tickers)} tickers...")
+            self._send_response(200, safe_serialize(engines.batch_analyzer.analyze(tickers, api_key, chart_format)))
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._send_response(500, {"error": str(e)})
+
+    def _handle_watchlist(self):
+        try:
+            request_data = self._read_json()
+        except Exception as e:
+            self._send_response(400, {"error": str(e)})
+            return
+        tickers = request_data.get('tickers')
+        if not isinstance(tickers, list):
+            self._send_response(400, {"error": "Thiếu danh sách mã cổ phiếu (tickers)"})
+            return
+        watchlist_id = request_data.get('id') or 'default'
+        scheduled = engines.prefetcher.set_watchlist(watchlist_id, tickers)
+        self._send_response(200, {"watchlist": watchlist_id, "scheduled_tickers": len(scheduled)})
+
+    def _handle_intraday(self, params):
+        ticker = normalize_ticker(params.get('ticker'))
+        if not ticker:
+            self._send_response(400, {"error": "Thiếu mã cổ phiếu"})
+            return
+        try:
+            days = int(params['days']) if params.get('days') else None
+            chart_format = parse_chart_format(params.get('chartFormat'))
+            result = engines.data_engine.get_intraday(ticker, params.get('resolution', '15m'), days)
+        except ValueError as e:
+            self._send_response(400, {"error": str(e)})
+            return
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._send_response(500, {"error": str(e)})
+            return
+        self._send_response(200, safe_serialize(with_chart_format(result, chart_format)))
+
+    def _handle_scan(self, params):
+        from services.scanner import parse_filters
+
+        try:
+            filters = parse_filters(params)
+        except ValueError as e:
+            self._send_response(400, {"error": str(e)})
+            return
+        try:
+            print(f"[Nukida] Market scan ({', '.join(filters['exchanges'])})...")
+            self._send_response(200, safe_serialize(engines.scanner.scan(filters)))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._send_response(500, {"error": str(e)})
+
+    def _send_response(self, code, data, headers=None):
+        self._send_bytes(code, json.dumps(data).encode('utf-8'), 'application/json', headers)
+
+    def _send_bytes(self, code, body, content_type, extra_headers=None):
+        """gzip/brotli per Accept-Encoding; successful GETs carry an ETag and may be answered with 304"""
+        status, body, headers = encoder.encode(
+            body, content_type, self.headers.get('Accept-Encoding'), self.headers.get('If-None-Match'),
+            conditional=code == 200 and self.command in ('GET', 'HEAD'))
+        self.send_response(status or code)
+        self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _serve_static(self):
+        """frontend/ files through the same compression + ETag path; anything else (404, listings) as before"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            super().do_GET()
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        self._send_bytes(200, body, self.guess_type(path))
 
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header("Access-Control-Allow-Headers", "X-Requested-With, Content-Type")
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-def start_server():
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._await_next_request():
+            self.handle_one_request()
+
+    def _await_next_request(self):
+        """
+        Wait for the next request on a keep-alive connection in idle_poll slices. False (close it) after
+        `timeout`, or as soon as connections are queueing for a worker.
+        """
+        sock = self.connection
+        deadline = time.monotonic() + self.timeout
+        try:
+            # A pipelined request may already sit in rfile's buffer, where select() cannot see it
+            sock.settimeout(0)
+            if self.rfile.peek(1):
+                return True
+            while True:
+                if select.select([sock], [], [], self.idle_poll)[0]:
+                    return True
+                if self.server.saturated() or time.monotonic() >= deadline:
+                    return False
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.settimeout(self.timeout)
+            except OSError:
+                pass
+
+    def end_headers(self):
+        # Hand the worker back instead of holding a keep-alive connection while others queue
+        if not self.close_connection and self.server.saturated():
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def log_error(self, format, *args):
+        # An idle keep-alive connection reaching its timeout is normal, not an error
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
+
+def start_server(headless=None):
+    """Fixed worker pool + bounded queue (NUKIDA_WORKERS / NUKIDA_QUEUE_DEPTH); headless skips the browser"""
     # Change to backend dir to ensure imports work if run from there
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    
-    with socketserver.ThreadingTCPServer(("", PORT), NukidaHandler) as httpd:
-        print(f"NUKIDA TRADING APP RUNNING: http://localhost:{PORT}")
+    if headless is None:
+        headless = '--headless' in sys.argv or os.environ.get('NUKIDA_HEADLESS', '0') == '1'
+
+    httpd = WorkerPoolHTTPServer((os.environ.get('NUKIDA_HOST', ''), PORT), NukidaHandler)
+
+    def request_shutdown(signum, frame):
+        # serve_forever runs in this thread: shutdown() has to come from another one
+        threading.Thread(target=httpd.shutdown, name="Shutdown", daemon=True).start()
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    print(f"NUKIDA TRADING APP RUNNING: http://localhost:{PORT} "
+          f"({httpd.workers} workers, queue {httpd.queue_depth}{', headless' if headless else ''})")
+    if not headless:
         webbrowser.open(f"http://localhost:{PORT}")
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            httpd.server_close()
-            print("Server stopped.")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Shutting down: finishing in-flight requests...")
+    engines.stop()
+    httpd.drain()
+    httpd.server_close()
+    print("Server stopped.")
 
 if __name__ == "__main__":
     start_server()
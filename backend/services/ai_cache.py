@@ -0,0 +1,101 @@
+"""
+Content-addressed cache for Perplexity analyses
+Khóa = SHA-256 của input prompt đã chuẩn hóa (mã, các trường dữ liệu, tin tức).
+Input giống nhau -> dùng lại kết quả, không gọi lại sonar-pro.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+from services import market_calendar
+from services.cache import MISSING, TTLCache
+
+
+def prompt_key(ticker, fields, news, variant=None):
+    """Stable hash of the normalized prompt inputs (`variant`: e.g. the prompt schema mode)"""
+    payload = json.dumps({
+        "ticker": ticker.upper(),
+        "variant": variant,
+        "fields": {k: ("N/A" if v is None else str(v)).strip() for k, v in fields.items()},
+        "news": [" ".join(str(n).split()) for n in news or []]
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    LRU + TTL cache of parsed AI results, optionally persisted as one JSON file per key
+    (NUKIDA_AI_CACHE_DIR) so results survive restarts.
+    """
+
+    def __init__(self, max_entries=None, session_ttl=None, persist_dir=None):
+        env = os.environ.get
+        self.session_ttl = session_ttl or int(env('NUKIDA_AI_CACHE_TTL', 900))
+        self.store = TTLCache(max_bytes=32 * 1024 * 1024,
+                              max_entries=max_entries or int(env('NUKIDA_AI_CACHE_SIZE', 500)))
+        self.persist_dir = persist_dir if persist_dir is not None else env('NUKIDA_AI_CACHE_DIR')
+        if self.persist_dir:
+            try:
+                os.makedirs(self.persist_dir, exist_ok=True)
+            except OSError as e:
+                print(f"[AICache] Persistence disabled ({self.persist_dir}): {e}")
+                self.persist_dir = None
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+
+    def ttl(self):
+        """Short while the market moves; outside the session inputs are frozen until the next open"""
+        if market_calendar.is_trading_hours():
+            return self.session_ttl
+        return max(market_calendar.seconds_until_next_open(), self.session_ttl)
+
+    def get(self, key):
+        value = self.store.get(key)
+        if value is MISSING and self.persist_dir:
+            value = self._load(key)
+        return MISSING if value is MISSING else copy.deepcopy(value)
+
+    def put(self, key, result):
+        ttl = self.ttl()
+        self.store.put(key, copy.deepcopy(result), ttl)
+        if self.persist_dir:
+            self._save(key, result, time.time() + ttl)
+
+    def _path(self, key):
+        return os.path.join(self.persist_dir, f"{key}.json")
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return MISSING
+        remaining = entry.get("expires_at", 0) - time.time()
+        if remaining <= 0:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return MISSING
+        with self._lock:
+            self.disk_hits += 1
+        self.store.put(key, entry["result"], remaining)
+        return entry["result"]
+
+    def _save(self, key, result, expires_at):
+        tmp = self._path(key) + ".tmp"
+        try:
+            with open(tmp, "w", encoding='utf-8') as f:
+                json.dump({"expires_at": expires_at, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[AICache] Persist failed for {key[:12]}: {e}")
+
+    def stats(self):
+        stats = self.store.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["persistent"] = bool(self.persist_dir)
+        return stats
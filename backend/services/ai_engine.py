@@ -1,137 +1,238 @@
 import json
-import urllib.request
-import urllib.error
 import os
 import re
+import threading
+import time
+
+from services.ai_cache import AnalysisCache, prompt_key
+from services.cache import MISSING
+from services.http_client import PooledClient
+from services.metrics import AI_TOKENS, observe_stage, stage_timer
+from services.prompts import EXPECTED_OUTPUT_TOKENS, PromptBuilder, estimate_tokens
+from services.ratelimit import get_default_limiter
+
+PPLX_URL = "https://api.perplexity.ai/chat/completions"
 
 class AIEngine:
-    def call_perplexity(self, ticker, api_key, hard_data):
-        url = "https://api.perplexity.ai/chat/completions"
-        
-        # Format Hard Data for Prompt
+    def __init__(self, cache=None, http=None, prompts=None, limiter=None):
+        # Keep-alive pooled client: no TLS handshake per call, bounded timeouts, retries on 429/5xx,
+        # admission through the shared per-host limiter (waits up to NUKIDA_PPLX_MAX_WAIT seconds)
+        self.http = http or PooledClient(
+            pool_size=int(os.environ.get('NUKIDA_PPLX_POOL', 10)),
+            connect_timeout=float(os.environ.get('NUKIDA_PPLX_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(os.environ.get('NUKIDA_PPLX_READ_TIMEOUT', 90)),
+            max_retries=int(os.environ.get('NUKIDA_PPLX_RETRIES', 2)),
+            limiter=limiter or get_default_limiter(),
+            max_wait=float(os.environ.get('NUKIDA_PPLX_MAX_WAIT', 10))
+        )
+
+        # Result cache keyed by the prompt inputs (NUKIDA_AI_CACHE=0 disables)
+        if cache is None and os.environ.get('NUKIDA_AI_CACHE', '1') != '0':
+            cache = AnalysisCache()
+        self.cache = cache or None
+
+        # Precompiled system prompt + per-section token budgets (NUKIDA_PROMPT_*)
+        self.prompts = prompts or PromptBuilder()
+        self.expected_output_tokens = EXPECTED_OUTPUT_TOKENS[self.prompts.schema]
+        self._usage_lock = threading.Lock()
+        self.usage = {"calls": 0, "input_tokens_est": 0, "output_tokens_est": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def prompt_fields(self, hard_data):
+        """The hard-data values that go into the prompt"""
         fin = hard_data.get('financials', {})
         tech = hard_data.get('technicals', {})
-        
-        info_str = f"""
-        - Price: {hard_data.get('price')} (Source: {hard_data.get('source')})
-        - Volume: {hard_data.get('volume')}
-        - FINANCIALS (Scraped): EPS={fin.get('EPS', 'N/A')}, P/E={fin.get('PE', 'N/A')}, Market Cap={fin.get('VonHoa', 'N/A')}
-        - TECHNICALS (Calculated): 
-            + RSI(14)={tech.get('rsi_14', 'N/A')}
-            + Trend={tech.get('trend', 'N/A')}
-            + EMA(20)={tech.get('ema20', 'N/A')}
-            + Bollinger Bands=[{tech.get('bb_lower', 'N/A')} - {tech.get('bb_upper', 'N/A')}]
-            + MACD Line={tech.get('macd_line', 'N/A')}
-            + Signal Logic={tech.get('signal', 'N/A')}
-        """
+        return {
+            "price": hard_data.get('price'),
+            "source": hard_data.get('source'),
+            "volume": hard_data.get('volume'),
+            "eps": fin.get('EPS', 'N/A'),
+            "pe": fin.get('PE', 'N/A'),
+            "market_cap": fin.get('VonHoa', 'N/A'),
+            "rsi_14": tech.get('rsi_14', 'N/A'),
+            "trend": tech.get('trend', 'N/A'),
+            "ema20": tech.get('ema20', 'N/A'),
+            "bb_lower": tech.get('bb_lower', 'N/A'),
+            "bb_upper": tech.get('bb_upper', 'N/A'),
+            "macd_line": tech.get('macd_line', 'N/A'),
+            "signal": tech.get('signal', 'N/A')
+        }
 
-        raw_news_str = "\n".join(hard_data.get('raw_news', []))
+    def build_prompt(self, ticker, hard_data):
+        """Budgeted prompt; logs its estimated input tokens and the expected output size"""
+        prompt = self.prompts.build(ticker, self.prompt_fields(hard_data), hard_data.get('raw_news', []))
+        t = prompt["tokens"]
+        print(f"[AIEngine] Prompt {ticker} ({prompt['schema']}): input~{t['input']} tokens "
+              f"(system {t['system']}, data {t['data']}, news {t['news']} / {len(prompt['news'])} items, "
+              f"{prompt['news_dropped']} dropped), output~{self.expected_output_tokens}")
+        return prompt
 
-        # ĐỘC GIÁ TRADING STRATEGY ENGINE
-        system_prompt = f"""
-        BẠN LÀ "ĐỘC GIÁ" - CHUYÊN GIA ĐỌC VỊ THỊ TRƯỜNG & PHÂN TÍCH KỸ THUẬT SIÊU CẤP VỚI 20 NĂM KINH NGHIỆM.
-        
-        TƯ DUY:
-        - Bạn không chỉ nhìn chart, bạn nhìn thấy TÂM LÝ và DÒNG TIỀN đằng sau. Cái tên "ĐỘC GIÁ" của bạn có nghĩa là "Đọc Vị Mức Giá Độc Nhất".
-        - Bạn phân tích như một cỗ máy: Logic, Lạnh lùng, Chính xác.
-        - Bạn phải giải thích cho người mới hiểu (F0) nhưng giữ độ sâu sắc cho chuyên gia.
-
-        NHIỆM VỤ: "Phẫu thuật" mã {ticker}.
-
-        OUTPUT JSON (BẮT BUỘT):
-        {{
-            "ticker": "{ticker}",
-            "friendly_advice": "Lời khuyên ngắn gọn, súc tích nhất từ Độc Giá.",
-            "beginner_report": {{
-                "summary": "Tóm tắt tình hình bằng ngôn ngữ đời thường cho người mới.",
-                "action_plan": "Hành động cụ thể: Mua, Bán hay Giữ? Tại sao?",
-                "risk_level": "Thấp/Trung Bình/Cao/Rất Cao"
-            }},
-            "process_steps": [
-                "Bước 1: Quét cấu trúc thị trường...",
-                "Bước 2: Kiểm tra dòng tiền...",
-                "Bước 3: Phân tích hành vi giá..."
-            ],
-            "strategy": {{
-                "decision": "MUA NGAY / CANH MUA / BÁN NGAY / CANH BÁN / ĐỨNG NGOÀI",
-                "timing": "Thời điểm", "entry": "Vùng giá vào", "stop_loss": "Cắt lỗ", "target": "Chốt lời",
-                "rr_ratio": "R:R", "rationale": "Luận điểm cốt lõi"
-            }},
-            "layers": [
-                {{ "layer": "Lớp 1: Cấu Trúc Thị Trường", "analysis": "..." }},
-                {{ "layer": "Lớp 2: Động Lượng & Xu Hướng", "analysis": "..." }},
-                {{ "layer": "Lớp 3: Logic Khối Lượng", "analysis": "..." }},
-                {{ "layer": "Lớp 4: Vùng Giá Quan Trọng", "analysis": "..." }},
-                {{ "layer": "Lớp 5: Hành Vi Nến (Price Action)", "analysis": "..." }},
-                {{ "layer": "Lớp 6: Chu Kỳ & Sóng", "analysis": "..." }},
-                {{ "layer": "Lớp 7: Tổng Hợp & Phản Biện", "analysis": "..." }}
-            ],
-            "deep_analysis": {{
-                "enterprise": "Nội tại doanh nghiệp",
-                "smart_money": "Dòng tiền lớn",
-                "sentiment": "Tâm lý đám đông"
-            }},
-            "tech_analysis_7_layers": {{
-                "structure": "Cấu trúc (Trend)",
-                "momentum": "Động lượng (RSI/MACD)",
-                "volume_analysis": "VSA (Giá/Khối lượng)",
-                "key_levels": "Hỗ trợ/Kháng cự",
-                "candle_behavior": {{ "type": "Mẫu nến", "logic": "Ý nghĩa", "observation": "Chi tiết" }},
-                "meta_critic": {{ "status": "Confirm/Deny", "confidence": "High/Med/Low", "confirmation": "Điều kiện", "denial": "Phủ nhận" }}
-            }},
-            "tech_summary": ["Ý 1", "Ý 2"],
-            "news_analysis": {{
-                "corporate": [], "synthesis": "Tổng hợp tin tức"
-            }}
-        }}
+    def _cache_key(self, ticker, prompt):
+        return prompt_key(ticker, prompt["fields"], prompt["news"], prompt["schema"]) if self.cache else None
+
+    def call_perplexity(self, ticker, api_key, hard_data):
+        return self.analyze(ticker, api_key, hard_data)[0]
+
+    def analyze(self, ticker, api_key, hard_data):
+        """call_perplexity returning (result, ok); ok is False when the result is a get_fallback_error payload"""
+        with stage_timer("perplexity", "api") as t:
+            prompt = self.build_prompt(ticker, hard_data)
+
+            cache_key = self._cache_key(ticker, prompt)
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not MISSING:
+                    print(f"[AIEngine] Cache hit for {ticker} ({cache_key[:12]})")
+                    t.source = "cache"
+                    return cached, True
+
+            result, ok = self._request_analysis(ticker, api_key, prompt)
+            # Fallback error payloads are never cached
+            if ok and cache_key:
+                self.cache.put(cache_key, result)
+            if not ok:
+                t.outcome = "error"
+            return result, ok
+
+    def stream_perplexity(self, ticker, api_key, hard_data):
         """
-        
-        user_prompt = f"PHÂN TÍCH SÂU MÃ {ticker}.\nDATA:\n{info_str}\nTIN TỨC:\n{raw_news_str}\n\nYÊU CẦU: Trả về JSON chuẩn. Phần 'beginner_report' phải viết cực kỳ bình dân, dễ hiểu. Phần 'process_steps' liệt kê 5-7 bước bạn đã thực hiện."
-        
-        payload = {
-            "model": "sonar-pro",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.2
-        }
+        Streaming variant of call_perplexity (`stream: true`). Yields ("token", text) for each
+        content delta as it arrives, then ("result", parsed_result) once the answer is complete.
+        """
+        started = time.perf_counter()
+        prompt = self.build_prompt(ticker, hard_data)
 
-        req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), headers={
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        })
+        cache_key = self._cache_key(ticker, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not MISSING:
+                print(f"[AIEngine] Cache hit for {ticker} ({cache_key[:12]})")
+                observe_stage("perplexity_stream", time.perf_counter() - started, "cache")
+                yield "result", cached
+                return
+
+        payload = self._build_payload(prompt)
+        payload["stream"] = True
 
+        chunks = []
+        usage = None
         try:
-            with urllib.request.urlopen(req) as response:
-                response_data = response.read().decode('utf-8')
-                json_response = json.loads(response_data)
+            with self._post(api_key, payload, stream=True) as response:
+                # OpenAI-compatible SSE: "data: {json}" lines, terminated by "data: [DONE]"
+                for raw_line in response.iter_lines():
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        chunk = json.loads(data)
+                        usage = chunk.get('usage') or usage
+                        delta = chunk['choices'][0].get('delta', {}).get('content')
+                    except (ValueError, KeyError, IndexError, AttributeError):
+                        continue
+                    if delta:
+                        chunks.append(delta)
+                        yield "token", delta
+        except Exception as e:
+            print(f"[AIEngine] Stream Error: {e}")
+            observe_stage("perplexity_stream", time.perf_counter() - started, "api", "error")
+            yield "result", self.get_fallback_error(ticker, str(e))
+            return
+
+        content = "".join(chunks)
+        self._record_usage(ticker, prompt, content, usage)
+        result, ok = self._parse_content(ticker, content)
+        if ok and cache_key:
+            self.cache.put(cache_key, result)
+        observe_stage("perplexity_stream", time.perf_counter() - started, "api", "ok" if ok else "invalid_json")
+        yield "result", result
+
+    def _request_analysis(self, ticker, api_key, prompt):
+        """Returns (result, ok); ok is False when the result is a get_fallback_error payload"""
+        try:
+            with self._post(api_key, self._build_payload(prompt)) as response:
+                json_response = response.json()
                 content = json_response['choices'][0]['message']['content']
-                
-                # Clean Markdown
-                if "```" in content:
-                    content = content.replace("```json", "").replace("```", "").strip()
-                
-                # Extract JSON block
-                start_idx = content.find('{')
-                end_idx = content.rfind('}')
-                if start_idx != -1 and end_idx != -1:
-                    content = content[start_idx : end_idx + 1]
-                
-                content = self.repair_json(content)
-                
-                try:
-                    result = json.loads(content)
-                    return result
-                except json.JSONDecodeError as je:
-                    print(f"JSON Decode Error: {je}")
-                    return self.get_fallback_error(ticker, str(je))
+                self._record_usage(ticker, prompt, content, json_response.get('usage'))
+                return self._parse_content(ticker, content)
                     
         except Exception as e:
             print(f"[AIEngine] Error: {e}")
-            return self.get_fallback_error(ticker, str(e))
+            return self.get_fallback_error(ticker, str(e)), False
+
+    def _post(self, api_key, payload, stream=False):
+        response = self.http.post(PPLX_URL, data=json.dumps(payload).encode('utf-8'), stream=stream, headers={
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+        response.raise_for_status()
+        return response
+
+    def _build_payload(self, prompt):
+        payload = {
+            "model": "sonar-pro",
+            "messages": prompt["messages"],
+            "temperature": 0.2
+        }
+        if prompt["max_tokens"]:
+            payload["max_tokens"] = prompt["max_tokens"]
+        return payload
+
+    def _record_usage(self, ticker, prompt, content, usage):
+        """Log estimated vs reported token counts for one completed call and update the running stats"""
+        output_est = estimate_tokens(content)
+        usage = usage or {}
+        with self._usage_lock:
+            u = self.usage
+            u["calls"] += 1
+            u["input_tokens_est"] += prompt["tokens"]["input"]
+            u["output_tokens_est"] += output_est
+            u["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            u["completion_tokens"] += usage.get("completion_tokens") or 0
+            # Running expectation for the next call's output (reported before it is sent)
+            actual = usage.get("completion_tokens") or output_est
+            self.expected_output_tokens = round(0.8 * self.expected_output_tokens + 0.2 * actual)
+        AI_TOKENS.inc("prompt", n=usage.get("prompt_tokens") or prompt["tokens"]["input"])
+        AI_TOKENS.inc("completion", n=actual)
+        print(f"[AIEngine] Tokens {ticker}: input~{prompt['tokens']['input']} (reported {usage.get('prompt_tokens', '?')}), "
+              f"output~{output_est} (reported {usage.get('completion_tokens', '?')})")
+
+    def prompt_stats(self):
+        with self._usage_lock:
+            out = dict(self.usage)
+            out["schema"] = self.prompts.schema
+            out["system_tokens"] = self.prompts.system_tokens
+            out["expected_output_tokens"] = self.expected_output_tokens
+            out["max_tokens"] = self.prompts.max_output_tokens
+            return out
+
+    def _parse_content(self, ticker, content):
+        """Model output -> (result, ok)"""
+        # Clean Markdown
+        if "```" in content:
+            content = content.replace("```json", "").replace("```", "").strip()
+        
+        # Extract JSON block
+        start_idx = content.find('{')
+        end_idx = content.rfind('}')
+        if start_idx != -1 and end_idx != -1:
+            content = content[start_idx : end_idx + 1]
+        
+        content = self.repair_json(content)
+        
+        try:
+            result = json.loads(content)
+            return result, True
+        except json.JSONDecodeError as je:
+            print(f"JSON Decode Error: {je}")
+            return self.get_fallback_error(ticker, str(je)), False
 
     def repair_json(self, s):
+        with stage_timer("repair_json"):
+            return self._repair_json(s)
+
+    def _repair_json(self, s):
         s = re.sub(r'\"\s*(\[[0-9, ]+\])+', r'\1"', s)
         s = re.sub(r'(?<=[a-zA-Z0-9àáảãạâầấẩẫậăằắẳẵặèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵ])"(?=[a-zA-Z0-9àáảãạâầấẩẫậăằắẳẵặèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵ])', '\\"', s)
         s = re.sub(r'\"(\[[0-9, ]+\])+', '"', s)
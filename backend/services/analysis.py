@@ -0,0 +1,269 @@
+"""
+Analysis pipeline shared by app.py (Flask) and backend/main.py
+- merge_result: gắn dữ liệu cứng (giá, kỹ thuật, chart) vào kết quả AI
+- Analyzer: phân tích một mã, gộp các request trùng mã đang chạy (single-flight),
+  hoặc stream từng giai đoạn (Server-Sent Events)
+- BatchAnalyzer: phân tích cả watchlist trong một request
+"""
+import copy
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from services.bars import BarSeries
+from services.singleflight import FlightTimeout, SingleFlight
+
+# chart_data encodings: columnar (default) or compact (integer deltas, see BarSeries.to_compact)
+CHART_FORMATS = ("columnar", "compact")
+
+
+def normalize_ticker(ticker):
+    return "".join(filter(str.isalnum, ticker or "")).upper()
+
+
+# SAFE SERIALIZATION
+# Ensure no NaN or Inf which breaks JSON.parse in frontend
+def safe_serialize(obj):
+    if isinstance(obj, float):
+        if obj != obj: return None # NaN
+        if obj == float('inf') or obj == float('-inf'): return None
+    elif isinstance(obj, dict):
+        return {k: safe_serialize(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [safe_serialize(x) for x in obj]
+    return obj
+
+
+def sse_event(event, data):
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(safe_serialize(data), ensure_ascii=False)}\n\n"
+
+
+def parse_chart_format(value):
+    value = value or "columnar"
+    if value not in CHART_FORMATS:
+        raise ValueError(f"chartFormat phải là một trong {', '.join(CHART_FORMATS)}")
+    return value
+
+
+def chart_json(history, chart_format=None):
+    if not history:
+        return {}
+    return history.to_compact() if chart_format == "compact" else history.to_json()
+
+
+def with_chart_format(result, chart_format):
+    """Copy of `result` with its columnar chart_data re-encoded (the original may be shared)"""
+    chart = (result or {}).get('chart_data')
+    if chart_format != "compact" or not chart or "encoding" in chart:
+        return result
+    return dict(result, chart_data=BarSeries.from_json(chart).to_compact())
+
+
+def merge_result(ai_result, hard_data, chart_format=None):
+    """DATA MERGE: attach the raw metrics so the Frontend can display them in the Fast Metrics grid"""
+    history = hard_data.get('history')
+    ai_result['financials'] = hard_data.get('financials', {})
+    ai_result['technicals'] = hard_data.get('technicals', {})
+    ai_result['chart_data'] = chart_json(history, chart_format)
+    ai_result['current_price'] = hard_data.get('price')
+    ai_result['percent_change'] = hard_data.get('percent_change', '0%')
+    return ai_result
+
+
+class Analyzer:
+    """Single-ticker pipeline. Concurrent requests for the same ticker share one computation."""
+
+    def __init__(self, data_engine, ai_engine):
+        self.data_engine = data_engine
+        self.ai_engine = ai_engine
+        self.flights = SingleFlight()
+        self.data_flights = SingleFlight()
+
+    def analyze(self, ticker, api_key, chart_format=None):
+        ticker = normalize_ticker(ticker)
+        result, shared = self.flights.do(self._flight_key(ticker, api_key), lambda: self._run(ticker, api_key))
+        if shared:
+            print(f"[Analyzer] Coalesced request for {ticker} onto in-flight analysis")
+            # Each caller owns its response object
+            result = copy.deepcopy(result)
+        return with_chart_format(result, chart_format)
+
+    @staticmethod
+    def _flight_key(ticker, api_key):
+        # Only callers with the same key share a run: an invalid key's fallback error must not reach
+        # a caller with a valid key, and a paid result must not reach a caller with a bad one
+        return ticker, hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()
+
+    def _run(self, ticker, api_key):
+        # Step 1: Get Hard Data
+        hard_data = self.data_engine.get_market_data(ticker)
+        # Step 2: AI Analysis
+        ai_result = self.ai_engine.call_perplexity(ticker, api_key, hard_data)
+        # Step 3: DATA MERGE
+        return merge_result(ai_result, hard_data)
+
+    def stream(self, ticker, api_key, chart_format=None):
+        """
+        Staged pipeline as SSE frames: snapshot -> chart (history + technicals) -> news ->
+        AI tokens -> final merged result. The browser can draw the chart long before the LLM finishes.
+        Identical concurrent streams share one run; only the chart encoding is done per caller.
+        """
+        ticker = normalize_ticker(ticker)
+        stages = self.flights.stream(self._flight_key(ticker, api_key), lambda: self._stages(ticker, api_key))
+        try:
+            for event, payload in stages:
+                if event == "chart":
+                    payload = dict(payload, chart_data=chart_json(payload["chart_data"], chart_format))
+                elif event == "result":
+                    payload = with_chart_format(payload, chart_format)
+                yield sse_event(event, payload)
+        except FlightTimeout:
+            yield sse_event("error", {"error": f"Quá thời gian chờ phân tích {ticker}, vui lòng thử lại."})
+
+    def _stages(self, ticker, api_key):
+        yield "stage", {"message": f"Đang quét dữ liệu thị trường cho {ticker}..."}
+        hard_data = None
+        # The hard-data stage does not depend on the API key: every stream of this ticker shares it
+        market_data = self.data_flights.stream(ticker, lambda: self.data_engine.iter_market_data(ticker))
+        for event, payload in market_data:
+            if event == "chart":
+                yield "chart", {
+                    "ticker": ticker,
+                    "current_price": payload["price"],
+                    "technicals": payload["technicals"],
+                    "chart_data": payload["history"]
+                }
+            elif event in ("snapshot", "news"):
+                yield event, payload
+            elif event == "done":
+                hard_data = payload
+
+        if hard_data.get("status") == "error":
+            yield "error", {"error": hard_data.get("message")}
+            return
+
+        yield "stage", {"message": "Độc Giá đang phân tích (AI)..."}
+        for event, payload in self.ai_engine.stream_perplexity(ticker, api_key, hard_data):
+            if event == "token":
+                yield "token", {"text": payload}
+            else:
+                yield "result", merge_result(payload, hard_data)
+
+    def stats(self):
+        return dict(self.flights.stats(), hard_data=self.data_flights.stats())
+
+
+class BatchAnalyzer:
+    """
+    Analyse many tickers in one call:
+    1. hard data for every ticker with bounded concurrency (no technicals yet)
+    2. technicals for all of them in one batched, vectorized pass
+    3. Perplexity calls under their own concurrency limit
+    Each stage has a deadline, so one slow symbol is reported as an error instead of stalling the rest.
+    """
+
+    def __init__(self, data_engine, ai_engine, data_workers=None, ai_concurrency=None,
+                 data_timeout=None, ai_timeout=None, max_tickers=None):
+        env = os.environ.get
+        self.data_engine = data_engine
+        self.ai_engine = ai_engine
+        self.data_workers = data_workers or int(env('NUKIDA_BATCH_DATA_WORKERS', 8))
+        self.ai_concurrency = ai_concurrency or int(env('NUKIDA_PPLX_CONCURRENCY', 4))
+        self.data_timeout = data_timeout or float(env('NUKIDA_BATCH_DATA_TIMEOUT', 30))
+        self.ai_timeout = ai_timeout or float(env('NUKIDA_BATCH_AI_TIMEOUT', 120))
+        self.max_tickers = max_tickers or int(env('NUKIDA_BATCH_MAX_TICKERS', 100))
+
+    def dedupe(self, tickers):
+        seen = []
+        for t in tickers or []:
+            t = normalize_ticker(str(t))
+            if t and t not in seen:
+                seen.append(t)
+        return seen
+
+    def analyze(self, tickers, api_key, chart_format=None):
+        started = time.perf_counter()
+        unique = self.dedupe(tickers)
+        entries = {t: {"ticker": t, "status": "pending", "timing": {}} for t in unique}
+        print(f"[Batch] Analysing {len(unique)} tickers ({len(tickers or []) - len(unique)} duplicates removed)")
+
+        # Step 1: Hard Data (bounded concurrency, per-batch deadline)
+        hard = {}
+        data_started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=self.data_workers, thread_name_prefix="BatchData")
+        futures = {pool.submit(self._timed, self.data_engine.get_market_data, t, technicals=False): t for t in unique}
+        done, pending = wait(futures, timeout=self.data_timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            t = futures[future]
+            try:
+                hard_data, elapsed = future.result()
+            except Exception as e:
+                self._fail(entries[t], f"Lỗi truy xuất dữ liệu: {e}")
+                continue
+            entries[t]["timing"]["data"] = round(elapsed, 3)
+            if hard_data.get("status") == "error":
+                self._fail(entries[t], hard_data.get("message", "Lỗi truy xuất dữ liệu thị trường."))
+            else:
+                hard[t] = hard_data
+        for future in pending:
+            self._fail(entries[futures[future]], f"Quá thời gian lấy dữ liệu ({self.data_timeout:.0f}s)")
+        data_wall = time.perf_counter() - data_started
+
+        # Step 2: Technicals for the whole batch in one pass
+        tech_started = time.perf_counter()
+        ready = [t for t in unique if t in hard]
+        for t, tech in zip(ready, self.data_engine.calculate_technicals_batch([hard[t].get('history') for t in ready])):
+            hard[t]['technicals'] = tech
+        tech_elapsed = time.perf_counter() - tech_started
+
+        # Step 3: AI Analysis under the Perplexity concurrency limit
+        ai_started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=self.ai_concurrency, thread_name_prefix="BatchAI")
+        futures = {pool.submit(self._timed, self.ai_engine.analyze, t, api_key, hard[t]): t for t in ready}
+        done, pending = wait(futures, timeout=self.ai_timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            t = futures[future]
+            try:
+                (ai_result, ok), elapsed = future.result()
+            except Exception as e:
+                self._fail(entries[t], f"Lỗi AI: {e}")
+                continue
+            entries[t]["timing"]["ai"] = round(elapsed, 3)
+            if not ok:
+                # API / parse failure: AIEngine returned its fallback payload, whose rationale carries the error
+                self._fail(entries[t], ai_result.get("strategy", {}).get("rationale") or "Lỗi AI.")
+                continue
+            entries[t]["status"] = "ok"
+            entries[t]["result"] = merge_result(ai_result, hard[t], chart_format)
+        for future in pending:
+            self._fail(entries[futures[future]], f"Quá thời gian phân tích AI ({self.ai_timeout:.0f}s)")
+        ai_wall = time.perf_counter() - ai_started
+
+        return {
+            "count": len(unique),
+            "duplicates_removed": len(tickers or []) - len(unique),
+            "succeeded": sum(1 for e in entries.values() if e["status"] == "ok"),
+            "results": [entries[t] for t in unique],
+            "timing": {
+                "data_wall": round(data_wall, 3),
+                "technicals": round(tech_elapsed, 3),
+                "ai_wall": round(ai_wall, 3),
+                "total": round(time.perf_counter() - started, 3)
+            }
+        }
+
+    @staticmethod
+    def _timed(fn, *args, **kwargs):
+        started = time.perf_counter()
+        value = fn(*args, **kwargs)
+        return value, time.perf_counter() - started
+
+    @staticmethod
+    def _fail(entry, message):
+        entry["status"] = "error"
+        entry["error"] = message
@@ -0,0 +1,117 @@
+"""
+Persistent local OHLCV store (SQLite)
+Bars được lưu theo (symbol, resolution, ts) để chỉ phải tải phần mới từ DChart.
+Mỗi lần làm mới tải lại một phiên đã đóng để so sánh: DChart điều chỉnh giá quá khứ sau cổ tức / chia tách,
+lệch thì tải lại cả cửa sổ (replace) thay vì trộn bar đã điều chỉnh với bar chưa điều chỉnh.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, volume REAL,
+    PRIMARY KEY (symbol, resolution, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    covered_from INTEGER NOT NULL,
+    PRIMARY KEY (symbol, resolution)
+);
+"""
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_store():
+    """Process-wide store at NUKIDA_BAR_STORE (default: temp dir). Set it to 'off' to disable."""
+    global _default_store
+    path = os.environ.get('NUKIDA_BAR_STORE', os.path.join(tempfile.gettempdir(), 'nukida_bars.sqlite3'))
+    if path.lower() == 'off':
+        return None
+    with _default_lock:
+        if _default_store is None:
+            try:
+                _default_store = BarStore(path)
+            except sqlite3.Error as e:
+                print(f"[BarStore] Disabled, cannot open {path}: {e}")
+                return None
+        return _default_store
+
+
+class BarStore:
+    """SQLite-backed bar store, one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def coverage(self, symbol, resolution):
+        """(covered_from, last_ts) for a series, or (None, None) if nothing stored yet"""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT covered_from FROM coverage WHERE symbol=? AND resolution=?",
+            (symbol, resolution)).fetchone()
+        if row is None:
+            return None, None
+        last = conn.execute(
+            "SELECT MAX(ts) FROM bars WHERE symbol=? AND resolution=?",
+            (symbol, resolution)).fetchone()[0]
+        return row[0], last
+
+    def append(self, symbol, resolution, rows, covered_from):
+        """Insert or revise bars (ts, open, high, low, close, volume) and extend coverage"""
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((symbol, resolution) + tuple(r) for r in rows))
+                conn.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?) "
+                    "ON CONFLICT(symbol, resolution) DO UPDATE SET covered_from=MIN(covered_from, excluded.covered_from)",
+                    (symbol, resolution, covered_from))
+
+    def replace(self, symbol, resolution, rows, covered_from):
+        """Drop everything stored for the series and store `rows` as its only bars"""
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM bars WHERE symbol=? AND resolution=?", (symbol, resolution))
+                conn.execute("DELETE FROM coverage WHERE symbol=? AND resolution=?", (symbol, resolution))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((symbol, resolution) + tuple(r) for r in rows))
+                conn.execute("INSERT INTO coverage VALUES (?, ?, ?)", (symbol, resolution, covered_from))
+
+    def tail(self, symbol, resolution, n):
+        """Last `n` stored bars, oldest first"""
+        rows = self._conn().execute(
+            "SELECT ts, open, high, low, close, volume FROM bars "
+            "WHERE symbol=? AND resolution=? ORDER BY ts DESC LIMIT ?",
+            (symbol, resolution, n)).fetchall()
+        return rows[::-1]
+
+    def read(self, symbol, resolution, start_ts, end_ts):
+        """Bars in [start_ts, end_ts] in chronological order"""
+        return self._conn().execute(
+            "SELECT ts, open, high, low, close, volume FROM bars "
+            "WHERE symbol=? AND resolution=? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (symbol, resolution, start_ts, end_ts)).fetchall()
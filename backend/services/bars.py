@@ -0,0 +1,134 @@
+"""
+Columnar OHLCV bar series
+Lưu dạng cột (NumPy) với timestamp epoch giây, thứ tự thời gian tăng dần (cũ nhất trước).
+List dict theo từng phiên chỉ được tạo khi code cũ cần (to_records).
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+
+FIELDS = ("open", "high", "low", "close", "volume")
+
+
+class BarSeries:
+    """OHLCV bars as parallel arrays: t (int64 epoch seconds) + float64 open/high/low/close/volume"""
+
+    __slots__ = ("t",) + FIELDS
+
+    def __init__(self, t, open, high, low, close, volume):
+        self.t = np.asarray(t, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [])
+
+    @classmethod
+    def from_columns(cls, t, o, h, l, c, v):
+        """Build from TradingView-style column lists (DChart `t,o,h,l,c,v`), dropping broken bars"""
+        n = min(len(t), len(o), len(h), len(l), len(c), len(v))
+        cols = [np.array(col[:n], dtype=np.float64) for col in (t, o, h, l, c, v)]
+        ok = ~np.isnan(cols[0]) & ~np.isnan(cols[4])
+        if not ok.all():
+            cols = [col[ok] for col in cols]
+        return cls(*cols)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (ts, open, high, low, close, volume) tuples"""
+        if not rows:
+            return cls.empty()
+        arr = np.array(rows, dtype=np.float64)
+        return cls(arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3], arr[:, 4], arr[:, 5])
+
+    @classmethod
+    def from_json(cls, data):
+        """Inverse of to_json (null -> NaN)"""
+        return cls(data["t"], *(np.asarray(data[f], dtype=np.float64) for f in FIELDS))
+
+    @classmethod
+    def from_records(cls, records, date_format='%d/%m/%Y'):
+        """Build from legacy per-bar dicts with a `date` string"""
+        rows = []
+        for d in records:
+            day = datetime.strptime(d['date'], date_format).replace(tzinfo=timezone.utc)
+            rows.append((int(day.timestamp()), d['open'], d['high'], d['low'], d['close'], d.get('volume', 0)))
+        return cls.from_rows(rows)
+
+    def __len__(self):
+        return len(self.t)
+
+    def __bool__(self):
+        return len(self.t) > 0
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, f).nbytes for f in self.__slots__)
+
+    def rows(self):
+        """(ts, open, high, low, close, volume) tuples, e.g. for the bar store"""
+        return zip(self.t.tolist(), self.open.tolist(), self.high.tolist(),
+                   self.low.tolist(), self.close.tolist(), self.volume.tolist())
+
+    def tail(self, n):
+        return BarSeries(*(getattr(self, f)[-n:] for f in self.__slots__))
+
+    def scale_prices(self, factor):
+        """Multiply open/high/low/close in place (unit repair, e.g. x1000)"""
+        for f in ("open", "high", "low", "close"):
+            col = getattr(self, f)
+            col *= factor
+
+    def to_records(self):
+        """Legacy list of dicts with dd/mm/yyyy dates"""
+        return [
+            {
+                'date': datetime.fromtimestamp(ts, timezone.utc).strftime('%d/%m/%Y'),
+                'open': o, 'high': h, 'low': l, 'close': c, 'volume': v
+            }
+            for ts, o, h, l, c, v in self.rows()
+        ]
+
+    def to_json(self):
+        """Columnar JSON: {"t": [...epoch s], "open": [...], ...}; NaN/Inf become null"""
+        out = {"t": self.t.tolist()}
+        for f in FIELDS:
+            col = getattr(self, f)
+            if np.isfinite(col).all():
+                out[f] = col.tolist()
+            else:
+                out[f] = [x if np.isfinite(x) else None for x in col.tolist()]
+        return out
+
+    def to_compact(self, decimals=None):
+        """
+        Compact columnar JSON (opt-in `chartFormat: "compact"`), integers only.
+        scale = 10**decimals, by default the smallest one (up to 4 decimals) that keeps every price exact:
+        - t: first epoch second, then deltas
+        - close: round(close * scale), first value then deltas
+        - open/high/low: round(x * scale) - scaled close of the same bar
+        - volume: rounded
+        Falls back to to_json when a price is NaN/Inf.
+        """
+        prices = np.stack([self.open, self.high, self.low, self.close])
+        if not np.isfinite(prices).all() or not np.isfinite(self.volume).all():
+            return self.to_json()
+        if decimals is None:
+            decimals = next((d for d in range(5) if np.allclose(prices * 10 ** d, np.rint(prices * 10 ** d), rtol=0, atol=1e-6)), 4)
+        scale = 10 ** decimals
+        scaled = np.rint(prices * scale).astype(np.int64)
+        close = scaled[3]
+        return {
+            "encoding": "delta",
+            "scale": scale,
+            "t": np.diff(self.t, prepend=0).tolist(),
+            "close": np.diff(close, prepend=0).tolist(),
+            "open": (scaled[0] - close).tolist(),
+            "high": (scaled[1] - close).tolist(),
+            "low": (scaled[2] - close).tolist(),
+            "volume": np.rint(self.volume).astype(np.int64).tolist()
+        }
@@ -0,0 +1,164 @@
+"""
+In-process caches for market data
+- TTLCache: thread-safe LRU with per-entry TTL and an approximate memory cap
+- MarketDataCache: overview / history / news cached separately, TTLs follow the HOSE calendar
+"""
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from services import market_calendar
+
+MISSING = object()
+
+
+def estimate_size(value):
+    """Approximate deep size in bytes of JSON-like data (dict/list/str/number)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k) + estimate_size(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            size += estimate_size(v)
+    elif hasattr(value, 'nbytes'):
+        size += value.nbytes
+    return size
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and a memory cap"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl, size=None):
+        if ttl <= 0:
+            return
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while self._data and (self._bytes > self.max_bytes or
+                                  (self.max_entries and len(self._data) > self.max_entries)):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions
+            }
+
+
+class MarketDataCache:
+    """
+    Caches the three parts of DataEngine.get_market_data independently.
+    During the session (09:00-15:00 ICT) entries live for a short, per-part TTL;
+    once the market is closed they stay valid until the next open.
+    """
+
+    SESSION_TTLS = {
+        "overview": 30,
+        "history": 300,
+        "news": 120,
+        # MarketScanner: DChart-only bars (thousand VND). "history" may hold any source, in either unit
+        "dchart_history": 300
+    }
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, session_ttls=None):
+        self.store = TTLCache(max_bytes=max_bytes)
+        self.session_ttls = dict(self.SESSION_TTLS, **(session_ttls or {}))
+        self._counters = {part: {"hits": 0, "misses": 0} for part in self.session_ttls}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, part, now=None):
+        if market_calendar.is_trading_hours(now):
+            return self.session_ttls[part]
+        return max(market_calendar.seconds_until_next_open(now), self.session_ttls[part])
+
+    def get(self, part, ticker):
+        value = self.store.get((part, ticker))
+        with self._lock:
+            self._counters[part]["hits" if value is not MISSING else "misses"] += 1
+        # Callers mutate the result (unit repair, volume patch), so never hand out the cached object
+        return copy.deepcopy(value) if value is not MISSING else MISSING
+
+    def put(self, part, ticker, value):
+        self.store.put((part, ticker), copy.deepcopy(value), self.ttl_for(part))
+
+    def get_or_load(self, part, ticker, loader, valid=bool):
+        value = self.get(part, ticker)
+        if value is not MISSING:
+            return value
+        value = loader()
+        # Failed / empty fetches are not cached so the next request retries upstream
+        if valid(value):
+            self.put(part, ticker, value)
+        return value
+
+    def invalidate(self, ticker):
+        for part in self.session_ttls:
+            self.store.delete((part, ticker))
+
+    def stats(self):
+        stats = self.store.stats()
+        with self._lock:
+            stats["parts"] = {part: dict(c) for part, c in self._counters.items()}
+        return stats
@@ -0,0 +1,143 @@
+"""
+Nén response (brotli/gzip theo Accept-Encoding) + ETag / If-None-Match -> 304
+Dùng chung cho Flask (app.py) và NukidaHandler (backend/main.py), cho cả API JSON lẫn file tĩnh frontend/.
+- brotli chỉ dùng khi có cài package `brotli` (tùy chọn), không thì gzip
+- Body nén được cache theo (ETag, encoding) nên file tĩnh / snapshot lặp lại chỉ nén một lần
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/", "image/svg+xml")
+
+
+class ResponseEncoder:
+    def __init__(self, enabled=None, min_size=None, gzip_level=None, brotli_quality=None, cache_bytes=None):
+        env = os.environ.get
+        self.enabled = enabled if enabled is not None else env('NUKIDA_COMPRESS', '1') != '0'
+        self.min_size = min_size if min_size is not None else int(env('NUKIDA_COMPRESS_MIN_BYTES', 1024))
+        self.gzip_level = gzip_level or int(env('NUKIDA_GZIP_LEVEL', 6))
+        self.brotli_quality = brotli_quality or int(env('NUKIDA_BROTLI_QUALITY', 5))
+        self.cache_bytes = cache_bytes if cache_bytes is not None else int(env('NUKIDA_COMPRESS_CACHE_MB', 8)) * 1024 * 1024
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (etag, encoding) -> compressed body
+        self._cached_bytes = 0
+        self.counts = {"responses": 0, "not_modified": 0, "compressed": 0, "cache_hits": 0,
+                       "bytes_in": 0, "bytes_out": 0}
+
+    # --- Negotiation ---
+    def choose_encoding(self, accept_encoding):
+        offered = {}
+        for item in (accept_encoding or "").lower().split(","):
+            name, _, params = item.strip().partition(";")
+            q = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            offered[name.strip()] = q
+        for encoding in (("br", "gzip") if brotli else ("gzip",)):
+            if offered.get(encoding, offered.get("*", 0)) > 0:
+                return encoding
+        return None
+
+    def compressible(self, content_type, size):
+        return self.enabled and size >= self.min_size and (content_type or "").startswith(COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def etag_for(body):
+        # Weak: the same entity is served under different Content-Encodings
+        return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+    @staticmethod
+    def etag_matches(if_none_match, etag):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        opaque = etag[2:] if etag.startswith("W/") else etag
+        return any((tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == opaque
+                   for tag in if_none_match.split(","))
+
+    def _compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _cached_compress(self, body, encoding, etag):
+        key = (etag, encoding)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                self.counts["cache_hits"] += 1
+                return hit
+        out = self._compress(body, encoding)
+        with self._lock:
+            if len(out) <= self.cache_bytes // 4 and key not in self._cache:
+                self._cache[key] = out
+                self._cached_bytes += len(out)
+                while self._cached_bytes > self.cache_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(old)
+        return out
+
+    # --- One response ---
+    def encode(self, body, content_type, accept_encoding=None, if_none_match=None, conditional=True):
+        """
+        -> (status, body, headers): status is 304 with an empty body when the client already has
+        this entity (conditional GET), otherwise None (keep the original status).
+        conditional=False (e.g. POST results) only compresses.
+        """
+        headers = {"Vary": "Accept-Encoding"}
+        etag = None
+        if conditional:
+            etag = self.etag_for(body)
+            headers["ETag"] = etag
+            if self.etag_matches(if_none_match, etag):
+                with self._lock:
+                    self.counts["responses"] += 1
+                    self.counts["not_modified"] += 1
+                return 304, b"", headers
+
+        size = len(body)
+        encoding = self.choose_encoding(accept_encoding) if self.compressible(content_type, size) else None
+        if encoding:
+            body = self._cached_compress(body, encoding, etag) if etag else self._compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        with self._lock:
+            self.counts["responses"] += 1
+            self.counts["bytes_in"] += size
+            self.counts["bytes_out"] += len(body)
+            if encoding:
+                self.counts["compressed"] += 1
+        return None, body, headers
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counts)
+            out["brotli"] = brotli is not None
+            out["cache_entries"] = len(self._cache)
+            out["ratio"] = round(out["bytes_out"] / out["bytes_in"], 3) if out["bytes_in"] else None
+            return out
+
+
+_default_encoder = None
+_default_lock = threading.Lock()
+
+
+def get_default_encoder():
+    global _default_encoder
+    with _default_lock:
+        if _default_encoder is None:
+            _default_encoder = ResponseEncoder()
+        return _default_encoder
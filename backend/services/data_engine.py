@@ -1,17 +1,101 @@
 import requests
-from bs4 import BeautifulSoup
-import json
+import contextvars
+import copy
+import html
 import re
 import urllib3
 import datetime
-from datetime import datetime, timedelta
-import math
+from datetime import datetime, timedelta, timezone
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from services.bars import BarSeries
+from services.cache import MarketDataCache
+from services.health import UpstreamUnavailable, get_default_registry, guarded_get
+from services.metrics import observe_stage, stage_timer
+from services.news_store import NewsCrawler
+from services.ratelimit import UpstreamThrottled, get_default_limiter
+from services.vnstock_lite import VNStockLite
 
 # Suppress SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# --- CafeF overview: precompiled patterns for the fast extraction path ---
+# Numbers must end on a digit so a sentence's trailing "." is not captured
+_OG_PRICE_RE = re.compile(r'Giá cổ phiếu[^(]*\([^)]*\):\s*([\d\.,]*\d)')
+_OG_VOLUME_RE = re.compile(r'Khối lượng\s*([\d\.,]*\d)')
+_OG_CAP_RE = re.compile(r'Vốn hóa tt:\s*([\d\.,]*\d)')
+_META_TAG_RE = re.compile(r'<meta\b[^>]*>', re.I)
+_OG_DESC_ATTR_RE = re.compile(r'property\s*=\s*["\']og:description["\']', re.I)
+_CONTENT_ATTR_RE = re.compile(r'content\s*=\s*(["\'])(.*?)\1', re.I | re.S)
+_PRICE_EL_RE = re.compile(r'<(\w+)\b[^>]*\bid\s*=\s*["\'][^"\']*(?:lblCurrentPrice|lblPrice)[^"\']*["\'][^>]*>(.*?)</\1\s*>', re.I | re.S)
+_METRIC_LABEL_RE = re.compile(
+    r'<(?:td|span|div)\b[^>]*>[^<]*?'
+    r'(?:(?P<eps>EPS|Lợi nhuận mỗi CP)|(?P<pe>P/E|Hệ số P/E)|(?P<cap>Vốn hóa|Market Cap))'
+    r'[^<]*</(?:td|span|div)\s*>', re.I)
+_CELL_RE = re.compile(r'<(td|span|div)\b[^>]*>(.*?)</\1\s*>', re.I | re.S)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _element_text(fragment):
+    """Approximation of BeautifulSoup get_text(strip=True) for a small HTML fragment"""
+    return "".join(part.strip() for part in html.unescape(_TAG_RE.sub('\n', fragment)).split('\n'))
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - started
+
+
+class _PartsFetch:
+    """Named fetch jobs: submitted together on an executor, or run lazily in call order without one"""
+
+    def __init__(self, executor, jobs):
+        self.jobs = dict(jobs)
+        self.started = time.perf_counter()
+        # Jobs run in the caller's context (admission deadline)
+        self.futures = {name: executor.submit(contextvars.copy_context().run, _timed, fn) for name, fn in jobs} if executor else None
+        self.values = {}
+        self.durations = {}
+
+    def get(self, name):
+        if name not in self.values:
+            if self.futures:
+                value, elapsed = self.futures[name].result()
+            else:
+                value, elapsed = _timed(self.jobs[name])
+            self.values[name] = value
+            self.durations[name] = elapsed
+        return self.values[name]
+
+
+HISTORY_SOURCES = ("dchart", "finfo", "yahoo", "ssi")
+
+# Intraday resolutions served by get_intraday -> default lookback (days) per request
+INTRADAY_RESOLUTIONS = {"1m": 5, "15m": 30, "30m": 60, "1H": 120}
+
+# Independent parts of get_market_data (also the MarketDataCache part names)
+PARTS = ("overview", "history", "news")
+
+HIGHLIGHTS_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Cache-Control': 'no-cache'
+}
+
+FALLBACK_NEWS = (
+    {"title": "Thị trường: Nhà đầu tư chờ đợi tín hiệu từ KQKD quý mới", "url": "https://cafef.vn"},
+    {"title": "Dòng tiền khối ngoại đang có xu hướng quay trở lại", "url": "https://cafef.vn"},
+    {"title": "Góc nhìn kỹ thuật: VN-Index đang tích lũy tại vùng hỗ trợ", "url": "https://cafef.vn"}
+)
+
+
 class DataEngine:
-    def __init__(self):
+    def __init__(self, concurrent_fetch=None, max_workers=None, cache=None, health=None, limiter=None):
         self.session = requests.Session()
         # Premium browser headers to avoid blocks
         self.session.headers.update({
@@ -24,12 +108,66 @@ class DataEngine:
         })
         self.session.verify = False
 
-    def get_market_data(self, ticker):
+        # Concurrent fan-out of the per-ticker upstream fetches (bounded, shared across requests)
+        if concurrent_fetch is None:
+            concurrent_fetch = os.environ.get('NUKIDA_CONCURRENT_FETCH', '1') != '0'
+        if max_workers is None:
+            max_workers = int(os.environ.get('NUKIDA_FETCH_WORKERS', 12))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="DataEngine") if concurrent_fetch else None
+
+        # Per-part TTL cache in front of the upstream fetches (NUKIDA_CACHE=0 disables)
+        if cache is None and os.environ.get('NUKIDA_CACHE', '1') != '0':
+            cache = MarketDataCache(max_bytes=int(os.environ.get('NUKIDA_CACHE_MB', 64)) * 1024 * 1024)
+        self.cache = cache or None
+
+        # Per-host circuit breakers: a host that keeps failing is skipped instead of costing a timeout
+        self.health = health or get_default_registry()
+        # Per-host rate + concurrency budget, shared with VNStockLite and AIEngine
+        self.limiter = limiter or get_default_limiter()
+
+        # CafeF headlines: incremental crawl into a shared store, reads are index lookups
+        self.news = NewsCrawler(self.session, health=self.health, limiter=self.limiter)
+
+        # History sources in priority order and how they are combined (sequential | hedged | race)
+        self.vnstock = VNStockLite(health=self.health, limiter=self.limiter)
+        self.history_sources = [n.strip() for n in os.environ.get('NUKIDA_HISTORY_SOURCES', ','.join(HISTORY_SOURCES)).split(',')
+                                if n.strip() in HISTORY_SOURCES]
+        self.history_mode = os.environ.get('NUKIDA_HISTORY_MODE', 'hedged')
+        if self.history_mode not in ('sequential', 'hedged', 'race'):
+            print(f"[DataEngine] Unknown NUKIDA_HISTORY_MODE={self.history_mode}, using sequential")
+            self.history_mode = 'sequential'
+        # Delay before starting source i+1 (last value repeats), e.g. "1.5" or "1.5,0.5"
+        self.hedge_delays = [float(d) for d in os.environ.get('NUKIDA_HISTORY_HEDGE_DELAY', '1.5').split(',') if d.strip()]
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('NUKIDA_HEDGE_WORKERS', 8)), thread_name_prefix="HistoryHedge"
+        ) if self.history_mode != 'sequential' else None
+        self._history_lock = threading.Lock()
+        self.history_stats_counts = {"hedges": 0, "wins": {}}
+
+        # Streaming indicator state per (ticker, resolution): an intraday refresh only feeds the new bars
+        self._intraday_states = OrderedDict()
+        self._intraday_lock = threading.Lock()
+        self.max_intraday_states = int(os.environ.get('NUKIDA_INTRADAY_STATES', 256))
+
+    def get_market_data(self, ticker, technicals=True):
         """
         Main entry point. Returns a rich dictionary with Price, Technicals, and Financials.
+        technicals=False skips the indicator pass (batch callers compute it for all tickers at once).
+        """
+        result = None
+        for event, payload in self.iter_market_data(ticker, technicals):
+            if event == "done":
+                result = payload
+        return result
+
+    def iter_market_data(self, ticker, technicals=True):
+        """
+        Staged variant of get_market_data for streaming responses. Yields ("snapshot", ...),
+        ("chart", ...) and ("news", ...) as each part becomes usable, then ("done", hard_data).
         """
         ticker = ticker.upper()
         print(f"[DataEngine] Starting Deep Scan for {ticker}...")
+        started = time.perf_counter()
         
         result = {
             "ticker": ticker,
@@ -43,63 +181,124 @@ class DataEngine:
         }
 
         try:
-            # 1. Get Basic Info & Financials (Overview Page)
+            # Overview (CafeF), History (DChart & fallbacks) and News are independent,
+            # so they are all started together and assembled as they arrive.
             cafef_url = self._find_cafef_url(ticker)
+            parts = self._start_parts(ticker, cafef_url)
+
+            # 1. Basic Info & Financials (Overview Page)
             if cafef_url:
-                overview_data = self._scrape_overview(cafef_url)
+                overview_data = parts.get('overview')
                 if overview_data.get('price', 0) > 0:
                     result.update(overview_data)
                 result['url'] = cafef_url
+            yield "snapshot", {k: result.get(k) for k in ("ticker", "price", "volume", "financials", "url")}
 
-            # 2. Get Historical Data & Technical Analysis
-            history = self._get_historical_prices(ticker)
+            # 2. Historical Data & Technical Analysis
+            history = parts.get('history')
             if history:
-                # DATA REPAIR: Normalize units if huge discrepancy
-                # CafeF might be 97800, History might be 97.8
                 if result.get('price', 0) > 0 and len(history) > 0:
-                    latest_hist = history[-1]['close']
-                    scraped_price = result['price']
-                    
-                    # Factor detection (approximate)
-                    if scraped_price > 1000 and latest_hist < 500: # History is likely in k
-                        ratio = scraped_price / latest_hist
-                        if 800 < ratio < 1200: # ~1000x difference
-                            print(f"[DataEngine] Auto-scaling history x1000 for {ticker}")
-                            for h in history:
-                                h['open'] = h['open'] * 1000
-                                h['high'] = h['high'] * 1000
-                                h['low'] = h['low'] * 1000
-                                h['close'] = h['close'] * 1000
-                    
-                    # If history volume is 0, try to patch with previous week average
-                    avg_vol = sum(x['volume'] for x in history[-5:]) / 5 if len(history) >= 5 else 0
-                    if history[-1]['volume'] == 0:
-                         history[-1]['volume'] = avg_vol
+                    self._normalize_history_units(ticker, result['price'], history)
                 
                 result['history'] = history
                 # If scraping failed or was 0, trust the history (now normalized)
                 if result['price'] == 0:
-                    latest = history[-1]
-                    result['price'] = latest['close']
-                    result['volume'] = latest.get('volume', 0)
+                    result['price'] = float(history.close[-1])
+                    result['volume'] = float(history.volume[-1])
                 
-                tech_signals = self._calculate_technicals(history)
-                result['technicals'] = tech_signals
+                if technicals:
+                    result['technicals'] = self._calculate_technicals(history)
+                # Only a real series is worth drawing (an invalid ticker has none)
+                yield "chart", {"history": history, "technicals": result['technicals'], "price": result['price']}
 
-            # 3. Get Raw News
-            result['raw_news'] = self._get_ticker_news(ticker)
+            # 3. Raw News
+            result['raw_news'] = parts.get('news')
+            yield "news", {"raw_news": result['raw_news']}
+            result['timing'] = self._report_timing(ticker, parts)
 
             # 4. Final Validation
             if result['price'] == 0:
                  # Last ditch effort
                  print(f"[DataEngine] Failure: No real price found for {ticker}")
-                 return {"status": "error", "message": f"Không tìm thấy dữ liệu thực tế cho mã {ticker}. Vui lòng kiểm tra lại mã."}
+                 observe_stage("market_data", time.perf_counter() - started, outcome="no_price")
+                 yield "done", {"status": "error", "message": f"Không tìm thấy dữ liệu thực tế cho mã {ticker}. Vui lòng kiểm tra lại mã."}
+                 return
             
-            return result
+            observe_stage("market_data", time.perf_counter() - started)
+            yield "done", result
 
         except Exception as e:
             print(f"[DataEngine] Critical Error: {e}")
-            return {"status": "error", "message": "Lỗi truy xuất dữ liệu thị trường."}
+            observe_stage("market_data", time.perf_counter() - started, outcome="error")
+            yield "done", {"status": "error", "message": "Lỗi truy xuất dữ liệu thị trường."}
+
+    def _start_parts(self, ticker, cafef_url):
+        """
+        Start the three upstream fetches. In concurrent mode they are issued together on the
+        shared bounded pool, so the request waits for the slowest one instead of the sum.
+        """
+        jobs = [(part, lambda part=part: self._cached(part, ticker, *self._part_loader(part, ticker, cafef_url)))
+                for part in PARTS]
+        return _PartsFetch(self._executor, jobs)
+
+    def _part_loader(self, part, ticker, cafef_url=None):
+        """(loader, valid) for one part of the hard data; invalid results are never cached"""
+        if part == "overview":
+            return (lambda: self._scrape_overview(cafef_url) if cafef_url else {}), (lambda d: d.get('price', 0) > 0)
+        if part == "history":
+            return (lambda: self._get_historical_prices(ticker)), bool
+        return (lambda: self._get_ticker_news(ticker)), bool
+
+    def refresh_part(self, part, ticker):
+        """Fetch one part from upstream and overwrite its cache entry (prefetch). Returns whether it was usable."""
+        ticker = ticker.upper()
+        cafef_url = self._find_cafef_url(ticker) if part == "overview" else None
+        loader, valid = self._part_loader(part, ticker, cafef_url)
+        value = loader()
+        ok = bool(valid(value))
+        if ok and self.cache:
+            self.cache.put(part, ticker, value)
+        return ok
+
+    def _report_timing(self, ticker, parts):
+        durations = parts.durations
+        wall = time.perf_counter() - parts.started
+        sequential = sum(durations.values())
+        mode = "concurrent" if self._executor else "sequential"
+        for name, d in durations.items():
+            # Includes cache hits: compare with the upstream stages below
+            observe_stage("part", d, name)
+        print(f"[DataEngine] Fetch timing {ticker} ({mode}): "
+              + " ".join(f"{name}={d:.2f}s" for name, d in durations.items())
+              + f" | wall={wall:.2f}s vs sequential={sequential:.2f}s (saved {sequential - wall:.2f}s)")
+        return {
+            "mode": mode,
+            "stages": {name: round(d, 3) for name, d in durations.items()},
+            "wall": round(wall, 3),
+            "sequential": round(sequential, 3),
+            "saved": round(sequential - wall, 3)
+        }
+
+    def _cached(self, part, ticker, loader, valid=bool):
+        if not self.cache:
+            return loader()
+        return self.cache.get_or_load(part, ticker, loader, valid=valid)
+
+    def _normalize_history_units(self, ticker, scraped_price, history):
+        """DATA REPAIR: Normalize units if huge discrepancy (CafeF might be 97800, History might be 97.8)"""
+        latest_hist = history.close[-1]
+        
+        # Factor detection (approximate)
+        if scraped_price > 1000 and latest_hist < 500: # History is likely in k
+            ratio = scraped_price / latest_hist
+            if 800 < ratio < 1200: # ~1000x difference
+                print(f"[DataEngine] Auto-scaling history x1000 for {ticker}")
+                history.scale_prices(1000)
+        
+        # If history volume is 0, try to patch with previous week average
+        avg_vol = history.volume[-5:].sum() / 5 if len(history) >= 5 else 0
+        if history.volume[-1] == 0:
+             history.volume[-1] = avg_vol
 
     def _find_cafef_url(self, ticker):
         """Find the main profile URL for the ticker on CafeF"""
@@ -110,29 +309,90 @@ class DataEngine:
     def _scrape_overview(self, url):
         """Scrape Price, Volume, EPS, P/E from Overview Page with OG Tag Priority"""
         data = {"price": 0, "volume": 0, "financials": {}, "last_update": ""}
+        with stage_timer("scrape_overview", "cafef") as t:
+            try:
+                r = guarded_get(self.session, url, registry=self.health, limiter=self.limiter, timeout=10)
+                data = self._parse_overview(r.text, data)
+                if not data.get('price'):
+                    t.outcome = "empty"
+            except Exception as e:
+                print(f"[DataEngine] Scrape Error for {url}: {e}")
+                t.outcome = "throttled" if isinstance(e, UpstreamThrottled) else "error"
+        return data
+
+    def _parse_overview(self, html_text, data=None):
+        """Fast targeted extraction first; the full BeautifulSoup tree only when it finds nothing usable"""
+        if data is None:
+            data = {"price": 0, "volume": 0, "financials": {}, "last_update": ""}
+        fast = self._parse_overview_fast(html_text, copy.deepcopy(data))
+        if fast['price'] > 0 and any(v != "N/A" for v in fast['financials'].values()):
+            return fast
+        return self._parse_overview_soup(html_text, data)
+
+    def _parse_og_description(self, content, data):
+        # Pattern: "Giá cổ phiếu ( chiều 06/02/2026): 26,800 VNĐ. Khối lượng 67,073,000"
+        # Price Extraction
+        p_match = _OG_PRICE_RE.search(content)
+        if p_match:
+            data['price'] = float(p_match.group(1).replace(',', ''))
+        
+        # Volume Extraction
+        v_match = _OG_VOLUME_RE.search(content)
+        if v_match:
+            data['volume'] = int(v_match.group(1).replace(',', '').replace('.', ''))
+
+        # Market Cap Extraction
+        cap_match = _OG_CAP_RE.search(content)
+        if cap_match:
+            data['financials']['VonHoa'] = cap_match.group(1)
+
+    def _parse_overview_fast(self, html_text, data):
+        """
+        Regex extraction without building a DOM: the og:description meta tag, the price label and
+        the EPS / P/E / market cap cells, found in one pass over the label candidates.
+        """
+        # --- 1. PRIORITY: OG Tags (Pre-rendered and usually live) ---
+        for tag in _META_TAG_RE.finditer(html_text):
+            if _OG_DESC_ATTR_RE.search(tag.group(0)):
+                content = _CONTENT_ATTR_RE.search(tag.group(0))
+                if content:
+                    self._parse_og_description(html.unescape(content.group(2)), data)
+                break
+
+        # --- 2. SECONDARY: Price label (If OG fail) ---
+        if data['price'] == 0:
+            price_el = _PRICE_EL_RE.search(html_text)
+            if price_el:
+                data['price'] = float(_element_text(price_el.group(2)).replace(',', ''))
+
+        # Financials Table Scraping: first label of each kind, value = next td/span/div
+        found = {}
+        for label in _METRIC_LABEL_RE.finditer(html_text):
+            key = label.lastgroup
+            if key in found:
+                continue
+            val_el = _CELL_RE.search(html_text, label.end())
+            found[key] = _element_text(val_el.group(2)) if val_el else "N/A"
+            if len(found) == 3:
+                break
+
+        data['financials'].update({
+            "EPS": found.get("eps", "N/A"),
+            "PE": found.get("pe", "N/A"),
+            "VonHoa": data['financials'].get('VonHoa', found.get("cap", "N/A"))
+        })
+        return data
+
+    def _parse_overview_soup(self, html_text, data):
+        """Full-tree BeautifulSoup parse (fallback)"""
         try:
-            r = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(r.text, 'html.parser')
+            from bs4 import BeautifulSoup  # heavy; only the fallback path needs it
+            soup = BeautifulSoup(html_text, 'html.parser')
             
             # --- 1. PRIORITY: OG Tags (Pre-rendered and usually live) ---
             og_desc = soup.find("meta", property="og:description")
             if og_desc and og_desc.get("content"):
-                content = og_desc["content"]
-                # Pattern: "Giá cổ phiếu ( chiều 06/02/2026): 26,800 VNĐ. Khối lượng 67,073,000"
-                # Price Extraction
-                p_match = re.search(r'Giá cổ phiếu[^(]*\([^)]*\):\s*([\d\.,]+)', content)
-                if p_match:
-                    data['price'] = float(p_match.group(1).replace(',', ''))
-                
-                # Volume Extraction
-                v_match = re.search(r'Khối lượng\s*([\d\.,]+)', content)
-                if v_match:
-                    data['volume'] = int(v_match.group(1).replace(',', ''))
-
-                # Market Cap Extraction
-                cap_match = re.search(r'Vốn hóa tt:\s*([\d\.,]+)', content)
-                if cap_match:
-                    data['financials']['VonHoa'] = cap_match.group(1)
+                self._parse_og_description(og_desc["content"], data)
 
             # --- 2. SECONDARY: BeautifulSoup Selectors (If OG fail or for extra data) ---
             if data['price'] == 0:
@@ -152,296 +412,345 @@ class DataEngine:
                 "PE": find_metric(["P/E", "Hệ số P/E"]),
                 "VonHoa": data['financials'].get('VonHoa', find_metric(["Vốn hóa", "Market Cap"]))
             })
-            
-            return data
         except Exception as e:
-            print(f"[DataEngine] Scrape Error for {url}: {e}")
-            return data
+            print(f"[DataEngine] Overview parse error: {e}")
+        return data
 
     def _get_ticker_news(self, ticker):
-        """Fetch latest raw news for a specific ticker from CafeF"""
-        raw_news = []
-        try:
-            url = f"https://s.cafef.vn/tin-doanh-nghiep/{ticker}/tin-moi-nhat.chn"
-            r = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(r.text, 'html.parser')
-            # Look for news in the common list structure on CafeF enterprise news page
-            # Usually .tlitem or inside specialized lists
-            items = soup.select('.tlitem') or soup.select('li.news-item') or soup.find_all('li', class_=re.compile('news-item|doc-item'))
-            for item in items[:10]:
-                h = item.find(['h3', 'h4', 'a'])
-                if h:
-                    title = h.get_text(strip=True)
-                    date_span = item.find(class_=re.compile('date|time'))
-                    date_str = date_span.get_text(strip=True) if date_span else ""
-                    raw_news.append(f"{date_str} - {title}")
-        except Exception as e:
-            print(f"[DataEngine] Ticker News Fetch Error: {e}")
-        return raw_news
+        """Latest raw news for a specific ticker from CafeF (via the news store)"""
+        with stage_timer("ticker_news", "cafef") as t:
+            try:
+                news = self.news.ticker_news(ticker)
+            except Exception as e:
+                print(f"[DataEngine] Ticker News Fetch Error: {e}")
+                t.outcome = "error"
+                return []
+            if not news:
+                t.outcome = "empty"
+            return news
 
     def _get_historical_prices(self, ticker):
-        """Fetch history with VNStockLite (PRIORITY), fallback to other APIs"""
+        """
+        History from the configured sources (NUKIDA_HISTORY_SOURCES, priority order).
+        sequential: try each in turn; hedged: start the next source whenever the previous one has
+        not answered within its hedge delay; race: start them all. First valid series wins.
+        """
         ticker = ticker.upper()
-        
-        # === PRIORITY 1: VNStockLite (Lightweight API wrapper) ===
+        sources = [(name, getattr(self, f"_history_{name}")) for name in self.history_sources
+                   if name != "finfo" or ticker == "VNINDEX"]  # finfo fast path is for the index only
+
+        if self.history_mode == "sequential":
+            for name, fetch in sources:
+                history = self._try_history_source(name, fetch, ticker)
+                if self._valid_history(history):
+                    self._record_history_win(name)
+                    return history
+        else:
+            history = self._hedged_history(ticker, sources)
+            if history is not None:
+                return history
+
+        # === FINAL FALLBACK: No data ===
+        print(f"[WARNING] ALL APIs FAILED for {ticker} history!")
+        return BarSeries.empty()
+
+    def _hedged_history(self, ticker, sources):
+        queue = list(sources)
+        futures = {}
+        pending = set()
+
+        def launch():
+            name, fetch = queue.pop(0)
+            future = self._hedge_executor.submit(contextvars.copy_context().run, self._try_history_source, name, fetch, ticker)
+            futures[future] = name
+            pending.add(future)
+            if len(futures) > 1:
+                with self._history_lock:
+                    self.history_stats_counts["hedges"] += 1
+
+        launch()
+        if self.history_mode == "race":
+            while queue:
+                launch()
+
+        next_at = time.perf_counter() + self._hedge_delay(0)
+        while pending:
+            # Wait for an answer, but only until the next hedge is due while sources remain
+            timeout = max(0.0, next_at - time.perf_counter()) if queue else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                history = future.result()
+                if self._valid_history(history):
+                    name = futures[future]
+                    for other in pending:
+                        other.cancel()  # Not started yet -> never runs; running ones are left to time out
+                    if len(futures) > 1:
+                        print(f"[DataEngine] History {ticker}: {name} won the race ({len(futures)} sources started)")
+                    self._record_history_win(name)
+                    return history
+            # Hedge delay elapsed, or a source failed: start the next one now
+            if queue:
+                launch()
+                next_at = time.perf_counter() + self._hedge_delay(len(futures) - 1)
+        return None
+
+    def _hedge_delay(self, index):
+        delays = self.hedge_delays or [0.0]
+        return delays[min(index, len(delays) - 1)]
+
+    def _try_history_source(self, name, fetch, ticker):
+        started = time.perf_counter()
         try:
-            print(f"[DataEngine] Trying VNStockLite API: {ticker}...")
-            from services.vnstock_lite import VNStockLite
-            vsl = VNStockLite()
-            
-            # Get 3 months of data
-            df = vsl.get_historical_data(
-                symbol=ticker, 
-                data_type="index" if ticker == "VNINDEX" else "stock"
-            )
-            
-            if df:
-                print(f"[OK] VNStockLite SUCCESS: {len(df)} bars for {ticker}")
-                return df
+            history = fetch(ticker)
+        except (UpstreamUnavailable, UpstreamThrottled) as e:
+            print(f"[DataEngine] History source {name} skipped for {ticker}: {e}")
+            observe_stage("history_source", time.perf_counter() - started, name, "skipped")
+            return None
         except Exception as e:
-            print(f"[DataEngine] VNStockLite failed: {e}")
-        
-        # === FALLBACK 1: VNINDEX from VNDirect ===
-        if ticker == "VNINDEX":
-            try:
-                print(f"[DataEngine] Fast path for VNINDEX...")
-                url = "https://finfo-api.vndirect.com.vn/v4/stock_prices?query=code:VNINDEX&size=100&sort=date:desc"
-                r = self.session.get(url, timeout=5)
-                if r.status_code == 200:
-                    data = r.json().get('data', [])
-                    if data:
-                        history = []
-                        for item in data:
-                            history.append({
-                                "date": datetime.strptime(item['date'], '%Y-%m-%d').strftime('%d/%m/%Y'),
-                                "open": float(item.get('adOpen', item.get('adClose', 0))),
-                                "high": float(item.get('adHigh', item.get('adClose', 0))),
-                                "low": float(item.get('adLow', item.get('adClose', 0))),
-                                "close": float(item.get('adClose', 0)),
-                                "volume": float(item.get('nmVolume', 0))
-                            })
-                        history.reverse()
-                        return history
-            except: pass
-        
-        # === FALLBACK 2: Yahoo Finance ===
-        try:
-            import yfinance as yf
-            yahoo_ticker = "^VNI" if ticker == "VNINDEX" else f"{ticker}.VN"
+            print(f"[DataEngine] History source {name} failed for {ticker}: {type(e).__name__}: {e}")
+            observe_stage("history_source", time.perf_counter() - started, name, "error")
+            return None
+        elapsed = time.perf_counter() - started
+        if not self._valid_history(history):
+            print(f"[DataEngine] History source {name} returned no usable bars for {ticker} ({elapsed:.2f}s)")
+            observe_stage("history_source", elapsed, name, "empty")
+        else:
+            observe_stage("history_source", elapsed, name)
+        return history
+
+    @staticmethod
+    def _valid_history(history):
+        return bool(history) and float(history.close[-1]) > 0
+
+    def _record_history_win(self, name):
+        with self._history_lock:
+            self.history_stats_counts["wins"][name] = self.history_stats_counts["wins"].get(name, 0) + 1
+
+    def history_stats(self):
+        with self._history_lock:
+            return {
+                "mode": self.history_mode,
+                "sources": list(self.history_sources),
+                "hedge_delays": list(self.hedge_delays),
+                "hedges_started": self.history_stats_counts["hedges"],
+                "wins": dict(self.history_stats_counts["wins"])
+            }
+
+    # === History sources: each returns a BarSeries (empty / exception = failure) ===
+    def _history_dchart(self, ticker):
+        """VNStockLite (VNDirect DChart + local bar store)"""
+        print(f"[DataEngine] Trying VNStockLite API: {ticker}...")
+        history = self.vnstock.get_bar_series(
+            symbol=ticker,
+            data_type="index" if ticker == "VNINDEX" else "stock"
+        )
+        if history:
+            print(f"[OK] VNStockLite SUCCESS: {len(history)} bars for {ticker}")
+        return history
+
+    def _history_finfo(self, ticker):
+        """VNINDEX from VNDirect finfo"""
+        print(f"[DataEngine] Fast path for VNINDEX...")
+        url = f"https://finfo-api.vndirect.com.vn/v4/stock_prices?query=code:{ticker}&size=100&sort=date:desc"
+        r = guarded_get(self.session, url, registry=self.health, limiter=self.limiter, timeout=5)
+        if r.status_code != 200:
+            return BarSeries.empty()
+        rows = []
+        for item in r.json().get('data', []):
+            rows.append((
+                self._epoch_day(item['date']),
+                float(item.get('adOpen', item.get('adClose', 0))),
+                float(item.get('adHigh', item.get('adClose', 0))),
+                float(item.get('adLow', item.get('adClose', 0))),
+                float(item.get('adClose', 0)),
+                float(item.get('nmVolume', 0))
+            ))
+        rows.reverse()
+        return BarSeries.from_rows(rows)
+
+    def _history_yahoo(self, ticker):
+        """Yahoo Finance (optional yfinance dependency)"""
+        import yfinance as yf
+        yahoo_ticker = "^VNI" if ticker == "VNINDEX" else f"{ticker}.VN"
+        with self.limiter.admit("query1.finance.yahoo.com"), self.health.track("query1.finance.yahoo.com"):
             hist = yf.download(yahoo_ticker, period="3mo", interval="1d", progress=False, timeout=2)
-            if not hist.empty:
-                history = []
-                for date, row in hist.iterrows():
-                    history.append({
-                        "date": date.strftime('%d/%m/%Y'),
-                        "open": float(row['Open']),
-                        "high": float(row['High']),
-                        "low": float(row['Low']),
-                        "close": float(row['Close']),
-                        "volume": float(row['Volume'])
-                    })
-                if history: return history
-        except: pass
-        
-        # === FALLBACK 3: SSI API ===
-        try:
-            print(f"[DataEngine] Trying SSI API: {ticker}...")
-            ssi_url = f"https://iboard-query.ssi.com.vn/stock/second/history/{ticker}/1M"
-            r = self.session.get(ssi_url, timeout=3)
-            if r.status_code == 200:
-                data = r.json()
-                if data and isinstance(data, dict) and 'data' in data:
-                    items = data['data']
-                    if items:
-                        history = []
-                        for item in items[:50]:
-                            try:
-                                date_str = item.get('tradingDate', '')
-                                if date_str:
-                                    d_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                                    formatted_date = d_obj.strftime('%d/%m/%Y')
-                                    
-                                    history.append({
-                                        "date": formatted_date,
-                                        "open": float(item.get('openPrice', item.get('closePrice', 0))),
-                                        "high": float(item.get('highestPrice', item.get('closePrice', 0))),
-                                        "low": float(item.get('lowestPrice', item.get('closePrice', 0))),
-                                        "close": float(item.get('closePrice', 0)),
-                                        "volume": float(item.get('totalVolume', 0))
-                                    })
-                            except:
-                                continue
-                        
-                        if history:
-                            history.reverse()
-                            return history
-        except: pass
-        
-        # === FINAL FALLBACK: No data ===
-        print(f"[WARNING] ALL APIs FAILED for {ticker} history!")
-        return []
+        # An empty frame is a data outcome (unlisted / delisted symbol), not a host failure: it must not
+        # trip the Yahoo breaker. _try_history_source records it as outcome "empty".
+        if hist.empty:
+            return BarSeries.empty()
+        return BarSeries(
+            [self._epoch_day(d.strftime('%Y-%m-%d')) for d in hist.index],
+            hist['Open'].to_numpy().ravel(),
+            hist['High'].to_numpy().ravel(),
+            hist['Low'].to_numpy().ravel(),
+            hist['Close'].to_numpy().ravel(),
+            hist['Volume'].to_numpy().ravel()
+        )
+
+    def _history_ssi(self, ticker):
+        """SSI iBoard"""
+        print(f"[DataEngine] Trying SSI API: {ticker}...")
+        ssi_url = f"https://iboard-query.ssi.com.vn/stock/second/history/{ticker}/1M"
+        r = guarded_get(self.session, ssi_url, registry=self.health, limiter=self.limiter, timeout=3)
+        if r.status_code != 200:
+            return BarSeries.empty()
+        data = r.json()
+        if not (data and isinstance(data, dict) and data.get('data')):
+            return BarSeries.empty()
+        rows = []
+        for item in data['data'][:50]:
+            date_str = item.get('tradingDate', '')
+            if not date_str:
+                continue
+            try:
+                rows.append((
+                    self._epoch_day(date_str),
+                    float(item.get('openPrice', item.get('closePrice', 0))),
+                    float(item.get('highestPrice', item.get('closePrice', 0))),
+                    float(item.get('lowestPrice', item.get('closePrice', 0))),
+                    float(item.get('closePrice', 0)),
+                    float(item.get('totalVolume', 0))
+                ))
+            except (TypeError, ValueError):
+                continue
+        rows.reverse()
+        return BarSeries.from_rows(rows)
+
+    @staticmethod
+    def _epoch_day(date_str):
+        """'YYYY-MM-DD' -> epoch seconds at 00:00 UTC (same convention as DChart daily bars)"""
+        return int(datetime.strptime(date_str[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
 
     
 
     def _calculate_technicals(self, history):
         """
-        Calculates a suite of technical indicators:
-        - SMA 20, EMA 20
+        Calculates a suite of technical indicators (vectorized, see services/indicators.py):
+        - SMA 20, EMA 20/50
         - Bollinger Bands (20, 2)
-        - RSI (14)
-        - MACD (12, 26, 9) - Basic implementation
-        - Volume Analysis
+        - RSI (14, Wilder)
+        - MACD (12, 26, 9) with signal line & histogram
+        - ATR (14), Volume MA 5/20
+        Returns the values at the last bar.
         """
-        if len(history) < 30: # Need enough data for calculations
-            return {"status": "Không đủ dữ liệu (khuyến nghị tối thiểu 30 ngày)"}
+        with stage_timer("technicals"):
+            return self.calculate_technicals_batch([history])[0]
 
-        closes = [d['close'] for d in history]
-        # volumes = [d.get('volume', 0) for d in history] # CafeF history might not have vol in all rows, let's check
-        current_price = closes[-1]
-        
-        # 1. Moving Averages
-        sma20 = sum(closes[-20:]) / 20
-        
-        # Simple EMA calculation
-        def calculate_ema(data, period):
-            k = 2 / (period + 1)
-            ema = data[0]
-            for price in data[1:]:
-                ema = (price * k) + (ema * (1 - k))
-            return ema
-
-        ema20 = calculate_ema(closes[-40:], 20) # Use a bit more data for EMA stability
-        ema50 = calculate_ema(closes[-50:], 50) if len(closes) >= 50 else sma20
-
-        # 2. Bollinger Bands (20, 2)
-        variance = sum((x - sma20) ** 2 for x in closes[-20:]) / 20
-        std_dev = math.sqrt(variance)
-        bb_upper = sma20 + (std_dev * 2)
-        bb_lower = sma20 - (std_dev * 2)
-
-        # 3. RSI 14
-        deltas = [closes[i] - closes[i-1] for i in range(1, len(closes))]
-        recent_deltas = deltas[-14:]
-        gains = [d for d in recent_deltas if d > 0]
-        losses = [abs(d) for d in recent_deltas if d < 0]
-        
-        avg_gain = sum(gains) / 14
-        avg_loss = sum(losses) / 14
-        
-        if avg_loss == 0: rsi = 100
-        else:
-            rs = avg_gain / avg_loss
-            rsi = 100 - (100 / (1 + rs))
-
-        # 4. MACD (Basic)
-        ema12 = calculate_ema(closes[-26-12:], 12)
-        ema26 = calculate_ema(closes[-26:], 26)
-        macd_line = ema12 - ema26
-        # Signal line would be EMA 9 of MACD line, but we need time-series of MACD line for that.
-        # For simplicity, we'll just provide MACD line and Trend.
-
-        # 5. Trend & Signals
-        trend = "ĐI NGANG"
-        if current_price > ema20 and ema20 > ema50: trend = "TĂNG MẠNH"
-        elif current_price > ema20: trend = "XU HƯỚNG TĂNG"
-        elif current_price < ema20 and ema20 < ema50: trend = "GIẢM MẠNH"
-        elif current_price < ema20: trend = "XU HƯỚNG GIẢM"
-
-        # Signal Logic (Simple)
-        signal = "CHỜ"
-        if rsi < 35 and current_price <= bb_lower: signal = "MUA (HỖ TRỢ/QUÁ BÁN)"
-        elif rsi > 65 and current_price >= bb_upper: signal = "BÁN (KHÁNG CỰ/QUÁ MUA)"
-        elif trend == "XU HƯỚNG TĂNG" and rsi < 50: signal = "MUA (THEO TREND)"
-        
+    def calculate_technicals_batch(self, histories):
+        """
+        Technicals for many tickers at once: one batched computation over a 2-D (tickers x bars) array.
+        `histories` holds BarSeries (legacy lists of dicts are converted).
+        """
+        from services import indicators
+
+        histories = [BarSeries.from_records(h) if isinstance(h, list) else h for h in histories]
+        results = [None] * len(histories)
+        rows = []
+        for i, history in enumerate(histories):
+            if not history or len(history) < 30: # Need enough data for calculations
+                results[i] = {"status": "Không đủ dữ liệu (khuyến nghị tối thiểu 30 ngày)"}
+            else:
+                rows.append(i)
+        if not rows:
+            return results
+
+        def column(key):
+            return indicators.stack([getattr(histories[i], key) for i in rows])
+
+        ind = indicators.compute(column('close'), column('high'), column('low'), column('volume'))
+        for r, i in enumerate(rows):
+            results[i] = indicators.latest(ind, row=r)
+        return results
+
+    def get_intraday(self, ticker, resolution="15m", days=None):
+        """
+        Intraday bars (VNDirect DChart, DChart units) + technicals from the streaming indicator state.
+        Bars already applied are never recomputed: a refresh revises the running bar and appends new ones.
+        """
+        from services.indicator_state import TechnicalsState
+
+        if resolution not in INTRADAY_RESOLUTIONS:
+            raise ValueError(f"resolution phải là một trong {', '.join(INTRADAY_RESOLUTIONS)}")
+        ticker = ticker.upper()
+        days = days or INTRADAY_RESOLUTIONS[resolution]
+        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        history = self.vnstock.get_bar_series(ticker, start_date=start_date, resolution=resolution,
+                                              data_type="index" if ticker == "VNINDEX" else "stock")
+        if not history:
+            return {"status": "error", "message": f"Không có dữ liệu {resolution} cho mã {ticker}"}
+
+        key = (ticker, resolution)
+        started = time.perf_counter()
+        with self._intraday_lock:
+            state = self._intraday_states.pop(key, None)
+            # Reseed when the state's last bar is no longer in the window (gap, or a shorter lookback)
+            if state is None or state.last_ts < history.t[0] or state.last_ts > history.t[-1]:
+                state = TechnicalsState.from_series(history)
+                applied, mode = len(history), "seeded"
+            else:
+                applied, mode = state.apply(history), "incremental"
+            self._intraday_states[key] = state
+            while len(self._intraday_states) > self.max_intraday_states:
+                self._intraday_states.popitem(last=False)
+            technicals = state.technicals()
+        print(f"[DataEngine] Intraday {ticker} {resolution}: {mode}, {applied} bars applied "
+              f"in {(time.perf_counter() - started) * 1000:.2f} ms")
+        # Deterministic for unchanged bars, so repeat polls can be answered with 304 (ETag)
         return {
-            "current_price": current_price,
-            "sma20": round(sma20, 2),
-            "ema20": round(ema20, 2),
-            "bb_upper": round(bb_upper, 2),
-            "bb_lower": round(bb_lower, 2),
-            "rsi_14": round(rsi, 2),
-            "macd_line": round(macd_line, 2),
-            "trend": trend,
-            "signal": signal
+            "ticker": ticker,
+            "resolution": resolution,
+            "price": float(history.close[-1]),
+            "price_unit": 1 if ticker == "VNINDEX" else 1000,
+            "chart_data": history.to_json(),
+            "technicals": technicals,
+            "status": "success"
         }
 
     def get_market_highlights(self):
         """Fetch VN-Index and hot news using VNStockLite for price stability"""
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': '*/*',
-            'Cache-Control': 'no-cache'
-        })
-
-        result = {
-            "index": {"code": "VNINDEX", "price": 0, "change": 0, "changePercent": 0, "history": []},
-            "news": []
+        index = self.get_highlights_index()
+        news = self.get_highlights_news()
+        return {
+            "index": index or {"code": "VNINDEX", "price": 0, "change": 0, "changePercent": 0, "history": []},
+            # Fallback News
+            "news": news or list(FALLBACK_NEWS)
         }
-        
-        # 1. VNINDEX Fetch via VNStockLite (Stable)
+
+    def get_highlights_index(self):
+        """VNINDEX price, change and history (legacy records); None if no source answered"""
         try:
             print("[DataEngine] Fetching VNINDEX from VNStockLite...")
-            from services.vnstock_lite import VNStockLite
-            vsl = VNStockLite()
             # Get history (default 90 days)
-            history = vsl.get_historical_data("VNINDEX", resolution="1D")
-            
-            if history and len(history) > 0:
-                result['index']['history'] = history
-                latest = history[-1]
-                
-                price = latest['close']
-                result['index']['price'] = price
-                
-                if len(history) >= 2:
-                    prev = history[-2]
-                    change = price - prev['close']
-                    pct = (change / prev['close']) * 100
-                    result['index']['change'] = round(change, 2)
-                    result['index']['changePercent'] = round(pct, 2)
-                    print(f"[DataEngine] VNINDEX Updated: {price} ({change:+.2f})")
-                else:
-                    print(f"[DataEngine] VNINDEX Updated: {price} (No prev data)")
-            else:
-                 print("[DataEngine] VNStockLite returned no history for VNINDEX")
-
+            history = self.vnstock.get_historical_data("VNINDEX", resolution="1D", data_type="index")
         except Exception as e:
             print(f"[DataEngine] VNINDEX Fetch Error: {e}")
+            return None
+        if not history:
+            print("[DataEngine] VNStockLite returned no history for VNINDEX")
+            return None
+
+        price = history[-1]['close']
+        index = {"code": "VNINDEX", "price": price, "change": 0, "changePercent": 0, "history": history}
+        if len(history) >= 2:
+            prev = history[-2]['close']
+            change = price - prev
+            index['change'] = round(change, 2)
+            index['changePercent'] = round((change / prev) * 100, 2)
+            print(f"[DataEngine] VNINDEX Updated: {price} ({change:+.2f})")
+        else:
+            print(f"[DataEngine] VNINDEX Updated: {price} (No prev data)")
+        return index
 
-        # 2. News Scraping (CafeF)
+    def get_highlights_news(self, limit=5):
+        """Top market news from CafeF as [{title, url}]; empty list on failure"""
         try:
-            print(f"[DataEngine] Scraping News from CafeF...")
-            news_url = "https://cafef.vn/thi-truong-chung-khoan.chn"
-            r_news = self.session.get(news_url, timeout=10)
-            if r_news.status_code == 200:
-                soup = BeautifulSoup(r_news.text, 'html.parser')
-                items = soup.select('.tlitem') or soup.select('.tr-item') or soup.select('li.news-item') or soup.select('.itemnews')
-                
-                for item in items:
-                    if len(result['news']) >= 5: break
-                    h = item.find(['h3', 'h2', 'a'])
-                    if h:
-                        title = h.get_text(strip=True)
-                        if len(title) < 20: continue
-                        a = item.find('a') if item.name != 'a' else item
-                        if a and a.get('href'):
-                            link = a['href']
-                            if link.startswith('/'): link = "https://cafef.vn" + link
-                            if not any(n['title'] == title for n in result['news']):
-                                result['news'].append({"title": title, "url": link})
+            print(f"[DataEngine] Reading market news from CafeF store...")
+            # Per-request headers: the shared session is used by other threads
+            return self.news.market_news(limit, headers=HIGHLIGHTS_HEADERS)
         except Exception as e:
             print(f"[DataEngine] CafeF Scraping failed: {e}")
-
-        # 3. Fallback News
-        if not result['news']:
-             result['news'] = [
-                {"title": "Thị trường: Nhà đầu tư chờ đợi tín hiệu từ KQKD quý mới", "url": "https://cafef.vn"},
-                {"title": "Dòng tiền khối ngoại đang có xu hướng quay trở lại", "url": "https://cafef.vn"},
-                {"title": "Góc nhìn kỹ thuật: VN-Index đang tích lũy tại vùng hỗ trợ", "url": "https://cafef.vn"}
-            ]
-        
-        result['news'] = result['news'][:5]
-        return result
+            return []
 
     def _fallback_mock(self, ticker):
         return {
@@ -0,0 +1,204 @@
+"""
+Upstream health registry + circuit breaker theo từng host (CafeF, DChart, finfo, Yahoo, SSI)
+- closed: gọi bình thường, ghi nhận thành công / lỗi / độ trễ trong cửa sổ trượt
+- open: host lỗi liên tục -> bỏ qua ngay (không tốn timeout) cho tới hết cooldown
+- half_open: hết cooldown -> cho một request thăm dò; thành công thì đóng lại, lỗi thì mở tiếp
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+from services.metrics import UPSTREAM_SECONDS
+from services.ratelimit import get_default_limiter
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Statuses that mean "this host is not serving us" (404 is a bad ticker, not a bad host)
+FAILURE_STATUSES = (403, 429, 500, 502, 503, 504)
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit is open"""
+
+
+class _Probe:
+    __slots__ = ("error",)
+
+    def __init__(self):
+        self.error = None
+
+    def fail(self, error):
+        self.error = error
+
+
+class _Host:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (ok, latency seconds)
+        self.errors = Counter()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_at = 0.0
+        self.last_error = None
+        self.last_error_at = None
+        self.skipped = 0
+        self.trips = 0
+
+
+class HealthRegistry:
+    """
+    Per-host rolling health. A host trips open after `failure_threshold` consecutive failures, or when
+    the failure rate over the window exceeds `failure_rate` (with at least `min_samples` samples).
+    """
+
+    def __init__(self, window=None, failure_threshold=None, failure_rate=None, min_samples=None, cooldown=None):
+        env = os.environ.get
+        self.window = window or int(env('NUKIDA_HEALTH_WINDOW', 50))
+        self.failure_threshold = failure_threshold or int(env('NUKIDA_BREAKER_FAILURES', 5))
+        self.failure_rate = failure_rate or float(env('NUKIDA_BREAKER_FAILURE_RATE', 0.5))
+        self.min_samples = min_samples or int(env('NUKIDA_BREAKER_MIN_SAMPLES', 10))
+        self.cooldown = cooldown or float(env('NUKIDA_BREAKER_COOLDOWN', 30))
+        self.enabled = env('NUKIDA_BREAKER', '1') != '0'
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = _Host(self.window)
+        return entry
+
+    def allow(self, host):
+        """Whether a call to `host` may go out now. In half-open only one probe is let through at a time."""
+        if not self.enabled:
+            return True
+        with self._lock:
+            entry = self._host(host)
+            if entry.state == OPEN:
+                if time.time() - entry.opened_at < self.cooldown:
+                    entry.skipped += 1
+                    return False
+                entry.state = HALF_OPEN
+                entry.probing = False
+                print(f"[Health] {host} half-open, probing")
+            if entry.state == HALF_OPEN:
+                # A probe that never reported back (abandoned call) stops blocking after one cooldown
+                if entry.probing and time.time() - entry.probe_at < self.cooldown:
+                    entry.skipped += 1
+                    return False
+                entry.probing = True
+                entry.probe_at = time.time()
+            return True
+
+    def record(self, host, ok, latency, error=None):
+        UPSTREAM_SECONDS.observe(latency, host, "ok" if ok else error or "error")
+        with self._lock:
+            entry = self._host(host)
+            entry.samples.append((ok, latency))
+            if ok:
+                entry.consecutive_failures = 0
+                if entry.state != CLOSED:
+                    print(f"[Health] {host} recovered, circuit closed")
+                    # Failures from before the outage would re-trip the failure-rate check right away
+                    entry.samples.clear()
+                    entry.samples.append((ok, latency))
+                entry.state = CLOSED
+                entry.probing = False
+                return
+            entry.consecutive_failures += 1
+            entry.errors[error] += 1
+            entry.last_error = error
+            entry.last_error_at = time.time()
+            failures = sum(1 for s in entry.samples if not s[0])
+            tripped = (entry.state == HALF_OPEN
+                       or entry.consecutive_failures >= self.failure_threshold
+                       or (len(entry.samples) >= self.min_samples and failures / len(entry.samples) >= self.failure_rate))
+            if tripped and self.enabled:
+                if entry.state != OPEN:
+                    entry.trips += 1
+                    print(f"[Health] {host} circuit OPEN after {entry.consecutive_failures} failures "
+                          f"(last: {error}), retry in {self.cooldown:g}s")
+                entry.state = OPEN
+                entry.opened_at = time.time()
+                entry.probing = False
+
+    @contextmanager
+    def track(self, host):
+        """
+        Guard one upstream call: raises UpstreamUnavailable if the circuit is open, records latency and
+        outcome. Exceptions count as failures (keyed by type); the caller can also mark a failure with probe.fail().
+        """
+        if not self.allow(host):
+            raise UpstreamUnavailable(f"{host} circuit open")
+        probe = _Probe()
+        started = time.perf_counter()
+        try:
+            yield probe
+        except Exception as e:
+            self.record(host, False, time.perf_counter() - started, type(e).__name__)
+            raise
+        self.record(host, probe.error is None, time.perf_counter() - started, probe.error)
+
+    def snapshot(self):
+        """State, rolling success rate, latency percentiles and error mix for every host seen"""
+        now = time.time()
+        out = {}
+        with self._lock:
+            for host, entry in sorted(self._hosts.items()):
+                latencies = sorted(s[1] for s in entry.samples)
+                ok = sum(1 for s in entry.samples if s[0])
+                out[host] = {
+                    "state": entry.state,
+                    "samples": len(entry.samples),
+                    "success_rate": round(ok / len(entry.samples), 3) if entry.samples else None,
+                    "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    "latency_p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+                    "consecutive_failures": entry.consecutive_failures,
+                    "errors": dict(entry.errors),
+                    "last_error": entry.last_error,
+                    "last_error_age_s": round(now - entry.last_error_at, 1) if entry.last_error_at else None,
+                    "retry_in_s": round(max(0.0, self.cooldown - (now - entry.opened_at)), 1) if entry.state == OPEN else 0,
+                    "skipped": entry.skipped,
+                    "trips": entry.trips
+                }
+        return out
+
+
+def host_of(url):
+    return urlsplit(url).hostname or url
+
+
+def guarded_get(session, url, registry=None, limiter=None, max_wait=None, **kwargs):
+    """
+    session.get through the host's rate limiter (UpstreamThrottled past `max_wait`) and circuit breaker.
+    Blocking/5xx statuses count as failures; a throttled call never reaches the breaker.
+    """
+    registry = registry or get_default_registry()
+    limiter = limiter or get_default_limiter()
+    host = host_of(url)
+    with limiter.admit(host, max_wait), registry.track(host) as probe:
+        r = session.get(url, **kwargs)
+        if r.status_code in FAILURE_STATUSES:
+            probe.fail(f"http_{r.status_code}")
+        return r
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_default_registry():
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HealthRegistry()
+        return _default
+
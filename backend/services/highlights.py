@@ -0,0 +1,142 @@
+"""
+Market highlights (VN-Index + tin nóng CafeF) phục vụ từ snapshot trong bộ nhớ
+- Người đọc luôn nhận ngay giá trị tốt gần nhất (stale-while-revalidate)
+- Thread nền làm mới theo lịch: dày trong phiên, thưa ngoài giờ giao dịch
+- Phần nào làm mới thất bại thì giữ lại phần cũ (index / news độc lập)
+"""
+import copy
+import os
+import threading
+import time
+
+from services import market_calendar
+from services.data_engine import FALLBACK_NEWS
+from services.singleflight import SingleFlight
+
+
+class HighlightsService:
+    def __init__(self, data_engine, session_interval=None, offhours_interval=None):
+        env = os.environ.get
+        self.data_engine = data_engine
+        self.session_interval = session_interval or float(env('NUKIDA_HIGHLIGHTS_INTERVAL', 60))
+        self.offhours_interval = offhours_interval or float(env('NUKIDA_HIGHLIGHTS_OFFHOURS_INTERVAL', 1800))
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._updated_at = None
+        self._refreshing = False
+        self._flight = SingleFlight()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_duration = None
+
+    def interval(self, now=None):
+        """Refresh period: short in session, long when closed but never sleeping past the next open"""
+        if market_calendar.is_trading_hours(now):
+            return self.session_interval
+        return max(self.session_interval, min(self.offhours_interval, market_calendar.seconds_until_next_open(now)))
+
+    def _stale_after(self):
+        # Headroom so a snapshot the scheduler is about to replace is not refreshed twice
+        return self.interval() * 1.5
+
+    def get(self):
+        """Last good snapshot, instantly. Only the very first call waits for a fetch."""
+        with self._lock:
+            snapshot = self._snapshot
+            updated_at = self._updated_at
+        if snapshot is None:
+            self.refresh()
+        elif time.time() - updated_at > self._stale_after():
+            # Stale (e.g. no background thread on serverless): serve it and revalidate behind the response
+            self.refresh_async()
+        return self._view()
+
+    def _view(self):
+        with self._lock:
+            if self._snapshot is None:
+                return None
+            age = time.time() - self._updated_at
+            view = copy.deepcopy(self._snapshot)
+            view["updated_at"] = self._updated_at
+            view["age_seconds"] = round(age, 1)
+            view["stale"] = age > self._stale_after()
+            view["refreshing"] = self._refreshing
+        return view
+
+    def refresh(self):
+        """Fetch now (concurrent callers share one fetch)"""
+        self._flight.do("highlights", self._refresh)
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="HighlightsRefresh", daemon=True).start()
+
+    def _refresh(self):
+        with self._lock:
+            self._refreshing = True
+        started = time.perf_counter()
+        try:
+            index = self.data_engine.get_highlights_index()
+            news = self.data_engine.get_highlights_news()
+        except Exception as e:
+            index, news = None, []
+            print(f"[Highlights] Refresh error: {e}")
+        with self._lock:
+            self._refreshing = False
+            self.refreshes += 1
+            self.last_duration = round(time.perf_counter() - started, 3)
+            old = self._snapshot
+            if not index and not news and old is not None:
+                self.failures += 1
+                self.last_error = "all sources failed, serving previous snapshot"
+                print(f"[Highlights] Refresh failed, keeping snapshot from {time.time() - self._updated_at:.0f}s ago")
+                return
+            if not index or not news:
+                self.failures += 1
+                self.last_error = "index unavailable" if not index else "news unavailable"
+            else:
+                self.last_error = None
+            self._snapshot = {
+                "index": index or (old or {}).get("index") or {"code": "VNINDEX", "price": 0, "change": 0, "changePercent": 0, "history": []},
+                "news": news or (old or {}).get("news") or list(FALLBACK_NEWS)
+            }
+            self._updated_at = time.time()
+
+    # --- Background refresher ---
+    def start(self):
+        """Start the scheduler thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name="HighlightsRefresher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        print("[Highlights] Background refresher started")
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "last_duration": self.last_duration,
+                "age_seconds": round(time.time() - self._updated_at, 1) if self._updated_at else None,
+                "interval": self.interval(),
+                "background": self._thread is not None
+            }
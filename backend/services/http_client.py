@@ -0,0 +1,121 @@
+"""
+Pooled keep-alive HTTP client
+Tái sử dụng kết nối TLS (urllib3 pool), có timeout connect/read và retry có jitter cho 429/5xx.
+Tùy chọn đi qua UpstreamLimiter (mỗi lần thử tính là một request tới host).
+"""
+import random
+import threading
+import time
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.ratelimit import UpstreamThrottled
+
+
+class PooledClient:
+    """Thread-safe client: one requests.Session with a bounded connection pool per host"""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # A non-idempotent request (the Perplexity POST) may already have been processed and billed after a
+    # read timeout or a 500/502/504: retried only when it surely was not (connect failure, 429, 503)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+    UNSENT_RETRY_STATUSES = (429, 503)
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=90,
+                 max_retries=2, backoff=0.5, max_backoff=8.0, limiter=None, max_wait=None):
+        self.limiter = limiter
+        self.max_wait = max_wait
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send with bounded retries (jittered exponential backoff, Retry-After honoured) on
+        connection errors, timeouts and 429/5xx. The final response is returned whatever its status.
+        UpstreamThrottled (limiter wait deadline exceeded) is raised at once, never retried.
+        Non-idempotent methods are retried only on connection errors and 429/503.
+        """
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        host = urlsplit(url).hostname
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        retry_statuses = self.RETRY_STATUSES if idempotent else self.UNSENT_RETRY_STATUSES
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.limiter.admit(host, self.max_wait) if self.limiter else nullcontext():
+                    with self._lock:
+                        self.requests += 1
+                    r = self.session.request(method, url, timeout=timeout, **kwargs)
+            except UpstreamThrottled:
+                with self._lock:
+                    self.failures += 1
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # ConnectTimeout is a ConnectionError; a ReadTimeout on a POST may have been processed
+                read_timeout = not isinstance(e, requests.ConnectionError)
+                if attempt >= self.max_retries or (read_timeout and not idempotent):
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                delay = self._delay(attempt)
+                print(f"[HTTP] {type(e).__name__} on {url}, retry {attempt + 1} in {delay:.2f}s")
+            else:
+                if r.status_code not in retry_statuses or attempt >= self.max_retries:
+                    return r
+                delay = self._delay(attempt, r.headers.get('Retry-After'))
+                print(f"[HTTP] {r.status_code} from {url}, retry {attempt + 1} in {delay:.2f}s")
+                r.close()
+            with self._lock:
+                self.retries += 1
+            time.sleep(delay)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # Full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def stats(self):
+        """Request / retry counts and how many requests reused an already-open connection"""
+        pools = self._adapter.poolmanager.pools
+        opened = 0
+        served = 0
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "connections_opened": opened,
+                "connections_reused": max(served - opened, 0)
+            }
@@ -0,0 +1,186 @@
+"""
+HTTP server với worker pool cố định cho backend/main.py (thay ThreadingTCPServer: một thread / kết nối, không giới hạn)
+- NUKIDA_WORKERS thread xử lý kết nối, hàng đợi tối đa NUKIDA_QUEUE_DEPTH kết nối đang chờ
+- Hàng đợi đầy (hoặc đang tắt) -> 503 + Retry-After; một client giữ quá NUKIDA_MAX_CONN_PER_CLIENT
+  kết nối -> 429 + Retry-After (0 = không giới hạn, nên tắt khi chạy sau reverse proxy)
+- Stream SSE giữ worker suốt cuộc gọi LLM: tối đa NUKIDA_MAX_STREAMS stream cùng lúc (mặc định nửa số worker),
+  vượt quá -> 503 + Retry-After
+- Tắt êm: ngừng nhận kết nối, xử lý nốt các request đang chạy / đang chờ trong NUKIDA_SHUTDOWN_GRACE giây
+"""
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+
+_REASONS = {429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+class WorkerPoolHTTPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=None, queue_depth=None,
+                 max_conn_per_client=None, retry_after=None, max_streams=None):
+        env = os.environ.get
+        self.workers = workers or int(env('NUKIDA_WORKERS', 16))
+        self.queue_depth = queue_depth or int(env('NUKIDA_QUEUE_DEPTH', 64))
+        self.max_conn_per_client = max_conn_per_client if max_conn_per_client is not None else int(env('NUKIDA_MAX_CONN_PER_CLIENT', 32))
+        self.retry_after = retry_after or int(env('NUKIDA_RETRY_AFTER', 2))
+        self.max_streams = max_streams or int(env('NUKIDA_MAX_STREAMS', max(1, self.workers // 2)))
+
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._lock = threading.Lock()
+        self._per_client = {}  # ip -> connections queued or in service
+        self._busy = 0
+        self._streams = 0
+        self._draining = False
+        self.counts = {"accepted": 0, "served": 0, "rejected_429": 0, "rejected_503": 0,
+                       "rejected_streams": 0, "errors": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        super().__init__(server_address, handler_class)
+        self._threads = [threading.Thread(target=self._worker, name=f"HTTPWorker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    # --- Accept thread ---
+    def process_request(self, request, client_address):
+        """Called by serve_forever for each accepted connection: queue it or turn it away"""
+        ip = client_address[0]
+        status = None
+        with self._lock:
+            if self._draining:
+                status = 503
+            elif self.max_conn_per_client and self._per_client.get(ip, 0) >= self.max_conn_per_client:
+                status = 429
+            else:
+                try:
+                    self._queue.put_nowait((request, client_address, time.monotonic()))
+                except queue.Full:
+                    status = 503
+            if status:
+                self.counts[f"rejected_{status}"] += 1
+            else:
+                self.counts["accepted"] += 1
+                self._per_client[ip] = self._per_client.get(ip, 0) + 1
+        if status:
+            self._reject(request, status)
+
+    def _reject(self, request, status):
+        body = json.dumps({"error": "Máy chủ đang quá tải, vui lòng thử lại sau." if status == 503
+                           else "Quá nhiều kết nối đồng thời."}).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Retry-After: {self.retry_after}\r\n"
+                f"Access-Control-Allow-Origin: *\r\n"
+                f"Connection: close\r\n\r\n").encode('latin-1')
+        try:
+            request.settimeout(1)
+            request.sendall(head + body)
+            # Swallow whatever request bytes already arrived so close() does not turn into a reset
+            request.setblocking(False)
+            request.recv(65536)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    # --- Workers ---
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address, enqueued = item
+            wait = time.monotonic() - enqueued
+            with self._lock:
+                self._busy += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                with self._lock:
+                    self.counts["errors"] += 1
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                ip = client_address[0]
+                with self._lock:
+                    self._busy -= 1
+                    self.counts["served"] += 1
+                    left = self._per_client.get(ip, 1) - 1
+                    if left > 0:
+                        self._per_client[ip] = left
+                    else:
+                        self._per_client.pop(ip, None)
+
+    def saturated(self):
+        """True when connections are waiting for a worker; handlers then close keep-alive connections"""
+        return self._queue.qsize() > 0 or self._draining
+
+    # --- Long-lived responses ---
+    def open_stream(self):
+        """Reserve a stream slot; False when NUKIDA_MAX_STREAMS streams already hold workers"""
+        with self._lock:
+            if self._streams >= self.max_streams:
+                self.counts["rejected_streams"] += 1
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._streams -= 1
+
+    # --- Shutdown ---
+    def drain(self, grace=None):
+        """
+        After serve_forever has returned: refuse new work, let queued and in-flight connections
+        finish for up to `grace` seconds, then close whatever is still waiting.
+        """
+        grace = grace if grace is not None else float(os.environ.get('NUKIDA_SHUTDOWN_GRACE', 10))
+        with self._lock:
+            self._draining = True
+        deadline = time.monotonic() + grace
+        for _ in self._threads:
+            # Sentinels go behind the queued connections, so those are still served
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        unfinished = sum(t.is_alive() for t in self._threads)
+        dropped = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                dropped += 1
+                self.shutdown_request(item[0])
+        print(f"[HTTP] Drained: {self.counts['served']} served, {unfinished} still running, {dropped} queued dropped")
+        return unfinished == 0 and dropped == 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counts)
+            out.update({
+                "workers": self.workers,
+                "busy": self._busy,
+                "streams": self._streams,
+                "max_streams": self.max_streams,
+                "queued": self._queue.qsize(),
+                "queue_depth": self.queue_depth,
+                "clients": len(self._per_client),
+                "queue_wait_avg_ms": round(self._wait_total / out["served"] * 1000, 2) if out["served"] else None,
+                "queue_wait_max_ms": round(self._wait_max * 1000, 2),
+                "draining": self._draining
+            })
+            return out
+
@@ -0,0 +1,324 @@
+"""
+Streaming indicator state (O(1) mỗi bar) cho dữ liệu intraday
+Mỗi indicator giữ state riêng và cập nhật khi có bar mới hoặc khi bar cuối bị sửa (nến đang chạy
+trong phiên), thay vì tính lại toàn bộ chuỗi như services/indicators.py.
+Cùng quy ước với bản vectorized: EMA seed bằng giá trị đầu tiên, Wilder seed bằng trung bình
+`period` giá trị đầu, Bollinger dùng độ lệch chuẩn tổng thể.
+"""
+import math
+from collections import deque
+
+from services.indicators import classify
+
+
+class _Stateful:
+    """
+    update(x) appends a bar, update(x, revise=True) replaces the last one.
+    Subclasses keep their scalar state in `_fields`; a revision restores the checkpoint taken
+    before the last bar and applies the new value, so it costs the same as an append.
+    """
+    _fields = ()
+
+    def __init__(self):
+        self._checkpoint = None
+
+    def update(self, *values, revise=False):
+        if revise and self._checkpoint is not None:
+            for name, v in zip(self._fields, self._checkpoint):
+                setattr(self, name, v)
+        else:
+            self._checkpoint = tuple(getattr(self, name) for name in self._fields)
+        self._push(*values)
+        return self.value
+
+    def _push(self, *values):
+        raise NotImplementedError
+
+
+class EMAState(_Stateful):
+    _fields = ("value",)
+
+    def __init__(self, period):
+        super().__init__()
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+
+    def _push(self, x):
+        self.value = x if self.value is None else self.value + self.alpha * (x - self.value)
+
+
+class _WilderMean:
+    """Wilder smoothing of a stream: simple mean of the first `period` values, then alpha = 1/period"""
+
+    def __init__(self, period):
+        self.period = period
+        self.n = 0
+        self.total = 0.0
+        self.avg = None
+
+    def state(self):
+        return self.n, self.total, self.avg
+
+    def restore(self, state):
+        self.n, self.total, self.avg = state
+
+    def push(self, x):
+        self.n += 1
+        if self.n < self.period:
+            self.total += x
+        elif self.n == self.period:
+            self.avg = (self.total + x) / self.period
+        else:
+            self.avg += (x - self.avg) / self.period
+        return self.avg
+
+
+class RSIState(_Stateful):
+    """Wilder RSI"""
+    _fields = ("last_close", "value", "_gain_state", "_loss_state")
+
+    def __init__(self, period=14):
+        super().__init__()
+        self.last_close = None
+        self.value = None
+        self._gain = _WilderMean(period)
+        self._loss = _WilderMean(period)
+
+    # Smoothers are checkpointed through these properties
+    @property
+    def _gain_state(self):
+        return self._gain.state()
+
+    @_gain_state.setter
+    def _gain_state(self, state):
+        self._gain.restore(state)
+
+    @property
+    def _loss_state(self):
+        return self._loss.state()
+
+    @_loss_state.setter
+    def _loss_state(self, state):
+        self._loss.restore(state)
+
+    def _push(self, close):
+        if self.last_close is not None:
+            delta = close - self.last_close
+            gain = self._gain.push(max(delta, 0.0))
+            loss = self._loss.push(max(-delta, 0.0))
+            if loss is not None:
+                self.value = 100.0 if loss == 0 else 100.0 - 100.0 / (1.0 + gain / loss)
+        self.last_close = close
+
+
+class ATRState(_Stateful):
+    """Wilder ATR of the true range"""
+    _fields = ("last_close", "value", "_tr_state")
+
+    def __init__(self, period=14):
+        super().__init__()
+        self.last_close = None
+        self.value = None
+        self._tr = _WilderMean(period)
+
+    @property
+    def _tr_state(self):
+        return self._tr.state()
+
+    @_tr_state.setter
+    def _tr_state(self, state):
+        self._tr.restore(state)
+
+    def _push(self, high, low, close):
+        prev = self.last_close
+        tr = high - low if prev is None else max(high - low, abs(high - prev), abs(low - prev))
+        self.last_close = close
+        self.value = self._tr.push(tr)
+
+
+class MACDState:
+    """(macd_line, signal_line, histogram) from two close EMAs and an EMA of the line"""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EMAState(fast)
+        self.slow = EMAState(slow)
+        self.signal = EMAState(signal)
+        self.value = None
+
+    def update(self, close, revise=False):
+        line = self.fast.update(close, revise=revise) - self.slow.update(close, revise=revise)
+        sig = self.signal.update(line, revise=revise)
+        self.value = (line, sig, line - sig)
+        return self.value
+
+
+class RollingState:
+    """
+    Running sum / sum of squares over the last `period` values: mean and population std in O(1).
+    Values are shifted by the first one seen (same cancellation guard as indicators.bollinger) and
+    the sums are rebuilt from the window every `resync` updates so float drift cannot accumulate.
+    """
+
+    def __init__(self, period, resync=1000):
+        self.period = period
+        self.resync = resync
+        self.window = deque()
+        self.ref = None
+        self.s = 0.0
+        self.s2 = 0.0
+        self._updates = 0
+
+    def update(self, x, revise=False):
+        if self.ref is None:
+            self.ref = x
+        d = x - self.ref
+        if revise and self.window:
+            old = self.window[-1]
+            self.window[-1] = d
+            self.s += d - old
+            self.s2 += d * d - old * old
+        else:
+            self.window.append(d)
+            self.s += d
+            self.s2 += d * d
+            if len(self.window) > self.period:
+                old = self.window.popleft()
+                self.s -= old
+                self.s2 -= old * old
+        self._updates += 1
+        if self._updates % self.resync == 0:
+            self.s = math.fsum(self.window)
+            self.s2 = math.fsum(v * v for v in self.window)
+        return self.mean
+
+    @property
+    def full(self):
+        return len(self.window) == self.period
+
+    @property
+    def mean(self):
+        return self.s / self.period + self.ref if self.full else None
+
+    @property
+    def std(self):
+        if not self.full:
+            return None
+        m = self.s / self.period
+        return math.sqrt(max(self.s2 / self.period - m * m, 0.0))
+
+
+class BollingerState:
+    """(middle, upper, lower); None until `period` bars"""
+
+    def __init__(self, period=20, k=2.0):
+        self.k = k
+        self.rolling = RollingState(period)
+        self.value = None
+
+    def update(self, close, revise=False):
+        mid = self.rolling.update(close, revise=revise)
+        if mid is None:
+            self.value = None
+        else:
+            band = self.k * self.rolling.std
+            self.value = (mid, mid + band, mid - band)
+        return self.value
+
+
+def _round(v):
+    return None if v is None or math.isnan(v) or math.isinf(v) else round(v, 2)
+
+
+class TechnicalsState:
+    """
+    The `indicators.compute` + `indicators.latest` suite for one (symbol, resolution), fed bar by bar.
+    Bars are (ts, open, high, low, close, volume); a bar with the last seen ts revises it.
+    """
+
+    def __init__(self):
+        self.ema20 = EMAState(20)
+        self.ema50 = EMAState(50)
+        self.rsi = RSIState(14)
+        self.macd = MACDState()
+        self.bb = BollingerState(20, 2.0)
+        self.atr = ATRState(14)
+        self.vol5 = RollingState(5)
+        self.vol20 = RollingState(20)
+        self.bars = 0
+        self.last_ts = None
+        self.close = None
+
+    @classmethod
+    def from_series(cls, series, warmup=500):
+        """
+        Seed from a BarSeries. Only the last `warmup` bars are streamed: older bars weigh less than
+        (49/51)^450 on the slowest EMA, far below the 2-decimal output, so seeding stays O(warmup).
+        """
+        state = cls()
+        skipped = max(0, len(series) - warmup)
+        state.apply(series.tail(warmup) if skipped else series)
+        state.bars += skipped
+        return state
+
+    def update(self, ts, open, high, low, close, volume):
+        """Apply one bar. Returns False for a bar older than the last one (ignored)."""
+        if self.last_ts is not None and ts < self.last_ts:
+            return False
+        revise = ts == self.last_ts
+        self.ema20.update(close, revise=revise)
+        self.ema50.update(close, revise=revise)
+        self.rsi.update(close, revise=revise)
+        self.macd.update(close, revise=revise)
+        self.bb.update(close, revise=revise)
+        self.atr.update(high, low, close, revise=revise)
+        self.vol5.update(volume, revise=revise)
+        self.vol20.update(volume, revise=revise)
+        if not revise:
+            self.bars += 1
+        self.last_ts = ts
+        self.close = close
+        return True
+
+    def apply(self, series):
+        """Feed the bars of `series` from the last seen ts onward (revised last bar + new ones). Returns bars applied."""
+        start = 0
+        if self.last_ts is not None:
+            # searchsorted on the int64 ts column: no Python scan over the already-applied bars
+            start = int(series.t.searchsorted(self.last_ts))
+        applied = 0
+        for row in zip(*(getattr(series, f)[start:].tolist() for f in series.__slots__)):
+            applied += self.update(*row)
+        return applied
+
+    def technicals(self):
+        """Same keys as indicators.latest()"""
+        if self.bars < 30:
+            return {"status": "Không đủ dữ liệu (khuyến nghị tối thiểu 30 nến)"}
+        price = self.close
+        bb = self.bb.value or (None, None, None)
+        sma20 = bb[0]
+        ema20 = self.ema20.value
+        ema50 = self.ema50.value if self.bars >= 50 else sma20
+        rsi_value = self.rsi.value
+        macd_line, macd_signal, macd_hist = self.macd.value
+        nan = float("nan")
+        trend, signal = classify(price, ema20, nan if ema50 is None else ema50,
+                                 nan if rsi_value is None else rsi_value,
+                                 nan if bb[1] is None else bb[1], nan if bb[2] is None else bb[2])
+        return {
+            "current_price": price,
+            "sma20": _round(sma20),
+            "ema20": _round(ema20),
+            "ema50": _round(ema50),
+            "bb_upper": _round(bb[1]),
+            "bb_lower": _round(bb[2]),
+            "rsi_14": _round(rsi_value),
+            "macd_line": _round(macd_line),
+            "macd_signal": _round(macd_signal),
+            "macd_hist": _round(macd_hist),
+            "trend": trend,
+            "signal": signal,
+            "atr_14": _round(self.atr.value),
+            "vol_ma5": _round(self.vol5.mean),
+            "vol_ma20": _round(self.vol20.mean)
+        }
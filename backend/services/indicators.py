@@ -0,0 +1,269 @@
+"""
+Vectorized technical indicators (NumPy)
+Mọi hàm nhận mảng 1-D (một mã) hoặc 2-D (nhiều mã x số phiên), tính trên trục cuối,
+trả về chuỗi đầy đủ cùng shape. NaN ở đầu chuỗi = chưa có dữ liệu (ví dụ do căn phải khi gộp nhiều mã).
+"""
+import math
+
+import numpy as np
+
+
+def _as_2d(x):
+    arr = np.asarray(x, dtype=np.float64)
+    return (arr[None, :], True) if arr.ndim == 1 else (arr, False)
+
+
+def _restore(arr, was_1d):
+    return arr[0] if was_1d else arr
+
+
+def stack(series_list, length=None):
+    """Right-align 1-D series of different lengths into one NaN-padded 2-D array"""
+    length = length or max((len(s) for s in series_list), default=0)
+    out = np.full((len(series_list), length), np.nan)
+    for i, s in enumerate(series_list):
+        s = np.asarray(s, dtype=np.float64)[-length:]
+        if len(s):
+            out[i, length - len(s):] = s
+    return out
+
+
+def _fill(x):
+    """Forward-fill interior NaN and back-fill the leading NaN run with the first valid value"""
+    lead = np.cumsum(~np.isnan(x), axis=1) == 0
+    mask = np.isnan(x)
+    if not mask.any():
+        return x, lead
+    n = x.shape[1]
+    idx = np.where(~mask, np.arange(n), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = x[np.arange(x.shape[0])[:, None], idx]
+    first = np.argmax(~mask, axis=1)
+    seeds = x[np.arange(x.shape[0]), first]
+    filled = np.where(lead, seeds[:, None], filled)
+    return np.nan_to_num(filled), lead
+
+
+def _ewm(x, alpha):
+    """
+    Recursive smoothing y[t] = alpha * x[t] + (1 - alpha) * y[t-1], seeded with the first valid value.
+    Evaluated in closed form over blocks (cumsum of x * decay^-t), so there is no per-bar Python loop;
+    blocks keep decay^-t far from float overflow.
+    """
+    x, lead = _fill(x)
+    decay = 1.0 - alpha
+    if decay <= 0:
+        out = x.copy()
+    else:
+        n = x.shape[1]
+        out = np.empty_like(x)
+        block = max(1, min(n, int(300 / -math.log(decay))))
+        prev = x[:, 0].copy()
+        for s in range(0, n, block):
+            seg = x[:, s:s + block]
+            pw = decay ** np.arange(1, seg.shape[1] + 1)
+            out[:, s:s + seg.shape[1]] = (prev[:, None] + alpha * np.cumsum(seg / pw, axis=1)) * pw
+            prev = out[:, s + seg.shape[1] - 1]
+    out[lead] = np.nan
+    return out
+
+
+def _rolling_sums(x, period):
+    valid = ~np.isnan(x)
+    v = np.where(valid, x, 0.0)
+    zeros = np.zeros((x.shape[0], 1))
+    cs = np.concatenate([zeros, np.cumsum(v, axis=1)], axis=1)
+    cs2 = np.concatenate([zeros, np.cumsum(v * v, axis=1)], axis=1)
+    cnt = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+    return (cs[:, period:] - cs[:, :-period],
+            cs2[:, period:] - cs2[:, :-period],
+            cnt[:, period:] - cnt[:, :-period])
+
+
+def sma(x, period):
+    x, was_1d = _as_2d(x)
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] >= period:
+        s, _, c = _rolling_sums(x, period)
+        out[:, period - 1:] = np.where(c == period, s / period, np.nan)
+    return _restore(out, was_1d)
+
+
+def ema(x, period):
+    x, was_1d = _as_2d(x)
+    return _restore(_ewm(x, 2.0 / (period + 1)), was_1d)
+
+
+def wilder(x, period):
+    """Wilder smoothing (alpha = 1/period) seeded with the simple average of the first `period` values"""
+    x, was_1d = _as_2d(x)
+    x = x.copy()
+    n = x.shape[1]
+    valid = ~np.isnan(x)
+    first = np.argmax(valid, axis=1)
+    seed_idx = first + period - 1
+    ok = valid.any(axis=1) & (seed_idx < n)
+    means = sma(x, period)
+    x[np.arange(n)[None, :] < np.where(ok, seed_idx, n)[:, None]] = np.nan
+    rows = np.nonzero(ok)[0]
+    x[rows, seed_idx[rows]] = means[rows, seed_idx[rows]]
+    return _restore(_ewm(x, 1.0 / period), was_1d)
+
+
+def bollinger(x, period=20, k=2.0):
+    """(middle, upper, lower) using the population standard deviation"""
+    x, was_1d = _as_2d(x)
+    mid = np.full(x.shape, np.nan)
+    std = np.full(x.shape, np.nan)
+    if x.shape[1] >= period:
+        # Shift by a per-row reference before squaring to avoid cancellation on large prices
+        ref = np.nan_to_num(x[np.arange(x.shape[0]), np.argmax(~np.isnan(x), axis=1)])[:, None]
+        s, s2, c = _rolling_sums(x - ref, period)
+        full = c == period
+        mean = s / period
+        var = np.maximum(s2 / period - mean * mean, 0.0)
+        mid[:, period - 1:] = np.where(full, mean + ref, np.nan)
+        std[:, period - 1:] = np.where(full, np.sqrt(var), np.nan)
+    return _restore(mid, was_1d), _restore(mid + k * std, was_1d), _restore(mid - k * std, was_1d)
+
+
+def rsi(close, period=14):
+    """Wilder RSI"""
+    close, was_1d = _as_2d(close)
+    delta = np.diff(close, axis=1, prepend=np.nan)
+    avg_gain = wilder(np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0)), period)
+    avg_loss = wilder(np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0)), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    out = np.where((avg_loss == 0) & ~np.isnan(avg_gain), 100.0, out)
+    return _restore(out, was_1d)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """(macd_line, signal_line, histogram)"""
+    close, was_1d = _as_2d(close)
+    line = _ewm(close, 2.0 / (fast + 1)) - _ewm(close, 2.0 / (slow + 1))
+    sig = _ewm(line, 2.0 / (signal + 1))
+    return _restore(line, was_1d), _restore(sig, was_1d), _restore(line - sig, was_1d)
+
+
+def atr(high, low, close, period=14):
+    high, was_1d = _as_2d(high)
+    low, _ = _as_2d(low)
+    close, _ = _as_2d(close)
+    prev_close = np.concatenate([np.full((close.shape[0], 1), np.nan), close[:, :-1]], axis=1)
+    ranges = np.stack([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    with np.errstate(invalid='ignore'):
+        tr = np.where(np.isnan(ranges).all(axis=0), np.nan, np.nanmax(np.where(np.isnan(ranges), -np.inf, ranges), axis=0))
+    return _restore(wilder(tr, period), was_1d)
+
+
+def compute(close, high=None, low=None, volume=None):
+    """All indicators over the full series in one pass. Returns a dict of arrays shaped like `close`."""
+    close = np.asarray(close, dtype=np.float64)
+    bb_mid, bb_upper, bb_lower = bollinger(close, 20, 2.0)
+    macd_line, macd_signal, macd_hist = macd(close)
+    ind = {
+        "close": close,
+        "sma20": bb_mid,
+        "ema20": ema(close, 20),
+        "ema50": ema(close, 50),
+        "bb_upper": bb_upper,
+        "bb_lower": bb_lower,
+        "rsi_14": rsi(close, 14),
+        "macd_line": macd_line,
+        "macd_signal": macd_signal,
+        "macd_hist": macd_hist,
+        "bars": np.sum(~np.isnan(close), axis=-1)
+    }
+    if high is not None and low is not None:
+        ind["atr_14"] = atr(high, low, close, 14)
+    if volume is not None:
+        ind["vol_ma5"] = sma(volume, 5)
+        ind["vol_ma20"] = sma(volume, 20)
+    return ind
+
+
+def classify(price, ema20, ema50, rsi_value, bb_upper, bb_lower):
+    """Trend & Signal labels used by the UI and the AI prompt"""
+    trend = "ĐI NGANG"
+    if price > ema20 and ema20 > ema50: trend = "TĂNG MẠNH"
+    elif price > ema20: trend = "XU HƯỚNG TĂNG"
+    elif price < ema20 and ema20 < ema50: trend = "GIẢM MẠNH"
+    elif price < ema20: trend = "XU HƯỚNG GIẢM"
+
+    # Signal Logic (Simple)
+    signal = "CHỜ"
+    if rsi_value < 35 and price <= bb_lower: signal = "MUA (HỖ TRỢ/QUÁ BÁN)"
+    elif rsi_value > 65 and price >= bb_upper: signal = "BÁN (KHÁNG CỰ/QUÁ MUA)"
+    elif trend == "XU HƯỚNG TĂNG" and rsi_value < 50: signal = "MUA (THEO TREND)"
+    return trend, signal
+
+
+TRENDS = ("TĂNG MẠNH", "XU HƯỚNG TĂNG", "GIẢM MẠNH", "XU HƯỚNG GIẢM", "ĐI NGANG")
+SIGNALS = ("MUA (HỖ TRỢ/QUÁ BÁN)", "BÁN (KHÁNG CỰ/QUÁ MUA)", "MUA (THEO TREND)", "CHỜ")
+
+
+def classify_many(price, ema20, ema50, rsi_value, bb_upper, bb_lower):
+    """`classify` over arrays (one element per ticker): same rules and precedence, no Python loop"""
+    with np.errstate(invalid='ignore'):
+        trend = np.select(
+            [(price > ema20) & (ema20 > ema50), price > ema20, (price < ema20) & (ema20 < ema50), price < ema20],
+            TRENDS[:4], default=TRENDS[4])
+        signal = np.select(
+            [(rsi_value < 35) & (price <= bb_lower), (rsi_value > 65) & (price >= bb_upper),
+             (trend == "XU HƯỚNG TĂNG") & (rsi_value < 50)],
+            SIGNALS[:3], default=SIGNALS[3])
+    return trend, signal
+
+
+def last_values(ind):
+    """Last-bar value of every indicator for each row of a 2-D `compute` result, plus trend/signal"""
+    out = {key: arr[:, -1] for key, arr in ind.items() if key != "bars"}
+    out["bars"] = ind["bars"]
+    # Same fallback as `latest`: too few bars for a meaningful EMA50
+    out["ema50"] = np.where(ind["bars"] >= 50, out["ema50"], out["sma20"])
+    out["trend"], out["signal"] = classify_many(out["close"], out["ema20"], out["ema50"],
+                                                out["rsi_14"], out["bb_upper"], out["bb_lower"])
+    return out
+
+
+def _round(v):
+    v = float(v)
+    return None if math.isnan(v) or math.isinf(v) else round(v, 2)
+
+
+def latest(ind, row=None, index=-1):
+    """Legacy technicals dict: a view over one element (default: the last bar) of `compute` output"""
+    def at(key):
+        arr = ind[key]
+        return arr[index] if row is None else arr[row, index]
+
+    price = float(at("close"))
+    bars = int(ind["bars"] if row is None else ind["bars"][row])
+    sma20 = float(at("sma20"))
+    ema20 = float(at("ema20"))
+    ema50 = float(at("ema50")) if bars >= 50 else sma20
+    rsi_value = float(at("rsi_14"))
+    bb_upper = float(at("bb_upper"))
+    bb_lower = float(at("bb_lower"))
+    trend, signal = classify(price, ema20, ema50, rsi_value, bb_upper, bb_lower)
+
+    out = {
+        "current_price": price,
+        "sma20": _round(sma20),
+        "ema20": _round(ema20),
+        "ema50": _round(ema50),
+        "bb_upper": _round(bb_upper),
+        "bb_lower": _round(bb_lower),
+        "rsi_14": _round(rsi_value),
+        "macd_line": _round(at("macd_line")),
+        "macd_signal": _round(at("macd_signal")),
+        "macd_hist": _round(at("macd_hist")),
+        "trend": trend,
+        "signal": signal
+    }
+    for key in ("atr_14", "vol_ma5", "vol_ma20"):
+        if key in ind:
+            out[key] = _round(at(key))
+    return out
@@ -0,0 +1,49 @@
+"""
+HOSE trading calendar helpers (Vietnam time, ICT = UTC+7)
+Phiên giao dịch: 09:00 - 15:00, thứ Hai - thứ Sáu (chưa tính ngày nghỉ lễ)
+"""
+from datetime import datetime, timedelta, timezone
+
+ICT = timezone(timedelta(hours=7), "ICT")
+SESSION_OPEN = (9, 0)
+SESSION_CLOSE = (15, 0)
+
+
+def now_ict():
+    return datetime.now(ICT)
+
+
+def _as_ict(now):
+    if now is None:
+        return now_ict()
+    if now.tzinfo is None:
+        return now.replace(tzinfo=ICT)
+    return now.astimezone(ICT)
+
+
+def _at(day, hm):
+    return day.replace(hour=hm[0], minute=hm[1], second=0, microsecond=0)
+
+
+def is_trading_hours(now=None):
+    """True while the HOSE continuous session is open"""
+    now = _as_ict(now)
+    if now.weekday() >= 5:
+        return False
+    return _at(now, SESSION_OPEN) <= now < _at(now, SESSION_CLOSE)
+
+
+def next_open(now=None):
+    """Datetime of the next session open strictly after `now`"""
+    now = _as_ict(now)
+    candidate = _at(now, SESSION_OPEN)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def seconds_until_next_open(now=None):
+    now = _as_ict(now)
+    return (next_open(now) - now).total_seconds()
@@ -0,0 +1,157 @@
+"""
+Metrics nhẹ (histogram / counter có label) + xuất định dạng text Prometheus cho /metrics
+- Không phụ thuộc prometheus_client: mỗi lần ghi là một bisect + cộng dồn dưới lock (~1-2 µs)
+- stage_timer(): đo một giai đoạn (scrape CafeF, từng nguồn lịch sử, tin tức, chỉ báo, Perplexity...)
+  với label stage / source / outcome
+- NUKIDA_METRICS=0 tắt ghi nhận (endpoint vẫn trả về, chỉ không có mẫu)
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.environ.get('NUKIDA_METRICS', '1') != '0'
+
+# Seconds: from in-process work (technicals, repair_json) up to slow upstreams and Perplexity
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, n=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}_total{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        lines = []
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + ("+Inf",), counts):
+                cumulative += c
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition (format 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name}{'_total' if m.kind == 'counter' else ''} {m.help}")
+            lines.append(f"# TYPE {m.name}{'_total' if m.kind == 'counter' else ''} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "nukida_stage_duration_seconds", "Duration of one pipeline stage", ("stage", "source", "outcome")))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "nukida_upstream_request_duration_seconds", "Upstream HTTP call latency by host (circuit breaker view)",
+    ("host", "outcome")))
+UPSTREAM_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "nukida_upstream_admission_wait_seconds", "Time spent waiting for a rate token / concurrency slot",
+    ("host", "outcome")))
+AI_TOKENS = REGISTRY.register(Counter(
+    "nukida_ai_tokens", "Perplexity tokens (reported by the API, estimated when missing)", ("kind",)))
+
+
+class stage_timer:
+    """
+    with stage_timer("scrape_overview", "cafef") as t:
+        ...
+        t.outcome = "empty"
+    Records the duration under outcome "ok" by default, or "error" if the block raises.
+    """
+    __slots__ = ("stage", "source", "outcome", "started")
+
+    def __init__(self, stage, source=""):
+        self.stage = stage
+        self.source = source
+        self.outcome = "ok"
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, self.stage, self.source,
+                              "error" if exc_type is not None else self.outcome)
+        return False
+
+
+def observe_stage(stage, seconds, source="", outcome="ok"):
+    STAGE_SECONDS.observe(seconds, stage, source, outcome)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,279 @@
+"""
+Kho tin tức CafeF cục bộ (SQLite) + crawler tăng dần
+- Bài viết lưu một lần theo hash URL, gắn vào từng "feed" (mã cổ phiếu, hoặc "market" cho tin thị trường)
+- Trang danh sách được tải có điều kiện (ETag / Last-Modified), và chỉ tải lại khi quá NUKIDA_NEWS_TTL giây
+- Khi parse bỏ qua tin đã có và dừng sau NUKIDA_NEWS_STOP_AFTER tin đã có liên tiếp (trang CafeF sắp tin
+  mới nhất lên đầu, nhưng có thể ghim một tin cũ ở trên cùng)
+- Mỗi feed giữ tối đa NUKIDA_NEWS_KEEP tin mới nhất; bài không còn thuộc feed nào bị xoá
+- Đọc headline của một mã = đọc index, không scrape lại
+"""
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from services.health import guarded_get
+
+MARKET_FEED = "market"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    url_hash TEXT PRIMARY KEY,
+    url TEXT,
+    title TEXT NOT NULL,
+    date_text TEXT,
+    first_seen INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feed_articles (
+    feed TEXT NOT NULL,
+    url_hash TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (feed, url_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS feed_articles_seq ON feed_articles (feed, seq);
+CREATE TABLE IF NOT EXISTS feeds (
+    feed TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL
+);
+"""
+
+# --- Listing page extraction without building a DOM ---
+_ITEM_START_RE = re.compile(r'<(?:li|div)\b[^>]*\bclass\s*=\s*["\'][^"\']*\b(?:tlitem|tr-item|news-item|doc-item|itemnews)\b[^>]*>', re.I)
+_HEADING_LINK_RE = re.compile(r'<h[2-4]\b[^>]*>\s*(?:<a\b[^>]*?href\s*=\s*["\']([^"\']+)["\'][^>]*>)?(.*?)</h[2-4]\s*>', re.I | re.S)
+_LINK_RE = re.compile(r'<a\b[^>]*?href\s*=\s*["\']([^"\']+)["\'][^>]*>(.*?)</a\s*>', re.I | re.S)
+_TIME_RE = re.compile(r'<(\w+)\b[^>]*\bclass\s*=\s*["\'][^"\']*(?:date|time)[^"\']*["\'][^>]*>(.*?)</\1\s*>', re.I | re.S)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _text(fragment):
+    return " ".join(html.unescape(_TAG_RE.sub(' ', fragment or "")).split())
+
+
+def url_hash(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+
+
+def iter_listing(html_text, base_url):
+    """Yield {url, title, date_text} for each item of a CafeF listing page, in page order (newest first)"""
+    starts = [m.start() for m in _ITEM_START_RE.finditer(html_text)]
+    for i, start in enumerate(starts):
+        block = html_text[start:starts[i + 1] if i + 1 < len(starts) else start + 4000]
+        heading = _HEADING_LINK_RE.search(block)
+        if heading and heading.group(1):
+            href, title = heading.group(1), heading.group(2)
+        else:
+            link = _LINK_RE.search(block)
+            if heading:
+                href, title = (link.group(1) if link else None), heading.group(2)
+            elif link:
+                href, title = link.group(1), link.group(2)
+            else:
+                continue
+        title = _text(title)
+        if not title:
+            continue
+        if href and href.startswith('/'):
+            href = base_url + href
+        date = _TIME_RE.search(block)
+        yield {"url": href, "title": title, "date_text": _text(date.group(2)) if date else ""}
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_news_store():
+    """Process-wide store at NUKIDA_NEWS_STORE (default: temp dir); 'off' keeps it in memory only"""
+    global _default_store
+    path = os.environ.get('NUKIDA_NEWS_STORE', os.path.join(tempfile.gettempdir(), 'nukida_news.sqlite3'))
+    if path.lower() == 'off':
+        path = ':memory:'
+    with _default_lock:
+        if _default_store is None:
+            try:
+                _default_store = NewsStore(path)
+            except sqlite3.Error as e:
+                print(f"[NewsStore] Cannot open {path} ({e}), keeping news in memory")
+                _default_store = NewsStore(':memory:')
+        return _default_store
+
+
+class NewsStore:
+    """SQLite article store; a single serialized connection (news writes are few and small)"""
+
+    def __init__(self, path, keep=None):
+        self.path = path
+        self.keep = keep or int(os.environ.get('NUKIDA_NEWS_KEEP', 200))
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        if path != ':memory:':
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def feed_state(self, feed):
+        """{etag, last_modified, fetched_at} or None if the feed was never fetched"""
+        with self._lock:
+            row = self._db.execute("SELECT etag, last_modified, fetched_at FROM feeds WHERE feed=?", (feed,)).fetchone()
+        return None if row is None else {"etag": row[0], "last_modified": row[1], "fetched_at": row[2]}
+
+    def has(self, feed, h):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM feed_articles WHERE feed=? AND url_hash=?", (feed, h)).fetchone() is not None
+
+    def add(self, feed, items, etag=None, last_modified=None):
+        """Attach `items` (page order, newest first) on top of the feed and record the fetch"""
+        now = time.time()
+        with self._lock, self._db:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM feed_articles WHERE feed=?", (feed,)).fetchone()[0]
+            for item in reversed(items):
+                seq += 1
+                self._db.execute("INSERT OR IGNORE INTO articles VALUES (?, ?, ?, ?, ?)",
+                                 (item["hash"], item["url"], item["title"], item["date_text"], int(now)))
+                self._db.execute("INSERT OR IGNORE INTO feed_articles VALUES (?, ?, ?)", (feed, item["hash"], seq))
+            self._db.execute("INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?)", (feed, etag, last_modified, now))
+            if items:
+                self._prune(feed)
+
+    def _prune(self, feed):
+        """Keep the newest `keep` articles of `feed`; drop articles no feed references any more"""
+        cutoff = self._db.execute("SELECT seq FROM feed_articles WHERE feed=? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                                  (feed, self.keep)).fetchone()
+        if cutoff is None:
+            return
+        dropped = [r[0] for r in self._db.execute("SELECT url_hash FROM feed_articles WHERE feed=? AND seq<=?",
+                                                  (feed, cutoff[0]))]
+        self._db.execute("DELETE FROM feed_articles WHERE feed=? AND seq<=?", (feed, cutoff[0]))
+        self._db.executemany("DELETE FROM articles WHERE url_hash=? AND NOT EXISTS "
+                             "(SELECT 1 FROM feed_articles f WHERE f.url_hash = articles.url_hash)",
+                             [(h,) for h in dropped])
+
+    def touch(self, feed):
+        with self._lock, self._db:
+            self._db.execute("UPDATE feeds SET fetched_at=? WHERE feed=?", (time.time(), feed))
+
+    def latest(self, feed, limit):
+        """Newest articles of a feed: [{url, title, date_text}]"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT a.url, a.title, a.date_text FROM feed_articles f JOIN articles a ON a.url_hash = f.url_hash "
+                "WHERE f.feed=? ORDER BY f.seq DESC LIMIT ?", (feed, limit)).fetchall()
+        return [{"url": r[0], "title": r[1], "date_text": r[2]} for r in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "articles": self._db.execute("SELECT COUNT(*) FROM articles").fetchone()[0],
+                "feeds": self._db.execute("SELECT COUNT(*) FROM feeds").fetchone()[0],
+                "keep_per_feed": self.keep
+            }
+
+
+class NewsCrawler:
+    """Keeps feeds in a NewsStore fresh and serves headline reads from it"""
+
+    def __init__(self, session, store=None, health=None, ttl=None, limiter=None, stop_after=None):
+        self.session = session
+        self.store = store or get_default_news_store()
+        self.health = health
+        self.limiter = limiter
+        self.ttl = ttl if ttl is not None else float(os.environ.get('NUKIDA_NEWS_TTL', 120))
+        # Known items in a row before the rest of the page is assumed known (a pinned item is just one)
+        self.stop_after = stop_after or int(os.environ.get('NUKIDA_NEWS_STOP_AFTER', 3))
+        self._lock = threading.Lock()
+        self._feed_locks = {}
+        self.counts = {"fetches": 0, "not_modified": 0, "fresh_reads": 0, "parsed_items": 0, "new_items": 0, "errors": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def _feed_lock(self, feed):
+        with self._lock:
+            return self._feed_locks.setdefault(feed, threading.Lock())
+
+    def refresh(self, feed, url, base_url, headers=None, force=False):
+        """Bring `feed` up to date from its listing page; returns the number of new articles"""
+        with self._feed_lock(feed):
+            state = self.store.feed_state(feed)
+            if state and not force and time.time() - (state["fetched_at"] or 0) < self.ttl:
+                self._count("fresh_reads")
+                return 0
+            req_headers = dict(headers or {})
+            if state and state["etag"]:
+                req_headers['If-None-Match'] = state["etag"]
+            if state and state["last_modified"]:
+                req_headers['If-Modified-Since'] = state["last_modified"]
+            self._count("fetches")
+            try:
+                r = guarded_get(self.session, url, registry=self.health, limiter=self.limiter,
+                                timeout=10, headers=req_headers)
+            except Exception as e:
+                self._count("errors")
+                print(f"[News] Fetch failed for {feed}: {e}")
+                return 0
+            if r.status_code == 304:
+                self._count("not_modified")
+                self.store.touch(feed)
+                return 0
+            if r.status_code != 200:
+                self._count("errors")
+                print(f"[News] {feed}: HTTP {r.status_code}")
+                return 0
+
+            # Newest first: skip articles this feed already has, stop after a run of them
+            new_items = []
+            seen = set()
+            known = 0
+            for item in iter_listing(r.text, base_url):
+                self._count("parsed_items")
+                h = url_hash(item["url"] or item["title"])
+                if h in seen:
+                    continue
+                seen.add(h)
+                if self.store.has(feed, h):
+                    known += 1
+                    if known >= self.stop_after:
+                        break
+                    continue
+                known = 0
+                item["hash"] = h
+                new_items.append(item)
+            self.store.add(feed, new_items, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+            self._count("new_items", len(new_items))
+            if new_items:
+                print(f"[News] {feed}: {len(new_items)} new articles")
+            return len(new_items)
+
+    def ticker_news(self, ticker, limit=10):
+        """Latest headlines for a ticker in the legacy "date - title" form"""
+        ticker = ticker.upper()
+        self.refresh(ticker, f"https://s.cafef.vn/tin-doanh-nghiep/{ticker}/tin-moi-nhat.chn", "https://s.cafef.vn")
+        return [f"{a['date_text']} - {a['title']}" for a in self.store.latest(ticker, limit)]
+
+    def market_news(self, limit=5, headers=None, min_title=20):
+        """Top market headlines as [{title, url}] (short titles and repeated titles skipped)"""
+        self.refresh(MARKET_FEED, "https://cafef.vn/thi-truong-chung-khoan.chn", "https://cafef.vn", headers=headers)
+        news = []
+        titles = set()
+        for a in self.store.latest(MARKET_FEED, limit * 4):
+            if len(news) >= limit:
+                break
+            if len(a["title"]) < min_title or not a["url"] or a["title"] in titles:
+                continue
+            titles.add(a["title"])
+            news.append({"title": a["title"], "url": a["url"]})
+        return news
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counts)
+        out.update(self.store.stats())
+        out["ttl"] = self.ttl
+        return out
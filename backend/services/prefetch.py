@@ -0,0 +1,208 @@
+"""
+Prefetch scheduler: trong phiên HOSE, làm mới trước (refresh-ahead) dữ liệu cứng của các mã nóng
+(VN30 + NUKIDA_PREFETCH_TICKERS + watchlist đăng ký qua API) vào MarketDataCache,
+để /api/analyze gần như không phải chờ upstream.
+- Mỗi (mã, phần) có hạn làm mới riêng = TTL của phần đó x NUKIDA_PREFETCH_AHEAD, cộng jitter
+- Đồng thời có giới hạn (NUKIDA_PREFETCH_WORKERS); lưu lượng upstream đi qua UpstreamLimiter dùng chung,
+  mỗi lần làm mới chờ token tối đa min(TTL của phần, NUKIDA_PREFETCH_MAX_WAIT) giây
+- Ngoài giờ giao dịch: nghỉ tới phiên kế tiếp
+"""
+import heapq
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services import market_calendar
+from services.data_engine import PARTS
+from services.ratelimit import admission_deadline
+from services.scanner import VN30
+
+
+def _normalize(tickers):
+    out = []
+    for t in tickers or []:
+        t = "".join(filter(str.isalnum, str(t))).upper()
+        if t and t not in out:
+            out.append(t)
+    return out
+
+
+class Prefetcher:
+    def __init__(self, data_engine, tickers=None, workers=None, ahead=None, jitter=None, max_wait=None, max_tickers=None):
+        env = os.environ.get
+        self.data_engine = data_engine
+        self.base = _normalize(tickers if tickers is not None else list(VN30) + env('NUKIDA_PREFETCH_TICKERS', '').split(','))
+        self.workers = workers or int(env('NUKIDA_PREFETCH_WORKERS', 4))
+        self.ahead = ahead or float(env('NUKIDA_PREFETCH_AHEAD', 0.8))
+        self.jitter = jitter if jitter is not None else float(env('NUKIDA_PREFETCH_JITTER', 0.1))
+        self.max_tickers = max_tickers or int(env('NUKIDA_PREFETCH_MAX_TICKERS', 200))
+        # Watchlist ids come from clients: keep only the most recently registered ones
+        self.max_watchlists = int(env('NUKIDA_PREFETCH_MAX_WATCHLISTS', 50))
+        # Background refreshes may queue on the shared upstream limiter much longer than user requests
+        self.max_wait = max_wait or float(env('NUKIDA_PREFETCH_MAX_WAIT', 30))
+
+        self.watchlists = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Prefetch")
+        self._thread = None
+
+        self._queue = []        # heap of (due, ticker, part)
+        self._scheduled = set()
+        self._wanted = set()
+        self._last_ok = {}      # (ticker, part) -> time of last successful refresh
+        self._generation = 0    # bumped when the schedule is reset; older refreshes don't re-queue
+        self._lags = []         # recent start delays vs due time (seconds)
+        self.refreshed = 0
+        self.failed = 0
+
+    # --- Ticker set ---
+    def tickers(self):
+        with self._lock:
+            out = list(self.base)
+            for tickers in self.watchlists.values():
+                out.extend(t for t in tickers if t not in out)
+        return out[:self.max_tickers]
+
+    def set_watchlist(self, watchlist_id, tickers):
+        """Register / replace a watchlist; its tickers join the schedule right away"""
+        tickers = _normalize(tickers)[:self.max_tickers]
+        with self._lock:
+            self.watchlists.pop(str(watchlist_id), None)
+            if tickers:
+                self.watchlists[str(watchlist_id)] = tickers
+                while len(self.watchlists) > self.max_watchlists:
+                    self.watchlists.pop(next(iter(self.watchlists)))
+        self._wake.set()
+        return self.tickers()
+
+    # --- Scheduling ---
+    def _ttl(self, part):
+        return self.data_engine.cache.ttl_for(part)
+
+    def _next_due(self, part, now):
+        interval = self._ttl(part) * self.ahead
+        return now + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _sync_schedule(self, now):
+        """Add newly wanted (ticker, part) pairs, spread over the first interval so they don't all fire at once"""
+        wanted = {(t, p) for t in self.tickers() for p in PARTS}
+        with self._lock:
+            for ticker, part in wanted - self._scheduled:
+                due = now + random.uniform(0, min(self._ttl(part) * self.ahead, 10))
+                heapq.heappush(self._queue, (due, ticker, part))
+                self._scheduled.add((ticker, part))
+            # Dropped watchlist tickers are skipped when popped
+            self._wanted = wanted
+
+    def start(self):
+        if not self.data_engine.cache:
+            print("[Prefetch] Disabled: DataEngine cache is off (NUKIDA_CACHE=0)")
+            return self
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name="Prefetcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        print(f"[Prefetch] Scheduler started: {len(self.tickers())} tickers, {self.workers} workers")
+        while not self._stop.is_set():
+            if not market_calendar.is_trading_hours():
+                wait = min(market_calendar.seconds_until_next_open(), 600)
+                with self._lock:
+                    # Off-hours cache entries live until the open; start fresh from there
+                    self._queue.clear()
+                    self._scheduled.clear()
+                    self._last_ok.clear()
+                    self._generation += 1
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+
+            now = time.time()
+            self._sync_schedule(now)
+            with self._lock:
+                due, ticker, part = self._queue[0] if self._queue else (now + 1, None, None)
+            if due > now:
+                self._wake.wait(due - now)
+                self._wake.clear()
+                continue
+            with self._lock:
+                heapq.heappop(self._queue)
+                if (ticker, part) not in self._wanted:
+                    self._scheduled.discard((ticker, part))
+                    continue
+                generation = self._generation
+
+            # Bounded concurrency: block here until a worker is free
+            self._slots.acquire()
+            self._pool.submit(self._refresh, ticker, part, due, generation)
+
+    def _refresh(self, ticker, part, due, generation):
+        started = time.time()
+        try:
+            # No point waiting for a token longer than the refreshed entry would stay fresh
+            with admission_deadline(time.monotonic() + min(self._ttl(part), self.max_wait)):
+                ok = self.data_engine.refresh_part(part, ticker)
+        except Exception as e:
+            print(f"[Prefetch] {ticker}/{part} failed: {e}")
+            ok = False
+        finally:
+            self._slots.release()
+        now = time.time()
+        with self._lock:
+            self._lags.append(started - due)
+            del self._lags[:-500]
+            if ok:
+                self.refreshed += 1
+            else:
+                self.failed += 1
+            # The schedule was reset (market closed) while this ran: _sync_schedule owns the pair now
+            if generation != self._generation or (ticker, part) not in self._scheduled:
+                return
+            if ok:
+                self._last_ok[(ticker, part)] = now
+                due = self._next_due(part, now)
+            else:
+                # Retry sooner than a full interval, but don't hammer a failing upstream
+                due = now + min(self._ttl(part), 30) * (1 + random.uniform(0, self.jitter))
+            heapq.heappush(self._queue, (due, ticker, part))
+        self._wake.set()
+
+    # --- Metrics ---
+    def stats(self):
+        now = time.time()
+        tickers = self.tickers()
+        with self._lock:
+            fresh = {part: 0 for part in PARTS}
+            for ticker in tickers:
+                for part in PARTS:
+                    last = self._last_ok.get((ticker, part))
+                    if last is not None and now - last < self._ttl(part):
+                        fresh[part] += 1
+            lags = sorted(self._lags)
+            total = len(tickers) * len(PARTS)
+            return {
+                "running": self._thread is not None and not self._stop.is_set(),
+                "trading_hours": market_calendar.is_trading_hours(),
+                "tickers": len(tickers),
+                "watchlists": {k: len(v) for k, v in self.watchlists.items()},
+                "coverage": round(sum(fresh.values()) / total, 3) if total else None,
+                "coverage_by_part": {p: round(n / len(tickers), 3) if tickers else None for p, n in fresh.items()},
+                "lag_p50_s": round(lags[len(lags) // 2], 3) if lags else None,
+                "lag_max_s": round(lags[-1], 3) if lags else None,
+                "queued": len(self._queue),
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "max_wait": self.max_wait
+            }
@@ -0,0 +1,221 @@
+"""
+Prompt builder cho AIEngine (Perplexity sonar-pro)
+- System prompt (persona + JSON schema) là template tĩnh, dựng một lần lúc import, không chứa mã CK
+  -> giống hệt nhau giữa các request
+- Hai chế độ schema: "full" (mô tả từng trường) và "compact" (khung JSON rút gọn, mặc định)
+- Ngân sách token theo từng phần: tin tức được khử trùng lặp, sắp theo thời gian mới nhất,
+  cắt ngắn; số liệu được làm tròn
+- Mỗi prompt kèm ước lượng token đầu vào và ngân sách token đầu ra
+"""
+import json
+import math
+import os
+import re
+from datetime import datetime
+
+# Persona (shared by both schema modes)
+PERSONA = """BẠN LÀ "ĐỘC GIÁ" - CHUYÊN GIA ĐỌC VỊ THỊ TRƯỜNG & PHÂN TÍCH KỸ THUẬT SIÊU CẤP VỚI 20 NĂM KINH NGHIỆM.
+
+TƯ DUY:
+- Bạn không chỉ nhìn chart, bạn nhìn thấy TÂM LÝ và DÒNG TIỀN đằng sau. Cái tên "ĐỘC GIÁ" của bạn có nghĩa là "Đọc Vị Mức Giá Độc Nhất".
+- Bạn phân tích như một cỗ máy: Logic, Lạnh lùng, Chính xác.
+- Bạn phải giải thích cho người mới hiểu (F0) nhưng giữ độ sâu sắc cho chuyên gia.
+
+NHIỆM VỤ: "Phẫu thuật" mã cổ phiếu trong tin nhắn của người dùng."""
+
+LAYERS = (
+    "Lớp 1: Cấu Trúc Thị Trường",
+    "Lớp 2: Động Lượng & Xu Hướng",
+    "Lớp 3: Logic Khối Lượng",
+    "Lớp 4: Vùng Giá Quan Trọng",
+    "Lớp 5: Hành Vi Nến (Price Action)",
+    "Lớp 6: Chu Kỳ & Sóng",
+    "Lớp 7: Tổng Hợp & Phản Biện"
+)
+
+# Output schema with a description per field (the original prompt, minus per-line indentation)
+SCHEMA_FULL = {
+    "ticker": "<MÃ>",
+    "friendly_advice": "Lời khuyên ngắn gọn, súc tích nhất từ Độc Giá.",
+    "beginner_report": {
+        "summary": "Tóm tắt tình hình bằng ngôn ngữ đời thường cho người mới.",
+        "action_plan": "Hành động cụ thể: Mua, Bán hay Giữ? Tại sao?",
+        "risk_level": "Thấp/Trung Bình/Cao/Rất Cao"
+    },
+    "process_steps": ["Bước 1: Quét cấu trúc thị trường...", "Bước 2: Kiểm tra dòng tiền...", "Bước 3: Phân tích hành vi giá..."],
+    "strategy": {
+        "decision": "MUA NGAY / CANH MUA / BÁN NGAY / CANH BÁN / ĐỨNG NGOÀI",
+        "timing": "Thời điểm", "entry": "Vùng giá vào", "stop_loss": "Cắt lỗ", "target": "Chốt lời",
+        "rr_ratio": "R:R", "rationale": "Luận điểm cốt lõi"
+    },
+    "layers": [{"layer": name, "analysis": "..."} for name in LAYERS],
+    "deep_analysis": {"enterprise": "Nội tại doanh nghiệp", "smart_money": "Dòng tiền lớn", "sentiment": "Tâm lý đám đông"},
+    "tech_analysis_7_layers": {
+        "structure": "Cấu trúc (Trend)",
+        "momentum": "Động lượng (RSI/MACD)",
+        "volume_analysis": "VSA (Giá/Khối lượng)",
+        "key_levels": "Hỗ trợ/Kháng cự",
+        "candle_behavior": {"type": "Mẫu nến", "logic": "Ý nghĩa", "observation": "Chi tiết"},
+        "meta_critic": {"status": "Confirm/Deny", "confidence": "High/Med/Low", "confirmation": "Điều kiện", "denial": "Phủ nhận"}
+    },
+    "tech_summary": ["Ý 1", "Ý 2"],
+    "news_analysis": {"corporate": [], "synthesis": "Tổng hợp tin tức"}
+}
+
+# Same keys and enums, placeholders only; the 7 layer names are listed once instead of as 7 objects
+SCHEMA_COMPACT = {
+    "ticker": "", "friendly_advice": "",
+    "beginner_report": {"summary": "", "action_plan": "", "risk_level": "Thấp|Trung Bình|Cao|Rất Cao"},
+    "process_steps": [""],
+    "strategy": {"decision": "MUA NGAY|CANH MUA|BÁN NGAY|CANH BÁN|ĐỨNG NGOÀI", "timing": "", "entry": "",
+                 "stop_loss": "", "target": "", "rr_ratio": "", "rationale": ""},
+    "layers": [{"layer": "", "analysis": ""}],
+    "deep_analysis": {"enterprise": "", "smart_money": "", "sentiment": ""},
+    "tech_analysis_7_layers": {"structure": "", "momentum": "", "volume_analysis": "", "key_levels": "",
+                               "candle_behavior": {"type": "", "logic": "", "observation": ""},
+                               "meta_critic": {"status": "Confirm|Deny", "confidence": "High|Med|Low",
+                                               "confirmation": "", "denial": ""}},
+    "tech_summary": [""],
+    "news_analysis": {"corporate": [""], "synthesis": ""}
+}
+
+SYSTEM_PROMPTS = {
+    "full": PERSONA + "\n\nOUTPUT JSON (BẮT BUỘC):\n" + json.dumps(SCHEMA_FULL, ensure_ascii=False, indent=1),
+    "compact": (PERSONA + "\n\nOUTPUT: đúng một object JSON theo khung sau (điền mọi trường, chuỗi tiếng Việt):\n"
+                + json.dumps(SCHEMA_COMPACT, ensure_ascii=False, separators=(",", ":"))
+                + "\n\"layers\" gồm đủ 7 lớp theo thứ tự: " + "; ".join(LAYERS) + ".")
+}
+
+INSTRUCTIONS = ("YÊU CẦU: Trả về JSON chuẩn. Phần 'beginner_report' phải viết cực kỳ bình dân, dễ hiểu. "
+                "Phần 'process_steps' liệt kê 5-7 bước bạn đã thực hiện.")
+
+# Typical completion size per schema mode (seed for the running output estimate)
+EXPECTED_OUTPUT_TOKENS = {"full": 2200, "compact": 1900}
+
+_NEWS_DATE_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})(?:\s+(\d{1,2}):(\d{2}))?')
+
+
+def estimate_tokens(text):
+    """
+    Tokenizer-free estimate: ~4 ASCII chars per token, while Vietnamese letters with diacritics
+    usually split into their own tokens (~0.6 token each)
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / 4 + non_ascii * 0.6)
+
+
+def _round_number(value):
+    """Prices/volumes as plain integers, ratios with 2 decimals; strings (e.g. scraped "2,345") unchanged"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return "N/A" if value is None else value
+    if value != value or value in (float('inf'), float('-inf')):
+        return "N/A"
+    if abs(value) >= 100:
+        return int(round(value))
+    return round(value, 2)
+
+
+def _news_time(item):
+    m = _NEWS_DATE_RE.search(item)
+    if not m:
+        return None
+    day, month, year, hour, minute = m.groups()
+    try:
+        return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+    except ValueError:
+        return None
+
+
+def _news_dedupe_key(item):
+    title = _NEWS_DATE_RE.sub("", item).strip(" -–|")
+    return re.sub(r'\W+', ' ', title.lower()).strip()
+
+
+class PromptBuilder:
+    def __init__(self, schema=None, news_tokens=None, news_items=None, headline_chars=None, max_output_tokens=None):
+        env = os.environ.get
+        self.schema = schema or env('NUKIDA_PROMPT_SCHEMA', 'compact')
+        if self.schema not in SYSTEM_PROMPTS:
+            print(f"[Prompts] Unknown NUKIDA_PROMPT_SCHEMA={self.schema}, using compact")
+            self.schema = 'compact'
+        self.news_tokens = news_tokens or int(env('NUKIDA_PROMPT_NEWS_TOKENS', 400))
+        self.news_items = news_items or int(env('NUKIDA_PROMPT_NEWS_ITEMS', 8))
+        self.headline_chars = headline_chars or int(env('NUKIDA_PROMPT_HEADLINE_CHARS', 160))
+        # Hard completion cap sent as max_tokens; unset by default (a truncated answer is invalid JSON)
+        self.max_output_tokens = max_output_tokens or (int(env('NUKIDA_PPLX_MAX_TOKENS')) if env('NUKIDA_PPLX_MAX_TOKENS') else None)
+        # Static parts: built and measured once
+        self.system_prompt = SYSTEM_PROMPTS[self.schema]
+        self.system_tokens = estimate_tokens(self.system_prompt)
+        self.instruction_tokens = estimate_tokens(INSTRUCTIONS)
+
+    def select_news(self, raw_news):
+        """Newest first, duplicates dropped, each headline truncated, until the news token budget is spent"""
+        items = []
+        seen = set()
+        for i, item in enumerate(raw_news or []):
+            item = " ".join(str(item).split())
+            key = _news_dedupe_key(item)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            items.append((_news_time(item), i, item))
+        # Dated items by recency; undated ones keep their source order after them
+        items.sort(key=lambda x: (x[0] is None, -(x[0].timestamp() if x[0] else 0), x[1]))
+
+        selected = []
+        used = 0
+        for _, _, item in items:
+            if len(selected) >= self.news_items:
+                break
+            if len(item) > self.headline_chars:
+                item = item[:self.headline_chars - 1].rstrip() + "…"
+            cost = estimate_tokens(item) + 1
+            if used + cost > self.news_tokens:
+                break
+            selected.append(item)
+            used += cost
+        return selected
+
+    @staticmethod
+    def round_fields(fields):
+        return {k: _round_number(v) for k, v in fields.items()}
+
+    def data_section(self, fields):
+        f = fields
+        return (f"Giá: {f['price']} (nguồn {f['source']}) | KL: {f['volume']}\n"
+                f"Tài chính: EPS={f['eps']}, P/E={f['pe']}, Vốn hóa={f['market_cap']}\n"
+                f"Kỹ thuật: RSI14={f['rsi_14']}, Trend={f['trend']}, EMA20={f['ema20']}, "
+                f"BB=[{f['bb_lower']} - {f['bb_upper']}], MACD={f['macd_line']}, Tín hiệu={f['signal']}")
+
+    def build(self, ticker, fields, raw_news):
+        """
+        -> {"messages", "fields", "news", "schema", "max_tokens", "tokens"}
+        `fields` / `news` are the budgeted inputs actually sent (also the AI cache key inputs).
+        """
+        fields = self.round_fields(fields)
+        news = self.select_news(raw_news)
+        data_str = self.data_section(fields)
+        news_str = "\n".join(news) if news else "(không có tin mới)"
+        user_prompt = f"PHÂN TÍCH SÂU MÃ {ticker}.\nDATA:\n{data_str}\nTIN TỨC:\n{news_str}\n\n{INSTRUCTIONS}"
+
+        tokens = {
+            "system": self.system_tokens,
+            "data": estimate_tokens(data_str),
+            "news": estimate_tokens(news_str),
+            "instructions": self.instruction_tokens
+        }
+        tokens["input"] = estimate_tokens(user_prompt) + self.system_tokens
+        return {
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "fields": fields,
+            "news": news,
+            "news_dropped": len(raw_news or []) - len(news),
+            "schema": self.schema,
+            "max_tokens": self.max_output_tokens,
+            "tokens": tokens
+        }
@@ -0,0 +1,233 @@
+"""
+Token-bucket rate limiting cho các upstream (theo host)
+- UpstreamLimiter: mỗi host một token bucket (NUKIDA_UPSTREAM_RATES) + semaphore giới hạn số request
+  đồng thời (NUKIDA_UPSTREAM_CONCURRENCY), dùng chung cho DataEngine, VNStockLite và AIEngine
+- Chờ quá hạn (NUKIDA_UPSTREAM_MAX_WAIT giây) -> UpstreamThrottled ngay, không xếp hàng thêm
+- Tác vụ nền có hạn chót riêng (scanner, prefetch) dùng admission_deadline(): chờ tới hạn đó thay vì
+  NUKIDA_UPSTREAM_MAX_WAIT
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from services.metrics import UPSTREAM_WAIT_SECONDS
+
+# "*" applies to hosts not listed
+DEFAULT_UPSTREAM_RATES = ("s.cafef.vn=8:16,cafef.vn=4:8,dchart-api.vndirect.com.vn=8:16,"
+                          "finfo-api.vndirect.com.vn=4:8,iboard-query.ssi.com.vn=4:8,"
+                          "query1.finance.yahoo.com=2:4,api.perplexity.ai=1:5,*=10:20")
+DEFAULT_UPSTREAM_CONCURRENCY = ("s.cafef.vn=6,cafef.vn=4,dchart-api.vndirect.com.vn=8,finfo-api.vndirect.com.vn=4,"
+                                "iboard-query.ssi.com.vn=4,query1.finance.yahoo.com=2,api.perplexity.ai=8,*=8")
+
+
+class UpstreamThrottled(requests.ConnectionError):
+    """Raised when a call could not be admitted to its host within the wait deadline"""
+
+
+# time.monotonic() deadline for admission waits of calls made in this context
+_admission_deadline = contextvars.ContextVar("nukida_admission_deadline", default=None)
+
+
+@contextmanager
+def admission_deadline(deadline):
+    """
+    Calls made inside the block wait for admission until `deadline` (time.monotonic()) instead of
+    NUKIDA_UPSTREAM_MAX_WAIT. Work handed to other threads keeps it only if run in a copied context.
+    """
+    token = _admission_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _admission_deadline.reset(token)
+
+
+class TokenBucket:
+    """`rate` tokens per second, bursts up to `burst`. Thread-safe."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.rejected = 0
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting at most `timeout` seconds (None = as long as needed). Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired += 1
+                    self.waited += now - started
+                    return True
+                wait = (1 - self._tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    self.rejected += 1
+                    return False
+            time.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "rejected": self.rejected,
+                "wait_total_s": round(self.waited, 3)
+            }
+
+
+def parse_rates(spec):
+    """'host=rate[:burst],host2=rate' -> {host: (rate, burst)}"""
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        host, value = item.split("=", 1)
+        rate, _, burst = value.partition(":")
+        rates[host.strip()] = (float(rate), float(burst) if burst else None)
+    return rates
+
+
+def parse_limits(spec):
+    """'host=n,host2=n' -> {host: n}"""
+    limits = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        host, value = item.split("=", 1)
+        limits[host.strip()] = int(value)
+    return limits
+
+
+class HostLimiter:
+    """Token bucket + concurrency slots for one host, with admission wait stats"""
+
+    def __init__(self, host, rate=None, burst=None, concurrency=None):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = concurrency or None
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_concurrency = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextmanager
+    def admit(self, max_wait):
+        """Hold one rate token + one slot for the duration of the block, or raise UpstreamThrottled"""
+        started = time.monotonic()
+        if self.bucket and not self.bucket.acquire(timeout=max_wait):
+            with self._lock:
+                self.rejected_rate += 1
+            UPSTREAM_WAIT_SECONDS.observe(time.monotonic() - started, self.host, "throttled")
+            raise UpstreamThrottled(f"{self.host}: rate limit {self.bucket.rate:g}/s, "
+                                    f"no token within {max_wait:g}s")
+        if self._slots and not self._slots.acquire(timeout=max(0.0, max_wait - (time.monotonic() - started))):
+            with self._lock:
+                self.rejected_concurrency += 1
+            UPSTREAM_WAIT_SECONDS.observe(time.monotonic() - started, self.host, "throttled")
+            raise UpstreamThrottled(f"{self.host}: {self.concurrency} concurrent requests in flight, "
+                                    f"no slot within {max_wait:g}s")
+        waited = time.monotonic() - started
+        UPSTREAM_WAIT_SECONDS.observe(waited, self.host, "admitted")
+        with self._lock:
+            self.admitted += 1
+            self.in_flight += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if self._slots:
+                self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.bucket.rate if self.bucket else None,
+                "burst": self.bucket.burst if self.bucket else None,
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "rejected_rate": self.rejected_rate,
+                "rejected_concurrency": self.rejected_concurrency,
+                "wait_avg_ms": round(self.wait_total / self.admitted * 1000, 2) if self.admitted else None,
+                "wait_max_ms": round(self.wait_max * 1000, 2)
+            }
+
+
+class UpstreamLimiter:
+    """Per-host HostLimiters, created on first use from the rate / concurrency specs ("*" = any other host)"""
+
+    def __init__(self, rates=None, concurrency=None, max_wait=None):
+        env = os.environ.get
+        self.enabled = env('NUKIDA_UPSTREAM_LIMITS', '1') != '0'
+        self.rates = parse_rates(rates or env('NUKIDA_UPSTREAM_RATES', DEFAULT_UPSTREAM_RATES))
+        self.concurrency = parse_limits(concurrency or env('NUKIDA_UPSTREAM_CONCURRENCY', DEFAULT_UPSTREAM_CONCURRENCY))
+        self.max_wait = max_wait if max_wait is not None else float(env('NUKIDA_UPSTREAM_MAX_WAIT', 3))
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def for_host(self, host):
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            with self._lock:
+                limiter = self._hosts.get(host)
+                if limiter is None:
+                    rate, burst = self.rates.get(host, self.rates.get("*", (None, None)))
+                    limiter = self._hosts[host] = HostLimiter(host, rate, burst, self.concurrency.get(host, self.concurrency.get("*")))
+        return limiter
+
+    @contextmanager
+    def admit(self, host, max_wait=None):
+        """
+        Admission for one call to `host`; waits at most `max_wait` seconds (default: until the
+        admission_deadline() in effect, else NUKIDA_UPSTREAM_MAX_WAIT)
+        """
+        if not self.enabled:
+            yield
+            return
+        if max_wait is None:
+            deadline = _admission_deadline.get()
+            max_wait = self.max_wait if deadline is None else max(0.0, deadline - time.monotonic())
+        with self.for_host(host).admit(max_wait):
+            yield
+
+    def stats(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: limiter.stats() for host, limiter in sorted(hosts.items())}
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter():
+    """Process-wide UpstreamLimiter: every engine shares the same per-host budget"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = UpstreamLimiter()
+        return _default_limiter
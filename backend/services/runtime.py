@@ -0,0 +1,144 @@
+"""
+Cold-start friendly engine holder dùng chung cho app.py và backend/main.py
+- Import module này rất nhẹ: DataEngine/AIEngine (requests, bs4, numpy...) chỉ được import
+  và khởi tạo ở lần truy cập đầu tiên
+- NUKIDA_EAGER_INIT=1: khởi tạo ngay khi import (hành vi cũ, hợp với server chạy lâu)
+- NUKIDA_WARMUP=1: khởi tạo + mở sẵn kết nối TLS tới các upstream trong thread nền
+- NUKIDA_PREFETCH=1: chạy prefetch scheduler trong phiên giao dịch (mặc định tắt; chỉ bật ở đúng một
+  process / host, vì mỗi worker gunicorn có DataEngine và scheduler riêng)
+"""
+import os
+import threading
+import time
+
+# Hosts whose TLS connections are worth opening before the first request
+WARMUP_TARGETS = (
+    ("data_engine", "session", "https://s.cafef.vn/"),
+    ("data_engine", "vnstock.session", "https://dchart-api.vndirect.com.vn/"),
+    ("ai_engine", "http.session", "https://api.perplexity.ai/"),
+)
+
+
+class Engines:
+    """Lazily built singletons: data_engine, ai_engine, analyzer, batch_analyzer, scanner, highlights"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = {}
+        self.build_times = {}
+        self.warmup_status = None
+
+    def _get(self, name, factory):
+        engine = self._built.get(name)
+        if engine is not None:
+            return engine
+        with self._lock:
+            if name not in self._built:
+                started = time.perf_counter()
+                self._built[name] = factory()
+                self.build_times[name] = round(time.perf_counter() - started, 4)
+                print(f"[Startup] {name} ready in {self.build_times[name] * 1000:.0f} ms")
+            return self._built[name]
+
+    @property
+    def data_engine(self):
+        def build():
+            from services.data_engine import DataEngine
+            return DataEngine()
+        return self._get("data_engine", build)
+
+    @property
+    def ai_engine(self):
+        def build():
+            from services.ai_engine import AIEngine
+            return AIEngine()
+        return self._get("ai_engine", build)
+
+    @property
+    def analyzer(self):
+        def build():
+            from services.analysis import Analyzer
+            return Analyzer(self.data_engine, self.ai_engine)
+        return self._get("analyzer", build)
+
+    @property
+    def batch_analyzer(self):
+        def build():
+            from services.analysis import BatchAnalyzer
+            return BatchAnalyzer(self.data_engine, self.ai_engine)
+        return self._get("batch_analyzer", build)
+
+    @property
+    def scanner(self):
+        def build():
+            from services.scanner import MarketScanner
+            return MarketScanner(self.data_engine)
+        return self._get("scanner", build)
+
+    @property
+    def highlights(self):
+        def build():
+            from services.highlights import HighlightsService
+            service = HighlightsService(self.data_engine)
+            # Long-running servers keep the snapshot warm; serverless relies on stale-while-revalidate
+            if os.environ.get('NUKIDA_HIGHLIGHTS_REFRESHER', '1') == '1':
+                service.start()
+            return service
+        return self._get("highlights", build)
+
+    @property
+    def prefetcher(self):
+        def build():
+            from services.prefetch import Prefetcher
+            return Prefetcher(self.data_engine)
+        return self._get("prefetcher", build)
+
+    def build_all(self):
+        for name in ("data_engine", "ai_engine", "analyzer", "batch_analyzer", "scanner", "highlights", "prefetcher"):
+            getattr(self, name)
+
+    def warmup(self):
+        """Build every engine, then open a keep-alive connection to each upstream host"""
+        started = time.perf_counter()
+        self.build_all()
+        connections = {}
+        for engine_name, path, url in WARMUP_TARGETS:
+            session = getattr(self, engine_name)
+            for attr in path.split("."):
+                session = getattr(session, attr)
+            t0 = time.perf_counter()
+            try:
+                # Any status will do: the point is the TCP + TLS handshake left in the pool
+                session.head(url, timeout=3, allow_redirects=False)
+                connections[url] = round(time.perf_counter() - t0, 3)
+            except Exception as e:
+                connections[url] = f"{type(e).__name__}"
+        self.warmup_status = {"seconds": round(time.perf_counter() - started, 3), "connections": connections}
+        print(f"[Startup] Warm-up done in {self.warmup_status['seconds']:.2f}s: {connections}")
+        return self.warmup_status
+
+    def start(self):
+        """Apply the startup mode from the environment (called once at server import)"""
+        if os.environ.get('NUKIDA_WARMUP', '0') == '1':
+            threading.Thread(target=self.warmup, name="Warmup", daemon=True).start()
+        elif os.environ.get('NUKIDA_EAGER_INIT', '0') == '1':
+            self.build_all()
+        # Trading-hours prefetch of hot tickers. Opt-in: every gunicorn worker would otherwise poll
+        # the same upstreams into its own cache
+        if os.environ.get('NUKIDA_PREFETCH', '0') == '1':
+            threading.Thread(target=lambda: self.prefetcher.start(), name="PrefetchStart", daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop the background threads of engines that were built (graceful server shutdown)"""
+        for name in ("prefetcher", "highlights"):
+            engine = self._built.get(name)
+            if engine is not None:
+                engine.stop()
+
+    def status(self):
+        return {
+            "built": sorted(self._built),
+            "build_times": dict(self.build_times),
+            "warmup": self.warmup_status
+        }
@@ -0,0 +1,352 @@
+"""
+Market scanner: quét toàn bộ cổ phiếu niêm yết (HOSE/HNX/UPCOM)
+1. Danh sách mã từ VNDirect finfo (dự phòng: rổ VN30)
+2. Lịch sử giá: bản trong MarketDataCache, nếu hết hạn thì đọc ngay từ bar store cục bộ và làm mới nền;
+   mã chưa từng tải thì chờ tối đa NUKIDA_SCAN_TIMEOUT giây (phần còn lại tiếp tục tải nền, báo "missing")
+3. Chỉ báo kỹ thuật + luật Trend/Signal tính một lần cho cả ma trận (mã x phiên)
+4. Lọc theo điều kiện người dùng, xếp hạng, trả về top kết quả
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import indicators
+from services.cache import MISSING
+from services.health import guarded_get
+from services.ratelimit import admission_deadline
+from services.singleflight import SingleFlight
+from services.vnstock_lite import VNStockLite
+
+UNIVERSE_URL = "https://finfo-api.vndirect.com.vn/v4/stocks"
+EXCHANGES = ("HOSE", "HNX", "UPCOM")
+
+VN30 = ("ACB", "BCM", "BID", "BVH", "CTG", "FPT", "GAS", "GVR", "HDB", "HPG",
+        "LPB", "MBB", "MSN", "MWG", "PLX", "SAB", "SHB", "SSB", "SSI", "STB",
+        "TCB", "TPB", "VCB", "VHM", "VIB", "VIC", "VJC", "VNM", "VPB", "VRE")
+
+# DChart prices are in thousand VND
+PRICE_UNIT = 1000
+
+# Ranking: setup quality first, then money flow (volume vs 20-session average) as tie-breaker
+SIGNAL_WEIGHTS = {
+    "MUA (HỖ TRỢ/QUÁ BÁN)": 3,
+    "MUA (THEO TREND)": 2,
+    "CHỜ": 1,
+    "BÁN (KHÁNG CỰ/QUÁ MUA)": 0
+}
+
+SORT_KEYS = ("score", "rsi_14", "change_pct", "volume_ratio", "volume", "price")
+MIN_BARS = 30
+
+
+def _round(v):
+    v = float(v)
+    return None if np.isnan(v) or np.isinf(v) else round(v, 2)
+
+
+def _number(params, key):
+    value = params.get(key)
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Giá trị không hợp lệ cho '{key}': {value}")
+
+
+def _names(params, key):
+    value = params.get(key)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(v).strip().upper() for v in value if str(v).strip()]
+
+
+def parse_filters(params):
+    """
+    User filters from query args or a JSON body. Raises ValueError on malformed values.
+    exchange, signal, trend: comma-separated (or list); signal/trend match by substring, e.g. signal=MUA
+    rsi_min/max, price_min/max (VND), change_min/max (%), volume_min (20-session average),
+    volume_ratio_min, above_ema20, sort, order (asc|desc), limit
+    """
+    params = params or {}
+    exchanges = _names(params, "exchange") or list(EXCHANGES)
+    unknown = [e for e in exchanges if e not in EXCHANGES]
+    if unknown:
+        raise ValueError(f"Sàn không hợp lệ: {', '.join(unknown)}")
+    sort = params.get("sort") or "score"
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort phải là một trong: {', '.join(SORT_KEYS)}")
+    limit = _number(params, "limit")
+    above = params.get("above_ema20")
+    return {
+        "exchanges": exchanges,
+        "signals": _names(params, "signal"),
+        "trends": _names(params, "trend"),
+        "rsi_min": _number(params, "rsi_min"),
+        "rsi_max": _number(params, "rsi_max"),
+        "price_min": _number(params, "price_min"),
+        "price_max": _number(params, "price_max"),
+        "change_min": _number(params, "change_min"),
+        "change_max": _number(params, "change_max"),
+        "volume_min": _number(params, "volume_min"),
+        "volume_ratio_min": _number(params, "volume_ratio_min"),
+        "above_ema20": None if above in (None, "") else str(above).lower() in ("1", "true", "yes"),
+        "sort": sort,
+        "ascending": str(params.get("order", "desc")).lower() == "asc",
+        "limit": int(min(max(limit or 50, 1), 500))
+    }
+
+
+class MarketScanner:
+    """Full-universe technical scan. Histories are shared with DataEngine through its MarketDataCache."""
+
+    def __init__(self, data_engine=None, vnstock=None, workers=None, timeout=None, universe_ttl=None):
+        env = os.environ.get
+        self.cache = data_engine.cache if data_engine is not None else None
+        self.workers = workers or int(env('NUKIDA_SCAN_WORKERS', 16))
+        self.timeout = timeout or float(env('NUKIDA_SCAN_TIMEOUT', 60))
+        # A full universe is ~1600 DChart calls: background refreshes get this long on the shared limiter
+        self.refresh_window = float(env('NUKIDA_SCAN_REFRESH_WINDOW', 600))
+        self.universe_ttl = universe_ttl or int(env('NUKIDA_SCAN_UNIVERSE_TTL', 24 * 3600))
+
+        self.vnstock = vnstock or VNStockLite()
+        # One keep-alive connection per worker instead of urllib3's default pool of 10
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+        self.vnstock.session.mount('https://', adapter)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': self.vnstock.session.headers['User-Agent']})
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Scanner")
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._universe = None
+        self._universe_expires = 0
+        self._refreshing = {}  # symbol -> future of its DChart load
+
+    # --- Universe ---
+    def universe(self):
+        """[{symbol, exchange}] of listed stocks; refreshed daily, VN30 if finfo is unreachable"""
+        with self._lock:
+            if self._universe and time.time() < self._universe_expires:
+                return self._universe
+        symbols = self._fetch_universe()
+        ttl = self.universe_ttl
+        if not symbols:
+            print("[Scanner] Universe fetch failed, falling back to VN30")
+            symbols = [{"symbol": s, "exchange": "HOSE"} for s in VN30]
+            ttl = 300
+        with self._lock:
+            self._universe = symbols
+            self._universe_expires = time.time() + ttl
+        return symbols
+
+    def _fetch_universe(self):
+        try:
+            r = guarded_get(self.session, UNIVERSE_URL, registry=self.vnstock.health, limiter=self.vnstock.limiter, timeout=10, params={
+                "q": "type:STOCK~status:LISTED~floor:" + ",".join(EXCHANGES),
+                "fields": "code,floor",
+                "size": 5000
+            })
+            if r.status_code != 200:
+                print(f"[Scanner] Universe HTTP {r.status_code}")
+                return []
+            items = r.json().get('data', [])
+        except (requests.RequestException, ValueError) as e:
+            print(f"[Scanner] Universe error: {e}")
+            return []
+        symbols = [{"symbol": item["code"].upper(), "exchange": item.get("floor", "").upper()}
+                   for item in items if item.get("code") and len(item["code"]) == 3]
+        print(f"[Scanner] Universe: {len(symbols)} symbols")
+        return symbols
+
+    # --- History ---
+    def _history(self, symbol, deadline):
+        # Own cache part: DataEngine's "history" can be a Yahoo/SSI fallback priced in VND, not PRICE_UNIT
+        loader = lambda: self.vnstock.get_bar_series(symbol)
+        # A cold universe needs far more DChart tokens than NUKIDA_UPSTREAM_MAX_WAIT allows for: wait on the
+        # shared limiter until the scan's own deadline instead
+        with admission_deadline(deadline):
+            if not self.cache:
+                return loader()
+            return self.cache.get_or_load("dchart_history", symbol, loader)
+
+    def _refresh(self, symbols):
+        """{future: symbol} of DChart loads for `symbols`, reusing loads already running in the background"""
+        deadline = time.monotonic() + self.refresh_window
+        futures = {}
+        with self._lock:
+            for s in symbols:
+                future = self._refreshing.get(s)
+                if future is None:
+                    future = self._refreshing[s] = self._executor.submit(self._history, s, deadline)
+                    future.add_done_callback(lambda f, s=s: self._refresh_done(s, f))
+                futures[future] = s
+        return futures
+
+    def _refresh_done(self, symbol, future):
+        with self._lock:
+            if self._refreshing.get(symbol) is future:
+                del self._refreshing[symbol]
+
+    def load_histories(self, symbols):
+        """
+        ({symbol: BarSeries}, {"stale": n, "missing": n}). Concurrent scans over the same universe share one load.
+        """
+        key = ",".join(symbols)
+        loaded, shared = self._flights.do(key, lambda: self._load(symbols))
+        if shared:
+            print(f"[Scanner] Joined in-flight load of {len(symbols)} symbols")
+        return loaded
+
+    def _load(self, symbols):
+        histories = {}
+        stale = []
+        cold = []
+        for s in symbols:
+            cached = self.cache.get("dchart_history", s) if self.cache else MISSING
+            if cached is not MISSING and cached:
+                histories[s] = cached
+                continue
+            stored = self.vnstock.stored_bar_series(s)
+            if stored:
+                histories[s] = stored
+                stale.append(s)
+            else:
+                cold.append(s)
+
+        # Never-loaded symbols first; the scan waits for them up to its deadline, not for the stale ones
+        futures = self._refresh(cold)
+        self._refresh(stale)
+        done, pending = wait(futures, timeout=self.timeout)
+        for future in done:
+            try:
+                history = future.result()
+            except Exception as e:
+                print(f"[Scanner] {futures[future]} failed: {e}")
+                continue
+            if history:
+                histories[futures[future]] = history
+        missing = len(symbols) - len(histories)
+        if stale or pending:
+            print(f"[Scanner] {len(stale)} symbols served from the bar store while refreshing, "
+                  f"{len(pending)} still loading after the {self.timeout:.0f}s deadline")
+        return histories, {"stale": len(stale), "missing": missing}
+
+    # --- Scan ---
+    def scan(self, filters=None):
+        started = time.perf_counter()
+        filters = filters or parse_filters({})
+        universe = [u for u in self.universe() if u["exchange"] in filters["exchanges"]]
+        exchange_of = {u["symbol"]: u["exchange"] for u in universe}
+        universe_elapsed = time.perf_counter() - started
+
+        load_started = time.perf_counter()
+        histories, load_stats = self.load_histories(sorted(exchange_of))
+        load_elapsed = time.perf_counter() - load_started
+
+        compute_started = time.perf_counter()
+        symbols = [s for s in sorted(histories) if len(histories[s]) >= MIN_BARS]
+        matches = self._evaluate(symbols, histories, exchange_of, filters) if symbols else []
+        compute_elapsed = time.perf_counter() - compute_started
+
+        print(f"[Scanner] {len(matches)} matches / {len(symbols)} scanned / {len(universe)} in universe "
+              f"(load={load_elapsed:.2f}s compute={compute_elapsed:.3f}s)")
+        return {
+            "universe": len(universe),
+            "loaded": len(histories),
+            # Symbols with no bars yet (still loading or failed): the scan covered only part of the universe
+            "missing": load_stats["missing"],
+            "partial": load_stats["missing"] > 0,
+            # Symbols scanned on bar-store data while their DChart refresh runs in the background
+            "stale": load_stats["stale"],
+            "scanned": len(symbols),
+            "matched": len(matches),
+            "results": matches[:filters["limit"]],
+            "timing": {
+                "universe": round(universe_elapsed, 3),
+                "load": round(load_elapsed, 3),
+                "compute": round(compute_elapsed, 3),
+                "total": round(time.perf_counter() - started, 3)
+            }
+        }
+
+    def _evaluate(self, symbols, histories, exchange_of, filters):
+        """Indicators, rules, filters and ranking as whole-array operations over all symbols"""
+        def column(key):
+            return indicators.stack([getattr(histories[s], key) for s in symbols])
+
+        close = column('close')
+        volume = column('volume')
+        ind = indicators.compute(close, column('high'), column('low'), volume)
+        last = indicators.last_values(ind)
+
+        price = last["close"] * PRICE_UNIT
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change_pct = (close[:, -1] / close[:, -2] - 1) * 100
+            volume_ratio = volume[:, -1] / last["vol_ma20"]
+        signal_weight = np.zeros(len(symbols))
+        for label, weight in SIGNAL_WEIGHTS.items():
+            signal_weight[last["signal"] == label] = weight
+        score = signal_weight + np.clip(np.nan_to_num(volume_ratio), 0, 3) / 3
+
+        mask = np.ones(len(symbols), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            for value, arr, op in (
+                (filters["rsi_min"], last["rsi_14"], np.greater_equal),
+                (filters["rsi_max"], last["rsi_14"], np.less_equal),
+                (filters["price_min"], price, np.greater_equal),
+                (filters["price_max"], price, np.less_equal),
+                (filters["change_min"], change_pct, np.greater_equal),
+                (filters["change_max"], change_pct, np.less_equal),
+                (filters["volume_min"], last["vol_ma20"], np.greater_equal),
+                (filters["volume_ratio_min"], volume_ratio, np.greater_equal),
+            ):
+                if value is not None:
+                    mask &= op(arr, value)
+            if filters["above_ema20"] is not None:
+                mask &= (last["close"] > last["ema20"]) == filters["above_ema20"]
+        if filters["signals"]:
+            mask &= self._label_match(last["signal"], filters["signals"])
+        if filters["trends"]:
+            mask &= self._label_match(last["trend"], filters["trends"])
+
+        columns = {
+            "score": score, "rsi_14": last["rsi_14"], "change_pct": change_pct,
+            "volume_ratio": volume_ratio, "volume": volume[:, -1], "price": price
+        }
+        key = np.nan_to_num(columns[filters["sort"]], nan=-np.inf if not filters["ascending"] else np.inf)
+        order = np.argsort(key if filters["ascending"] else -key, kind="stable")
+        idx = order[mask[order]]
+
+        return [{
+            "symbol": symbols[i],
+            "exchange": exchange_of.get(symbols[i]),
+            "price": _round(price[i]),
+            "change_pct": _round(change_pct[i]),
+            "volume": _round(volume[i, -1]),
+            "volume_ratio": _round(volume_ratio[i]),
+            "rsi_14": _round(last["rsi_14"][i]),
+            "ema20": _round(last["ema20"][i] * PRICE_UNIT),
+            "ema50": _round(last["ema50"][i] * PRICE_UNIT),
+            "bb_upper": _round(last["bb_upper"][i] * PRICE_UNIT),
+            "bb_lower": _round(last["bb_lower"][i] * PRICE_UNIT),
+            "trend": str(last["trend"][i]),
+            "signal": str(last["signal"][i]),
+            "score": _round(score[i])
+        } for i in idx]
+
+    @staticmethod
+    def _label_match(labels, wanted):
+        """Substring match against the Vietnamese labels, e.g. 'MUA' selects both buy setups"""
+        mask = np.zeros(len(labels), dtype=bool)
+        for label in np.unique(labels):
+            if any(w in label for w in wanted):
+                mask |= labels == label
+        return mask
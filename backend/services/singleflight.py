@@ -0,0 +1,155 @@
+"""
+Single-flight: gộp các request trùng khóa đang chạy đồng thời thành một lần tính toán
+- do(): một kết quả; stream(): một chuỗi sự kiện (SSE), follower nhận lại các sự kiện đã có rồi chờ tiếp
+- Follower chờ tối đa NUKIDA_FLIGHT_TIMEOUT giây, quá hạn -> FlightTimeout (leader treo không kéo theo tất cả)
+"""
+import os
+import threading
+import time
+
+
+class FlightTimeout(TimeoutError):
+    """A follower gave up waiting on the in-flight call it joined"""
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _Stream:
+    __slots__ = ("cond", "items", "done", "error", "waiters")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.items = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Concurrent callers with the same key wait on one shared execution of `fn`"""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or float(os.environ.get('NUKIDA_FLIGHT_TIMEOUT', 180))
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def _join(self, table, key, factory):
+        with self._lock:
+            call = table.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                return call, False
+            call = table[key] = factory()
+            self.executions += 1
+            return call, True
+
+    def _timed_out(self, key):
+        with self._lock:
+            self.timeouts += 1
+        return FlightTimeout(f"in-flight call for {key!r} did not finish within {self.timeout:g}s")
+
+    def do(self, key, fn):
+        """Returns (result, shared). `shared` is True for callers that joined an in-flight call."""
+        call, leader = self._join(self._calls, key, _Call)
+
+        if not leader:
+            if not call.event.wait(self.timeout):
+                raise self._timed_out(key)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stream(self, key, fn):
+        """
+        Iterate one shared run of the generator `fn()`: the leader drives it and records each item,
+        followers replay the items seen so far and then receive new ones as they arrive.
+        """
+        call, leader = self._join(self._streams, key, _Stream)
+        if leader:
+            yield from self._lead(key, call, fn)
+        else:
+            yield from self._follow(key, call)
+
+    def _lead(self, key, call, fn):
+        items = fn()
+        try:
+            for item in items:
+                with call.cond:
+                    call.items.append(item)
+                    call.cond.notify_all()
+                yield item
+        except GeneratorExit:
+            # The leader's client left: finish the run for the followers still reading it
+            with self._lock:
+                followers = call.waiters
+            if followers:
+                try:
+                    for item in items:
+                        with call.cond:
+                            call.items.append(item)
+                            call.cond.notify_all()
+                except Exception as e:
+                    call.error = e
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            with call.cond:
+                call.done = True
+                call.cond.notify_all()
+
+    def _follow(self, key, call):
+        deadline = time.monotonic() + self.timeout
+        i = 0
+        while True:
+            with call.cond:
+                while i >= len(call.items) and not call.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(key)
+                    call.cond.wait(remaining)
+                if i < len(call.items):
+                    item = call.items[i]
+                    i += 1
+                elif call.error is not None:
+                    raise call.error
+                else:
+                    return
+            yield item
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts
+            }
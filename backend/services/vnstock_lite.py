@@ -2,13 +2,23 @@
 Lightweight VN Stock API Wrapper
 Chỉ lấy dữ liệu history, không dùng vnstock (quá nặng cho Vercel)
 """
+import numpy as np
 import requests
 from datetime import datetime, timedelta
 
+from services.bar_store import get_default_store
+from services.bars import BarSeries
+from services.health import get_default_registry, guarded_get
+from services.ratelimit import get_default_limiter
+
 class VNStockLite:
     """Lightweight alternative to vnstock for Vercel deployment"""
     
-    def __init__(self):
+    def __init__(self, store=None, health=None, limiter=None):
+        # Local bar store: repeat calls only download bars newer than the last stored one
+        self.store = store if store is not None else get_default_store()
+        self.health = health or get_default_registry()
+        self.limiter = limiter or get_default_limiter()
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -18,7 +28,12 @@ class VNStockLite:
     def get_historical_data(self, symbol, start_date=None, end_date=None, resolution="1D", data_type="stock"):
         """
         Get historical price data for a symbol using VNDirect TradingView API (Most Stable)
+        Legacy format: list of dicts with dd/mm/yyyy dates.
         """
+        return self.get_bar_series(symbol, start_date, end_date, resolution, data_type).to_records()
+
+    def get_bar_series(self, symbol, start_date=None, end_date=None, resolution="1D", data_type="stock"):
+        """Same as get_historical_data but returns a columnar BarSeries (no per-bar dicts)"""
         symbol = symbol.upper()
         
         # Calculate timestamps
@@ -32,6 +47,51 @@ class VNStockLite:
         else:
             end_ts = int(datetime.strptime(end_date, '%Y-%m-%d').timestamp())
             
+        store = self.store
+        if store:
+            covered_from, last_ts = store.coverage(symbol, resolution)
+            # Incremental: the store already covers the window start, so only ask for bars from the
+            # last closed session before the newest stored one (which may still be revised) up to now
+            check = None
+            fetch_from = start_ts
+            if covered_from is not None and last_ts is not None and covered_from <= start_ts:
+                check = store.tail(symbol, resolution, 2)[0]
+                fetch_from = check[0]
+            fetched = self._fetch_dchart(symbol, resolution, fetch_from, end_ts)
+            if fetched and check is not None and not self._same_bar(fetched, check):
+                # DChart re-based past prices (dividend / split): stored bars are unadjusted now
+                print(f"[VNStockLite] {symbol} history was adjusted upstream, re-downloading the window")
+                full = self._fetch_dchart(symbol, resolution, start_ts, end_ts)
+                if full:
+                    store.replace(symbol, resolution, full.rows(), covered_from=start_ts)
+            elif fetched:
+                store.append(symbol, resolution, fetched.rows(), covered_from=fetch_from)
+            elif fetch_from != start_ts:
+                print(f"[VNStockLite] DChart refresh failed, serving stored bars for {symbol}")
+            return BarSeries.from_rows(store.read(symbol, resolution, start_ts, end_ts))
+
+        # VNDirect DChart returns chronological order (oldest first), which the UI chart expects
+        return self._fetch_dchart(symbol, resolution, start_ts, end_ts)
+
+    @staticmethod
+    def _same_bar(series, row):
+        """Whether `series` has the stored bar `row` unchanged (a missing bar proves nothing)"""
+        i = np.searchsorted(series.t, row[0])
+        if i >= len(series) or series.t[i] != row[0]:
+            return True
+        fetched = (series.open[i], series.high[i], series.low[i], series.close[i])
+        return bool(np.allclose(fetched, row[1:5], rtol=1e-6, equal_nan=True))
+
+    def stored_bar_series(self, symbol, resolution="1D", days=90):
+        """Bars of the default window already in the local store, without any upstream call (None if the store is off)"""
+        if not self.store:
+            return None
+        end_ts = int(datetime.now().timestamp())
+        start_ts = int((datetime.now() - timedelta(days=days)).timestamp())
+        return BarSeries.from_rows(self.store.read(symbol.upper(), resolution, start_ts, end_ts))
+
+    def _fetch_dchart(self, symbol, resolution, start_ts, end_ts):
+        """Columnar bars from VNDirect DChart"""
         # === SOURCE: VNDIRECT DCHART API (TradingView format) ===
         try:
             print(f"[VNStockLite] Fetching from VNDirect DChart: {symbol}")
@@ -53,44 +113,13 @@ class VNStockLite:
                 'Referer': 'https://dchart.vndirect.com.vn/'
             }
             
-            r = self.session.get(url, params=params, headers=headers, timeout=10)
+            r = guarded_get(self.session, url, registry=self.health, limiter=self.limiter, params=params, headers=headers, timeout=10)
             
             if r.status_code == 200:
                 data = r.json()
                 if data.get('s') == 'ok' and data.get('t'):
-                    history = []
-                    times = data['t']
-                    opens = data['o']
-                    highs = data['h']
-                    lows = data['l']
-                    closes = data['c']
-                    volumes = data['v']
-                    
-                    for i in range(len(times)):
-                        try:
-                            ts = times[i]
-                            d_obj = datetime.fromtimestamp(ts)
-                            date_str = d_obj.strftime('%d/%m/%Y')
-                            
-                            history.append({
-                                'date': date_str,
-                                'open': float(opens[i]),
-                                'high': float(highs[i]),
-                                'low': float(lows[i]),
-                                'close': float(closes[i]),
-                                'volume': float(volumes[i])
-                            })
-                        except: continue
-                        
-                    if history:
-                        # VNDirect DChart returns chronological order (oldest first)
-                        # We usually want newest last for chart plotting which is correct.
-                        # But some of my logic might expect newest first?
-                        # Actually data_engine expects list of dicts.
-                        # The UI chart expects chronological order.
-                        # So just return as is.
-                        return history
+                    return BarSeries.from_columns(data['t'], data['o'], data['h'], data['l'], data['c'], data['v'])
         except Exception as e:
             print(f"[VNStockLite] DChart failed: {e}")
             
-        return []
+        return BarSeries.empty()
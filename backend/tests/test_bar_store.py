@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from services.bar_store import BarStore
+from services.health import HealthRegistry
+from services.ratelimit import UpstreamLimiter
+from services.vnstock_lite import VNStockLite
+
+DAY = 86400
+
+
+class FakeDChart:
+    """Daily bars for the last 60 days; `factor` re-bases every price like a dividend adjustment"""
+
+    def __init__(self):
+        self.today = int(time.time()) // DAY * DAY
+        self.factor = 1.0
+        self.requests = []
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append((params["from"], params["to"]))
+        t = [ts for ts in range(self.today - 59 * DAY, self.today + 1, DAY) if params["from"] <= ts <= params["to"]]
+        c = [(10 + (ts - self.today) / DAY / 100) * self.factor for ts in t]
+        return _Response({"s": "ok", "t": t, "o": c, "h": c, "l": c, "c": c, "v": [1000] * len(t)})
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def lite(tmp_path):
+    client = VNStockLite(store=BarStore(str(tmp_path / "bars.sqlite3")), health=HealthRegistry(),
+                         limiter=UpstreamLimiter(rates="*=1000:1000"))
+    client.session = FakeDChart()
+    return client
+
+
+def test_incremental_refresh_round_trip(lite):
+    cold = lite.get_bar_series("HPG")
+    warm = lite.get_bar_series("HPG")
+
+    assert len(cold) == len(warm) == 60
+    assert warm.t.tolist() == cold.t.tolist()
+    assert warm.close.tolist() == cold.close.tolist()
+    first, second = lite.session.requests
+    # The warm call only asks from the last closed session before the newest stored bar
+    assert second[0] == cold.t[-2]
+    assert first[0] < second[0]
+    assert lite.stored_bar_series("HPG").t.tolist() == cold.t.tolist()
+
+
+def test_revised_last_bar_is_overwritten(lite):
+    lite.get_bar_series("HPG")
+    today = lite.session.today
+    lite.store.append("HPG", "1D", [(today, 1, 1, 1, 1, 1)], covered_from=today)
+    assert lite.stored_bar_series("HPG").close[-1] == 1
+
+    refreshed = lite.get_bar_series("HPG")
+    assert refreshed.close[-1] == pytest.approx(10)
+
+
+def test_upstream_adjustment_triggers_a_full_redownload(lite):
+    before = lite.get_bar_series("HPG")
+    lite.session.factor = 0.9
+    after = lite.get_bar_series("HPG")
+
+    assert len(after) == len(before)
+    assert after.close[0] == pytest.approx(before.close[0] * 0.9)
+    assert after.close[-1] == pytest.approx(before.close[-1] * 0.9)
+    # Incremental check, then the whole window again
+    assert len(lite.session.requests) == 3
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from services.health import CLOSED, HALF_OPEN, OPEN, HealthRegistry, UpstreamUnavailable
+
+HOST = "dchart-api.vndirect.com.vn"
+
+
+def _registry(**kwargs):
+    options = dict(window=20, failure_threshold=3, failure_rate=0.5, min_samples=10, cooldown=0.05)
+    options.update(kwargs)
+    return HealthRegistry(**options)
+
+
+def _state(registry):
+    return registry.snapshot()[HOST]["state"]
+
+
+def test_consecutive_failures_open_the_circuit():
+    registry = _registry()
+    for _ in range(3):
+        registry.record(HOST, False, 0.01, "Timeout")
+    assert _state(registry) == OPEN
+    assert not registry.allow(HOST)
+    with pytest.raises(UpstreamUnavailable):
+        with registry.track(HOST):
+            pass
+    assert registry.snapshot()[HOST]["skipped"] >= 2
+
+
+def test_half_open_lets_one_probe_through_then_closes_on_success():
+    registry = _registry()
+    for _ in range(3):
+        registry.record(HOST, False, 0.01, "Timeout")
+    time.sleep(0.06)
+
+    assert registry.allow(HOST)
+    assert _state(registry) == HALF_OPEN
+    assert not registry.allow(HOST)  # the probe is still out
+
+    registry.record(HOST, True, 0.01)
+    assert _state(registry) == CLOSED
+    assert registry.allow(HOST)
+
+
+def test_failed_probe_reopens_the_circuit():
+    registry = _registry()
+    for _ in range(3):
+        registry.record(HOST, False, 0.01, "Timeout")
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        with registry.track(HOST):
+            raise RuntimeError("still down")
+    assert _state(registry) == OPEN
+    assert registry.snapshot()[HOST]["trips"] == 2
+
+
+def test_recovery_starts_a_fresh_window():
+    # Trip on the failure rate, not on consecutive failures
+    registry = _registry(failure_threshold=100)
+    for _ in range(5):
+        registry.record(HOST, True, 0.01)
+        registry.record(HOST, False, 0.01, "http_503")
+    assert _state(registry) == OPEN
+    time.sleep(0.06)
+    registry.allow(HOST)
+    registry.record(HOST, True, 0.01)
+
+    # One failure after recovery must not re-trip on the failures from before the outage
+    registry.record(HOST, False, 0.01, "http_503")
+    assert _state(registry) == CLOSED
+    assert registry.snapshot()[HOST]["samples"] == 2
+
+
+def test_probe_fail_counts_as_failure():
+    registry = _registry()
+    for _ in range(3):
+        with registry.track(HOST) as probe:
+            probe.fail("http_429")
+    assert _state(registry) == OPEN
+    assert registry.snapshot()[HOST]["errors"] == {"http_429": 3}
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from services.ratelimit import TokenBucket, UpstreamLimiter, UpstreamThrottled, admission_deadline
+
+HOST = "dchart-api.vndirect.com.vn"
+
+
+@pytest.fixture(autouse=True)
+def limits_enabled(monkeypatch):
+    monkeypatch.delenv("NUKIDA_UPSTREAM_LIMITS", raising=False)
+
+
+def test_token_bucket_rejects_when_the_wait_exceeds_the_timeout():
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.acquire(timeout=0)
+    began = time.monotonic()
+    assert not bucket.acquire(timeout=0.1)
+    # Rejected up front: the next token is a full second away
+    assert time.monotonic() - began < 0.05
+    assert bucket.stats()["rejected"] == 1
+
+
+def test_admission_past_max_wait_raises_throttled():
+    limiter = UpstreamLimiter(rates=f"{HOST}=1:1", concurrency="*=4", max_wait=0.05)
+    with limiter.admit(HOST):
+        pass
+    with pytest.raises(UpstreamThrottled):
+        with limiter.admit(HOST):
+            pass
+    stats = limiter.stats()[HOST]
+    assert stats["admitted"] == 1
+    assert stats["rejected_rate"] == 1
+
+
+def test_admission_deadline_replaces_the_default_wait():
+    limiter = UpstreamLimiter(rates=f"{HOST}=10:1", concurrency="*=4", max_wait=0)
+    with limiter.admit(HOST):
+        pass
+    with pytest.raises(UpstreamThrottled):
+        with limiter.admit(HOST):
+            pass
+    # A background caller with its own deadline waits for the next token instead
+    with admission_deadline(time.monotonic() + 1):
+        with limiter.admit(HOST):
+            pass
+    # ...but not past that deadline
+    with admission_deadline(time.monotonic() + 0.01):
+        with pytest.raises(UpstreamThrottled):
+            with limiter.admit(HOST):
+                pass
+
+
+def test_concurrency_slots_are_held_for_the_call():
+    limiter = UpstreamLimiter(rates="*=1000:1000", concurrency=f"{HOST}=1", max_wait=0.05)
+    inside = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with limiter.admit(HOST):
+            inside.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    inside.wait(5)
+    with pytest.raises(UpstreamThrottled):
+        with limiter.admit(HOST):
+            pass
+    release.set()
+    holder.join(5)
+    with limiter.admit(HOST):
+        pass
+    assert limiter.stats()[HOST]["rejected_concurrency"] == 1
+
+
+def test_disabled_limiter_admits_everything(monkeypatch):
+    monkeypatch.setenv("NUKIDA_UPSTREAM_LIMITS", "0")
+    limiter = UpstreamLimiter(rates=f"{HOST}=1:1", max_wait=0)
+    for _ in range(5):
+        with limiter.admit(HOST):
+            pass
+    assert limiter.stats() == {}
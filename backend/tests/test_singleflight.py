@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from services.singleflight import FlightTimeout, SingleFlight
+
+
+def _run_concurrently(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    def caller():
+        results.append(flights.do("HPG", work))
+
+    threads = [threading.Thread(target=caller) for _ in range(5)]
+    for t in threads:
+        t.start()
+    while flights.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {value for value, _ in results} == {"value"}
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_leader_error_reaches_followers_and_key_is_released():
+    flights = SingleFlight()
+    started = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("upstream down")
+
+    def caller():
+        try:
+            flights.do("HPG", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    started.wait(5)
+    _run_concurrently(2, caller)
+    leader.join(5)
+
+    assert errors == ["upstream down"] * 3
+    assert flights.do("HPG", lambda: "fresh") == ("fresh", False)
+
+
+def test_follower_wait_is_bounded():
+    flights = SingleFlight(timeout=0.1)
+    started = threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("HPG", lambda: (started.set(), time.sleep(0.5))))
+    leader.start()
+    started.wait(5)
+
+    began = time.monotonic()
+    with pytest.raises(FlightTimeout):
+        flights.do("HPG", lambda: None)
+    assert time.monotonic() - began < 0.4
+    assert flights.stats()["timeouts"] == 1
+    leader.join(5)
+
+
+def test_stream_followers_replay_and_follow_the_leader():
+    flights = SingleFlight()
+    step = threading.Event()
+    runs = []
+
+    def events():
+        runs.append(1)
+        yield "snapshot"
+        step.wait(5)
+        yield "chart"
+        yield "done"
+
+    leader = flights.stream("HPG", events)
+    assert next(leader) == "snapshot"
+    got = []
+    follower = threading.Thread(target=lambda: got.extend(flights.stream("HPG", events)))
+    follower.start()
+    while flights.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    step.set()
+    assert list(leader) == ["chart", "done"]
+    follower.join(5)
+
+    assert runs == [1]
+    assert got == ["snapshot", "chart", "done"]
+
+
+def test_stream_finishes_for_followers_when_the_leader_leaves():
+    flights = SingleFlight()
+    step = threading.Event()
+
+    def events():
+        yield 1
+        step.wait(5)
+        yield 2
+        yield 3
+
+    leader = flights.stream("HPG", events)
+    next(leader)
+    got = []
+    follower = threading.Thread(target=lambda: got.extend(flights.stream("HPG", events)))
+    follower.start()
+    while flights.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    step.set()
+    leader.close()
+    follower.join(5)
+
+    assert got == [1, 2, 3]
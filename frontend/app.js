@@ -105,59 +105,92 @@ document.addEventListener('DOMContentLoaded', () => {
         terminalBody.scrollTop = terminalBody.scrollHeight;
     }
 
-    let simulationInterval;
-    function startSimulation(ticker) {
+    function openTerminal(ticker) {
         terminalBody.innerHTML = '';
         processTerminal.classList.remove('hidden');
         logToTerminal(`INITIATING ĐỘC GIÁ PROTOCOL FOR [${ticker}]...`, true);
-
-        const mainSteps = [
-            "Connecting to Market Data Exchange...",
-            "Fetching Real-time OHLCV Data...",
-            "Scanning Market Structure (Wyckoff Logic)...",
-            "Analyzing Volume Profiles & Order Flow...",
-            "Calculating Key Support/Resistance Levels..."
-        ];
-
-        let i = 0;
-        simulationInterval = setInterval(() => {
-            if (Math.random() > 0.4 && i < mainSteps.length) {
-                logToTerminal(mainSteps[i], true);
-                i++;
-            } else {
-                const hex = Math.random().toString(16).substr(2, 6).toUpperCase();
-                logToTerminal(`[SCAN] ADDR_0x${hex} ... OK`, false);
-            }
-        }, 300);
     }
 
-    function stopSimulation() {
-        clearInterval(simulationInterval);
+    // --- Streaming Analysis (Server-Sent Events over fetch POST) ---
+    async function streamAnalysis(ticker, onEvent) {
+        const response = await fetch('/api/analyze/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ticker, apiKey: apiKeyInput.value, chartFormat: 'compact' })
+        });
+        if (!response.ok || !response.body) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                let event = 'message';
+                let payload = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) payload += line.slice(5).trim();
+                }
+                if (payload) await onEvent(event, JSON.parse(payload));
+            }
+        }
     }
 
     // --- Scanner Implementation ---
+    let scanInFlight = null;
+
     function renderScanner() {
+        // One scan at a time; switching tabs again while it runs just waits for it
+        if (scanInFlight) return scanInFlight;
         const scannerGrid = document.getElementById('scannerGrid');
-        const mocks = [
-            { t: 'HPG', p: 28500, c: '+2.1%', r: 'Dòng tiền đột biến tại hỗ trợ cứng.' },
-            { t: 'SSI', p: 35200, c: '+1.5%', r: 'Cấu trúc tích lũy hướng lên (Ascending Triangle).' },
-            { t: 'VNM', p: 67800, c: '-0.2%', r: 'Đang kiểm định lại kênh giảm giá dài hạn.' },
-            { t: 'FPT', p: 112000, c: '+3.4%', r: 'Vượt đỉnh mọi thời đại với volume xác nhận.' }
-        ];
-
-        scannerGrid.innerHTML = mocks.map(m => `
-            <div class="scan-card" onclick="quickSearch('${m.t}')">
-                <div class="scan-head">
-                    <span class="scan-ticker">${m.t}</span>
-                    <span class="scan-price">${m.p.toLocaleString()}</span>
-                </div>
-                <p class="scan-reason">${m.r}</p>
-                <div class="scan-footer">
-                    <span>BIẾN ĐỘNG: <span style="color:${m.c.includes('+') ? '#00ff9d' : '#ff0055'}">${m.c}</span></span>
-                    <span style="color:var(--primary)">CHI TIẾT <i class="fa-solid fa-arrow-right"></i></span>
-                </div>
-            </div>
-        `).join('');
+        scannerGrid.innerHTML = '<div class="scanner-placeholder">Đang quét toàn thị trường...</div>';
+
+        scanInFlight = fetch('/api/scan?limit=24')
+            .then(async res => {
+                const data = await res.json();
+                if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+                return data;
+            })
+            .then(data => {
+                // Part of the universe is still loading: say so instead of presenting a partial scan as complete
+                const partialNote = data.partial
+                    ? `<div class="scanner-placeholder">Còn ${data.missing}/${data.universe} mã đang tải dữ liệu, quét lại sau ít phút để có kết quả đầy đủ.</div>`
+                    : '';
+                if (!data.results.length) {
+                    scannerGrid.innerHTML = (partialNote || '<div class="scanner-placeholder">Không có mã nào khớp bộ lọc.</div>');
+                    return;
+                }
+                scannerGrid.innerHTML = data.results.map(m => {
+                    const change = m.change_pct ?? 0;
+                    const changeText = `${change >= 0 ? '+' : ''}${change.toFixed(2)}%`;
+                    return `
+                    <div class="scan-card" onclick="quickSearch('${m.symbol}')">
+                        <div class="scan-head">
+                            <span class="scan-ticker">${m.symbol} <small>${m.exchange || ''}</small></span>
+                            <span class="scan-price">${(m.price || 0).toLocaleString()}</span>
+                        </div>
+                        <p class="scan-reason">${m.signal} · ${m.trend} · RSI ${m.rsi_14 ?? 'N/A'} · KL x${m.volume_ratio ?? 'N/A'} TB20</p>
+                        <div class="scan-footer">
+                            <span>BIẾN ĐỘNG: <span style="color:${change >= 0 ? '#00ff9d' : '#ff0055'}">${changeText}</span></span>
+                            <span style="color:var(--primary)">CHI TIẾT <i class="fa-solid fa-arrow-right"></i></span>
+                        </div>
+                    </div>`;
+                }).join('') + partialNote;
+            })
+            .catch(err => {
+                scannerGrid.innerHTML = `<div class="scanner-placeholder">Lỗi bộ lọc: ${err.message}</div>`;
+            })
+            .finally(() => { scanInFlight = null; });
+        return scanInFlight;
     }
 
     window.quickSearch = (ticker) => {
@@ -174,68 +207,84 @@ document.addEventListener('DOMContentLoaded', () => {
         analyzeBtn.disabled = true;
         emptyState.style.display = 'none';
         dashboardArea.classList.add('hidden');
-        startSimulation(ticker);
+        openTerminal(ticker);
+        const statusText = document.getElementById('statusText');
+        let aiChars = 0;
 
         try {
-            const response = await fetch('/api/analyze', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ ticker, apiKey: apiKeyInput.value })
-            });
-            const data = await response.json();
-            stopSimulation();
-
-            if (data.error) {
-                logToTerminal(`ERROR: ${data.error}`, true);
-                setTimeout(() => processTerminal.classList.add('hidden'), 2000);
-                return;
-            }
-
-            // Real data reveal
-            if (data.technicals) {
-                logToTerminal("--- REAL-TIME DATA SCAN ---", true);
-                logToTerminal(`PRICE: ${data.current_price.toLocaleString()}`);
-                logToTerminal(`RSI: ${data.technicals.rsi_14}`);
-                logToTerminal(`TREND: ${data.technicals.trend}`);
-            }
-
-            if (data.process_steps) {
-                logToTerminal("--- ĐỘC GIÁ STRATEGY ---", true);
-                for (let s of data.process_steps) {
-                    logToTerminal(s);
-                    await new Promise(r => setTimeout(r, 600));
+            await streamAnalysis(ticker, async (event, data) => {
+                if (event === 'stage') {
+                    logToTerminal(data.message, true);
+                } else if (event === 'snapshot') {
+                    logToTerminal(`SNAPSHOT: ${data.ticker} @ ${(data.price || 0).toLocaleString()} | VOL ${(data.volume || 0).toLocaleString()}`);
+                    renderFinancials(data.financials);
+                } else if (event === 'chart') {
+                    // Real data reveal: the chart is drawn before the AI has finished
+                    if (data.technicals) {
+                        logToTerminal("--- REAL-TIME DATA SCAN ---", true);
+                        logToTerminal(`PRICE: ${(data.current_price || 0).toLocaleString()}`);
+                        logToTerminal(`RSI: ${data.technicals.rsi_14}`);
+                        logToTerminal(`TREND: ${data.technicals.trend}`);
+                    }
+                    processTerminal.classList.add('hidden');
+                    renderMarketData(data);
+                    document.getElementById('actionBadge').textContent = 'ĐANG PHÂN TÍCH...';
+                } else if (event === 'news') {
+                    logToTerminal(`NEWS: ${(data.raw_news || []).length} tin mới nhất`);
+                } else if (event === 'token') {
+                    aiChars += data.text.length;
+                    statusText.textContent = `ĐỘC GIÁ ĐANG PHÂN TÍCH... ${aiChars} ký tự`;
+                } else if (event === 'result') {
+                    statusText.textContent = 'LIVE DATA FEED';
+                    renderDashboard(data);
+                } else if (event === 'error') {
+                    // Back to the terminal: a chart may already have revealed the dashboard
+                    dashboardArea.classList.add('hidden');
+                    document.getElementById('actionBadge').textContent = 'SẴN SÀNG';
+                    statusText.textContent = 'LIVE DATA FEED';
+                    processTerminal.classList.remove('hidden');
+                    logToTerminal(`ERROR: ${data.error}`, true);
                 }
-            }
-
-            logToTerminal("ANALYSIS COMPLETE. RENDERING...", true);
-            await new Promise(r => setTimeout(r, 800));
-            processTerminal.classList.add('hidden');
-
-            renderDashboard(data);
+            });
         } catch (e) {
+            processTerminal.classList.remove('hidden');
             logToTerminal(`SYSTEM ERROR: ${e.message}`, true);
         } finally {
             analyzeBtn.disabled = false;
         }
     });
 
-    function renderDashboard(data) {
+    function renderFinancials(fin) {
+        fin = fin || {};
+        document.getElementById('mMarketCap').textContent = fin.VonHoa || 'N/A';
+        document.getElementById('mPE').textContent = fin.PE || 'N/A';
+        document.getElementById('mEPS').textContent = fin.EPS || 'N/A';
+    }
+
+    // Compact chart_data (integer deltas, see BarSeries.to_compact) -> columnar arrays
+    function decodeChart(c) {
+        if (!c || c.encoding !== 'delta') return c;
+        const n = c.t.length;
+        const out = { t: new Array(n), open: new Array(n), high: new Array(n), low: new Array(n), close: new Array(n), volume: c.volume };
+        let t = 0, close = 0;
+        for (let i = 0; i < n; i++) {
+            t += c.t[i];
+            close += c.close[i];
+            out.t[i] = t;
+            out.close[i] = close / c.scale;
+            out.open[i] = (close + c.open[i]) / c.scale;
+            out.high[i] = (close + c.high[i]) / c.scale;
+            out.low[i] = (close + c.low[i]) / c.scale;
+        }
+        return out;
+    }
+
+    function renderMarketData(data) {
         dashboardArea.classList.remove('hidden');
         initChart();
 
-        // Header Metrics
         tickerSymbol.textContent = data.ticker;
-        currentPrice.textContent = data.current_price.toLocaleString();
-        priceChange.textContent = data.percent_change;
-        const isUp = !data.percent_change.includes('-');
-        currentPrice.style.color = isUp ? '#00ff9d' : '#ff0055';
-        priceChange.style.color = isUp ? '#00ff9d' : '#ff0055';
-
-        // Fast Metrics
-        const fin = data.financials || {};
-        document.getElementById('mMarketCap').textContent = fin.VonHoa || 'N/A';
-        document.getElementById('mPE').textContent = fin.PE || 'N/A';
-        document.getElementById('mEPS').textContent = fin.EPS || 'N/A';
+        currentPrice.textContent = (data.current_price || 0).toLocaleString();
         document.getElementById('mRSI').textContent = data.technicals?.rsi_14 || 'N/A';
 
         // Trend Badge
@@ -244,14 +293,28 @@ document.addEventListener('DOMContentLoaded', () => {
         trendBadge.className = 'trend-badge ' + (trend.includes('TĂNG') ? 'trend-bullish' : 'trend-bearish');
 
         // Chart
-        if (data.chart_data) {
-            const candles = data.chart_data.map(d => ({
-                time: formatDate(d.date),
-                open: d.open || d.close, high: d.high || d.close, low: d.low || d.close, close: d.close
-            })).sort((a, b) => a.time.localeCompare(b.time));
+        if (data.chart_data && data.chart_data.t) {
+            // Columnar bars: epoch-second timestamps, already in chronological order
+            const c = decodeChart(data.chart_data);
+            const candles = c.t.map((t, i) => ({
+                time: t,
+                open: c.open[i] || c.close[i], high: c.high[i] || c.close[i], low: c.low[i] || c.close[i], close: c.close[i]
+            }));
             candleSeries.setData(candles);
             chart.timeScale().fitContent();
         }
+    }
+
+    function renderDashboard(data) {
+        renderMarketData(data);
+        renderFinancials(data.financials);
+
+        // Header Metrics
+        priceChange.textContent = data.percent_change;
+        const isUp = !data.percent_change.includes('-');
+        currentPrice.style.color = isUp ? '#00ff9d' : '#ff0055';
+        priceChange.style.color = isUp ? '#00ff9d' : '#ff0055';
+
 
         // Beginner Report
         const b = data.beginner_report || {};
@@ -279,9 +342,4 @@ document.addEventListener('DOMContentLoaded', () => {
             </div>
         `).join('');
     }
-
-    function formatDate(str) {
-        const [d, m, y] = str.split('/');
-        return `${y}-${m}-${d}`;
-    }
 });